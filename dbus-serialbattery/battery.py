@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from typing import Union, Tuple, List, Dict, Callable
+from typing import Any, Union, Tuple, List, Dict, Callable
 
 from utils import logger
 import utils
@@ -216,6 +216,20 @@ class History:
         Total charged energy in Kilowatt-hour.
         """
 
+        self.changed: bool = False
+        """
+        Set to True, if a value changed since the history values were last saved to the dbus settings.
+        """
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        """
+        Set the changed flag, if a history value changes.
+        This avoids serializing and comparing all values to find out if they have to be saved.
+        """
+        if name != "changed" and getattr(self, name, None) != value:
+            object.__setattr__(self, "changed", True)
+        object.__setattr__(self, name, value)
+
     def reset_values(self, attributes: list = []) -> None:
         """
         Reset all calculated values that are not excluded.
@@ -270,9 +284,130 @@ class Cell:
     The balance status of a specific cell
     """
 
+    changes: int = 0
+    """
+    Counts the changes of voltage and balance status of all cells.
+    Used to know when the cell statistics have to be recalculated.
+    """
+
     def __init__(self, balance: bool = None):
         self.balance = balance
 
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name == "voltage" or name == "balance":
+            Cell.changes += 1
+        object.__setattr__(self, name, value)
+
+
+class CellStatistics:
+    """
+    This class holds the statistics of all cells, calculated in a single pass over the cells.
+
+    :param cells: list of cells
+    :param cell_count: number of cells of the battery
+    """
+
+    def __init__(self, cells: List[Cell], cell_count: int):
+        # cells that belong to the battery
+        cell_range = min(len(cells), cell_count) if cell_count is not None else 0
+
+        self.min_voltage: float = None
+        """
+        Lowest cell voltage of all cells
+        """
+
+        self.max_voltage: float = None
+        """
+        Highest cell voltage of all cells
+        """
+
+        self.min_cell: int = None
+        """
+        Index of the cell with the lowest voltage
+        """
+
+        self.max_cell: int = None
+        """
+        Index of the cell with the highest voltage
+        """
+
+        self.voltage_sum: float = 0
+        """
+        Sum of all cell voltages
+        """
+
+        self.mean_voltage: float = None
+        """
+        Mean of all cell voltages
+        """
+
+        self.stddev_voltage: float = None
+        """
+        Standard deviation of all cell voltages
+        """
+
+        self.half1_voltage_sum: float = 0
+        """
+        Sum of the cell voltages of the first half of the cells, the middle cell is not included
+        """
+
+        self.half2_voltage_sum: float = 0
+        """
+        Sum of the cell voltages of the second half of the cells, the middle cell is not included.
+        Like before, it also includes the cells beyond the cell count
+        """
+
+        self.balancing: int = 0
+        """
+        1 if any cell is balancing, else 0
+        """
+
+        half_count = cell_count // 2 if cell_count is not None else 0
+        half2_start = half_count + (cell_count % 2 if cell_count is not None else 0)
+        min_cell_voltage = 9999
+        max_cell_voltage = 0
+        voltage_count = 0
+        voltage_square_sum = 0
+
+        for index, cell in enumerate(cells):
+            voltage = cell.voltage
+
+            if voltage is not None:
+                if self.min_voltage is None or voltage < self.min_voltage:
+                    self.min_voltage = voltage
+                if self.max_voltage is None or voltage > self.max_voltage:
+                    self.max_voltage = voltage
+
+                # same as the slices cells[:half_count] and cells[half2_start:]
+                if index < half_count:
+                    self.half1_voltage_sum += voltage
+                elif index >= half2_start:
+                    self.half2_voltage_sum += voltage
+
+            # the following values only consider the cells that belong to the battery
+            if index >= cell_range:
+                continue
+
+            if voltage is not None:
+                if min_cell_voltage > voltage:
+                    min_cell_voltage = voltage
+                    self.min_cell = index
+                if max_cell_voltage < voltage:
+                    max_cell_voltage = voltage
+                    self.max_cell = index
+
+                if voltage:
+                    self.voltage_sum += voltage
+                    voltage_count += 1
+                    voltage_square_sum += voltage * voltage
+
+            if cell.balance:
+                self.balancing = 1
+
+        if voltage_count > 0:
+            self.mean_voltage = self.voltage_sum / voltage_count
+            self.stddev_voltage = math.sqrt(max(voltage_square_sum / voltage_count - self.mean_voltage * self.mean_voltage, 0))
+
 
 class Battery(ABC):
     """
@@ -286,10 +421,18 @@ class Battery(ABC):
         self.baud_rate: int = baud
         self.address: str = address
         self.can_transport_interface: object = None
+        self.can_subscription: object = None
+        """
+        Subscription to the CAN frames of this battery, see `get_can_message_cache()`
+        """
         self.role: str = "battery"
         self.type: str = "Generic"
         self.poll_interval: int = 1000
         self.dbus_external_objects: dict = None
+        self.dbus_external_sensor_signal: object = None
+        """
+        Signal receiver of the NameOwnerChanged signal, used to track the presence of the external sensor
+        """
         self.online: bool = True
         self.connection_info: str = "Initializing..."
         self.hardware_version: str = None
@@ -320,7 +463,19 @@ class Battery(ABC):
         self.control_allow_discharge: bool = None
 
         self.current_avg: float = None
-        self.current_avg_lst: list = []
+        self.cell_statistics: CellStatistics = None
+        """
+        Statistics of the cells, use `get_cell_statistics()` to get them up to date
+        """
+        self.cell_statistics_key: tuple = None
+        """
+        State of the cells when the statistics were calculated
+        """
+        self.current_avg_statistics: utils.RollingStatistics = utils.RollingStatistics(size=300, time_window=300)
+        """
+        Rolling statistics of the current used to calculate `current_avg`.
+        Limited to the last 300 values and 5 minutes, so the window doesn't depend on the poll interval.
+        """
         self.previous_current_avg: float = None
         self.current_external: float = None
         self.capacity_remain: float = None
@@ -367,6 +522,10 @@ class Battery(ABC):
         self.charge_charged: float = 0
         self.charge_discharged: float = 0
         self.charge_discharged_last: float = 0
+        self.charge_integrator: utils.ChargeIntegrator = None
+        """
+        Integrates the current at frame rate, if the driver adds the samples with `add_current_sample()`
+        """
 
         # Calculation of energy
         self.power_calc_last_time: int = None
@@ -500,6 +659,50 @@ class Battery(ABC):
         """
         self.can_transport_interface: object = can_transport_interface
 
+    def subscribe_can_frames(self, arbitration_ids: list = None, masks: list = None, timeouts: dict = None, callback: callable = None) -> None:
+        """
+        Subscribe to the CAN frames of this battery, so that only the frames of this battery have to be processed.
+        Only the first call subscribes, further calls are ignored.
+
+        :param arbitration_ids: list of arbitration IDs
+        :param masks: list of tuples (can_id, can_mask)
+        :param timeouts: dict with the arbitration ID as key and the maximum frame age in seconds as value
+        :param callback: function called with (arbitration_id, data, timestamp) from the receiver thread for each frame
+        :return: None
+        """
+        if self.can_subscription is None and self.can_transport_interface.can_subscribe_callback is not None:
+            self.can_subscription = self.can_transport_interface.can_subscribe_callback(
+                arbitration_ids=arbitration_ids, masks=masks, timeouts=timeouts, callback=callback
+            )
+
+    def get_can_message_cache(self, arbitration_ids: list = None, masks: list = None, timeouts: dict = None, callback: callable = None) -> dict:
+        """
+        Get the cached CAN frames of this battery. On the first call the battery subscribes to the given
+        arbitration IDs and masks, see `subscribe_can_frames()`.
+
+        :param arbitration_ids: list of arbitration IDs
+        :param masks: list of tuples (can_id, can_mask)
+        :param timeouts: dict with the arbitration ID as key and the maximum frame age in seconds as value
+        :param callback: function called with (arbitration_id, data, timestamp) from the receiver thread for each frame
+        :return: dict of received CAN messages with the arbitration ID as key
+        """
+        self.subscribe_can_frames(arbitration_ids=arbitration_ids, masks=masks, timeouts=timeouts, callback=callback)
+
+        if self.can_subscription is None:
+            return self.can_transport_interface.can_message_cache_callback()
+
+        return self.can_subscription.get_message_cache()
+
+    def unsubscribe_can_frames(self) -> None:
+        """
+        Remove the subscription to the CAN frames of this battery, e.g. if the connection test failed.
+
+        :return: None
+        """
+        if self.can_subscription is not None and self.can_transport_interface is not None:
+            self.can_transport_interface.can_unsubscribe_callback(self.can_subscription)
+        self.can_subscription = None
+
     @abstractmethod
     def get_settings(self) -> bool:
         """
@@ -582,9 +785,20 @@ class Battery(ABC):
 
         SOC_RESET_TIME = 60
 
+        # charge integrated at frame rate since the last calculation
+        charge_delta = None
+        if self.use_charge_integrator():
+            charged, discharged, _, _ = self.charge_integrator.get_delta("soc_calculation")
+            charge_delta = charged - discharged
+
         if self.soc_calc_capacity_remain is not None:
             # calculate remaining capacity based on current
-            self.soc_calc_capacity_remain = self.soc_calc_capacity_remain + self.current_calc * (current_time - self.soc_calc_capacity_remain_last_time) / 3600
+            if charge_delta is not None:
+                self.soc_calc_capacity_remain = self.soc_calc_capacity_remain + charge_delta
+            else:
+                self.soc_calc_capacity_remain = (
+                    self.soc_calc_capacity_remain + self.current_calc * (current_time - self.soc_calc_capacity_remain_last_time) / 3600
+                )
 
             # limit soc_calc_capacity_remain to capacity and zero
             # in case 100% is reached and the battery is not fully charged
@@ -1516,22 +1730,29 @@ class Battery(ABC):
             logger.error(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
             return self.max_battery_discharge_current
 
+    def get_cell_statistics(self) -> CellStatistics:
+        """
+        Get the statistics of the cells.
+        They are only recalculated, if a cell changed since the last call.
+
+        :return: The statistics of the cells
+        """
+        key = (Cell.changes, id(self.cells), len(self.cells), self.cell_count)
+        if self.cell_statistics is None or self.cell_statistics_key != key:
+            self.cell_statistics = CellStatistics(self.cells, self.cell_count)
+            self.cell_statistics_key = key
+        return self.cell_statistics
+
     def get_min_cell(self) -> int:
         """
         Get the cell with the lowest voltage.
 
         :return: The number of the cell with the lowest voltage
         """
-        min_voltage = 9999
-        min_cell = None
         if len(self.cells) == 0 and hasattr(self, "cell_min_no"):
             return self.cell_min_no
 
-        for c in range(min(len(self.cells), self.cell_count)):
-            if self.cells[c].voltage is not None and min_voltage > self.cells[c].voltage:
-                min_voltage = self.cells[c].voltage
-                min_cell = c
-        return min_cell
+        return self.get_cell_statistics().min_cell
 
     def get_max_cell(self) -> int:
         """
@@ -1539,16 +1760,10 @@ class Battery(ABC):
 
         :return: The number of the cell with the highest voltage
         """
-        max_voltage = 0
-        max_cell = None
         if len(self.cells) == 0 and hasattr(self, "cell_max_no"):
             return self.cell_max_no
 
-        for c in range(min(len(self.cells), self.cell_count)):
-            if self.cells[c].voltage is not None and max_voltage < self.cells[c].voltage:
-                max_voltage = self.cells[c].voltage
-                max_cell = c
-        return max_cell
+        return self.get_cell_statistics().max_cell
 
     def get_min_cell_desc(self) -> Union[str, None]:
         """
@@ -1585,12 +1800,7 @@ class Battery(ABC):
 
         :return: The sum of all cell voltages
         """
-        voltage_sum = 0
-        for i in range(self.cell_count):
-            voltage = self.get_cell_voltage(i)
-            if voltage:
-                voltage_sum += voltage
-        return voltage_sum
+        return self.get_cell_statistics().voltage_sum
 
     def get_cell_balancing(self, idx: int) -> Union[int, None]:
         """
@@ -1714,10 +1924,7 @@ class Battery(ABC):
             min_voltage = self.cell_min_voltage
 
         if min_voltage is None:
-            try:
-                min_voltage = min(c.voltage for c in self.cells if c.voltage is not None)
-            except ValueError:
-                pass
+            min_voltage = self.get_cell_statistics().min_voltage
         return min_voltage
 
     def get_max_cell_voltage(self) -> Union[float, None]:
@@ -1726,10 +1933,7 @@ class Battery(ABC):
             max_voltage = self.cell_max_voltage
 
         if max_voltage is None:
-            try:
-                max_voltage = max(c.voltage for c in self.cells if c.voltage is not None)
-            except ValueError:
-                pass
+            max_voltage = self.get_cell_statistics().max_voltage
         return max_voltage
 
     def get_midvoltage(self) -> Tuple[Union[float, None], Union[float, None]]:
@@ -1743,15 +1947,9 @@ class Battery(ABC):
             return None, None
 
         halfcount = int(math.floor(self.cell_count / 2))
-        uneven_cells_offset = self.cell_count % 2
-        half1voltage = 0
-        half2voltage = 0
-
-        try:
-            half1voltage = sum(cell.voltage for cell in self.cells[:halfcount] if cell.voltage is not None)
-            half2voltage = sum(cell.voltage for cell in self.cells[halfcount + uneven_cells_offset :] if cell.voltage is not None)
-        except ValueError:
-            pass
+        cell_statistics = self.get_cell_statistics()
+        half1voltage = cell_statistics.half1_voltage_sum
+        half2voltage = cell_statistics.half2_voltage_sum
 
         try:
             extra = 0 if self.cell_count % 2 == 0 else self.cells[halfcount].voltage / 2
@@ -1767,10 +1965,7 @@ class Battery(ABC):
             return None, None
 
     def get_balancing(self) -> int:
-        for c in range(min(len(self.cells), self.cell_count)):
-            if self.cells[c].balance is not None and self.cells[c].balance:
-                return 1
-        return 0
+        return self.get_cell_statistics().balancing
 
     def get_filtered_temperature_map(self) -> Dict[int, float]:
         """
@@ -1869,25 +2064,35 @@ class Battery(ABC):
 
     def setup_external_sensor(self) -> None:
         """
-        Setup external sensor and it's dbus items
+        Setup external sensor and it's dbus items.
+        The presence of the external sensor is tracked with the NameOwnerChanged signal, so the dbus
+        does not have to be polled. The dbus items cache the values and are updated by change signals.
         """
-        import dbus
-        import os
         from dbus.mainloop.glib import DBusGMainLoop
+        from dbushelper import get_bus
         from vedbus import VeDbusItemImport
 
         # setup external dbus paths
         try:
             DBusGMainLoop(set_as_default=True)
 
-            # connect to the sessionbus, on a CC GX the systembus is used
-            dbus_connection = dbus.SessionBus() if "DBUS_SESSION_BUS_ADDRESS" in os.environ else dbus.SystemBus()
+            # use the dbus connection shared by the driver, on a CC GX the systembus is used
+            dbus_connection = get_bus()
+
+            # track if the external sensor appears or disappears
+            if self.dbus_external_sensor_signal is None:
+                self.dbus_external_sensor_signal = dbus_connection.add_signal_receiver(
+                    self.external_sensor_name_owner_changed,
+                    signal_name="NameOwnerChanged",
+                    dbus_interface="org.freedesktop.DBus",
+                    arg0=utils.EXTERNAL_SENSOR_DBUS_DEVICE,
+                )
 
             # dictionary containing the different items
             dbus_objects = {}
 
             # check if the dbus service is available
-            is_present_in_vebus = utils.EXTERNAL_SENSOR_DBUS_DEVICE in dbus_connection.list_names()
+            is_present_in_vebus = dbus_connection.name_has_owner(utils.EXTERNAL_SENSOR_DBUS_DEVICE)
 
             if is_present_in_vebus:
 
@@ -1925,6 +2130,27 @@ class Battery(ABC):
             logger.error("Exception occurred: " + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}")
             logger.error("External current sensor setup failed, fallback to internal sensor")
 
+    def external_sensor_name_owner_changed(self, name: str, old_owner: str, new_owner: str) -> None:
+        """
+        Called by the NameOwnerChanged signal, when the external sensor appears or disappears on the dbus.
+
+        :param name: The dbus service name of the external sensor
+        :param old_owner: The unique name of the old owner, empty if the service appeared
+        :param new_owner: The unique name of the new owner, empty if the service disappeared
+        :return: None
+        """
+        # the external sensor was disconnected
+        if new_owner == "":
+            if self.dbus_external_objects is not None:
+                logger.error("External current sensor was disconnected, falling back to internal sensor")
+                self.dbus_external_objects = None
+
+        # the external sensor was connected or restarted
+        elif utils.EXTERNAL_SENSOR_DBUS_DEVICE is not None:
+            if self.dbus_external_objects is None:
+                logger.info("External current sensor was connected, switching to external sensor")
+            self.setup_external_sensor()
+
     def get_current(self) -> Union[float, None]:
         """
         Get the current, either from:
@@ -1935,8 +2161,15 @@ class Battery(ABC):
         """
         current_time = time()
 
+        # Use the charge integrated at frame rate
+        if self.use_charge_integrator():
+            charged, discharged, _, _ = self.charge_integrator.get_delta("current")
+            self.charge_charged += charged
+            self.charge_discharged += discharged
+            self.charge_discharged_last += discharged
+
         # Has to be calculated from last measurement until now
-        if self.current_calc is not None and self.current_calc_last_time is not None:
+        elif self.current_calc is not None and self.current_calc_last_time is not None:
             # Calculate charge based on the current from last measurement until now
             charge = self.current_calc / 3600 * (current_time - self.current_calc_last_time)
 
@@ -1973,6 +2206,38 @@ class Battery(ABC):
         self.current_calc_last_time = current_time
         return current
 
+    def add_current_sample(self, current: float, timestamp: float = None) -> None:
+        """
+        Add a current sample to the charge integrator as soon as it is received.
+        Drivers, which receive the current more often than they are polled, can call this
+        for each sample. Only used, if `CURRENT_INTEGRATION_AT_FRAME_RATE` is enabled.
+
+        :param current: The current reported by the BMS
+        :param timestamp: Monotonic timestamp of the sample, defaults to now
+        :return: None
+        """
+        if not utils.CURRENT_INTEGRATION_AT_FRAME_RATE:
+            return
+
+        if self.charge_integrator is None:
+            self.charge_integrator = utils.ChargeIntegrator()
+
+        if utils.CURRENT_CORRECTION:
+            current = utils.calc_linear_relationship(current, utils.CURRENT_REPORTED_BY_BMS, utils.CURRENT_MEASURED_BY_USER)
+
+        self.charge_integrator.add(current, self.voltage, timestamp)
+
+    def use_charge_integrator(self) -> bool:
+        """
+        Check if the charge integrated at frame rate can be used.
+        This is not the case, if the current is read from an external sensor.
+
+        :return: True if the charge integrator is used
+        """
+        return self.charge_integrator is not None and not (
+            self.dbus_external_objects is not None and "Current" in self.dbus_external_objects and self.dbus_external_objects["Current"] is not None
+        )
+
     def get_power(self) -> Union[float, None]:
         """
         Calculate the power from the current and voltage.
@@ -1981,8 +2246,14 @@ class Battery(ABC):
         """
         current_time = time()
 
+        # Use the energy integrated at frame rate
+        if self.use_charge_integrator():
+            _, _, energy_charged, energy_discharged = self.charge_integrator.get_delta("power")
+            self.energy_charged += energy_charged
+            self.energy_discharged += energy_discharged
+
         # Has to be calculated from last measurement until now
-        if self.power_calc is not None and self.power_calc_last_time is not None:
+        elif self.power_calc is not None and self.power_calc_last_time is not None:
             # Calculate energy based on the power from last measurement until now
             energy = self.power_calc / 3600 * (current_time - self.power_calc_last_time)
 
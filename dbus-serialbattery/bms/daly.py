@@ -6,7 +6,7 @@
 from battery import Battery, Cell
 from utils import (
     bytearray_to_string,
-    open_serial_port,
+    serial_port,
     logger,
     AUTO_RESET_SOC,
     BATTERY_CAPACITY,
@@ -81,7 +81,7 @@ class Daly(Battery):
         """
         result = False
         try:
-            with open_serial_port(self.port, self.baud_rate) as ser:
+            with serial_port(self.port, self.baud_rate) as ser:
                 result = self.read_status_data(ser)
                 # get first data to show in startup log, only if result is true
                 result = result and self.read_soc_data(ser)
@@ -115,9 +115,9 @@ class Daly(Battery):
     def refresh_data(self):
         result = False
 
-        # Open serial port to be used for all data reads instead of opening multiple times
+        # Use the serial port from the port pool for all data reads instead of opening it multiple times
         try:
-            with open_serial_port(self.port, self.baud_rate) as ser:
+            with serial_port(self.port, self.baud_rate) as ser:
                 result = self.read_soc_data(ser)
                 self.reset_soc = self.soc if self.soc else 0
                 if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
@@ -21,7 +21,8 @@ from utils import (
 from struct import unpack_from, pack_into
 from time import time
 import sys
-from can import Message, CanOperationError
+import threading
+from can import Message, CanError, CanOperationError
 from time import sleep
 
 
@@ -49,6 +50,21 @@ class Daly_Can(Battery):
         self.last_error_time = 0
         self.history.exclude_values_to_calculate = ["charge_cycles"]
 
+        # prebuild the request messages for this device address
+        self.request_messages = [
+            Message(arbitration_id=(self.CAN_FRAMES[command][0] & 0xFFFF00FF) | (self.device_address << 8), data=bytearray(8))
+            for command in self.REQUEST_COMMANDS
+        ]
+        self.settings_request_message = Message(
+            arbitration_id=(self.CAN_FRAMES[self.COMMAND_SETTINGS][0] & 0xFFFF00FF) | (self.device_address << 8), data=bytearray(8)
+        )
+        # subscribe to all response frames of this device address [Priority=18][Command=xx][Uplink ID=40][BMS ID]
+        self.response_masks = [(0x18004000 | self.device_address, 0xFF00FFFF)]
+        self.request_tasks = []
+        # period in seconds the periodic requests were scheduled with
+        self.request_period = None
+        self.response_received = threading.Event()
+
     COMMAND_BASE = "COMMAND_BASE"
     COMMAND_SOC = "COMMAND_SOC"
     COMMAND_MINMAX_CELL_VOLTS = "COMMAND_MINMAX_CELL_VOLTS"
@@ -99,6 +115,20 @@ class Daly_Can(Battery):
         RESPONSE_SETTINGS: [0x18504001],
     }
 
+    # commands requested on each poll
+    REQUEST_COMMANDS = [
+        COMMAND_SOC,
+        COMMAND_MINMAX_CELL_VOLTS,
+        COMMAND_MINMAX_TEMP,
+        COMMAND_FET,
+        COMMAND_STATUS,
+        COMMAND_CELL_VOLTS,
+        # unused
+        # COMMAND_TEMP,
+        COMMAND_CELL_BALANCE,
+        COMMAND_ALARM,
+    ]
+
     BATTERYTYPE = "Daly CAN"
     LENGTH_CHECK = 4
     LENGTH_POS = 3
@@ -145,21 +175,18 @@ class Daly_Can(Battery):
         # After successful connection get_settings() will be called to set up the battery
         # Set the current limits, populate cell count, etc
         # Return True if success, False for failure
-        data = bytearray(b"\x00\x00\x00\x00\x00\x00\x00\x00")
-
         if self.can_transport_interface.can_bus is None:
             raise RuntimeError("CAN Interface not initialised")
 
+        self.subscribe_can_frames(masks=self.response_masks, callback=self.can_frame_callback)
+
+        # the response is read with the next refresh_data()
         try:
-            message = Message(arbitration_id=(self.CAN_FRAMES[self.COMMAND_SETTINGS][0] & 0xFFFF00FF) | (self.device_address << 8), data=data)
-            self.can_transport_interface.can_bus.send(message, timeout=0.2)
+            self.can_transport_interface.can_bus.send(self.settings_request_message, timeout=0.2)
         except CanOperationError:
             logger.error("CAN Bus Error while sending data. Check cabeling")
 
         self.capacity = BATTERY_CAPACITY
-        sleep(0.1)
-
-        self.read_daly_can()
 
         return True
 
@@ -169,8 +196,12 @@ class Daly_Can(Battery):
         # Return True if success, False for failure
         self.reset_soc = self.soc if self.soc else 0
 
-        self.request_daly_can()
-        sleep(0.1)
+        if self.request_daly_can():
+            # wait for the responses of the current period, if they did not arrive since the last poll
+            self.response_received.wait(0.5)
+            self.response_received.clear()
+        else:
+            sleep(0.1)
 
         result = self.read_daly_can()
         self.write_soc()
@@ -179,35 +210,80 @@ class Daly_Can(Battery):
 
         return result
 
-    def request_daly_can(self):
-        data = bytearray(b"\x00\x00\x00\x00\x00\x00\x00\x00")
+    def request_daly_can(self) -> bool:
+        """
+        Request the data from the BMS. The requests are sent periodically by the kernel (SocketCAN BCM),
+        so they are scheduled only once and do not block the poll. If this is not supported by the
+        CAN interface, the requests are sent on each call.
 
+        :return: True if the requests are sent periodically
+        """
         if self.can_transport_interface.can_bus is None:
             raise RuntimeError("CAN Interface not initialised")
 
+        if len(self.request_tasks) > 0:
+            if self.request_period == self.poll_interval / 1000:
+                return True
+
+            # the poll interval was changed, e.g. increased automatically, so reschedule the requests with the new period
+            logger.debug(f"Poll interval changed, rescheduling the periodic requests with {self.poll_interval / 1000:.3f} s")
+            self.stop_requests()
+
+        self.subscribe_can_frames(masks=self.response_masks, callback=self.can_frame_callback)
+
+        # one task per message, since all messages of a task must have the same arbitration id
+        try:
+            self.request_period = self.poll_interval / 1000
+            for message in self.request_messages:
+                self.request_tasks.append(self.can_transport_interface.can_bus.send_periodic(message, self.request_period))
+            return True
+        except (NotImplementedError, CanError) as e:
+            logger.debug(f"Periodic sending failed, sending requests on each poll: {e}")
+            self.stop_requests()
+
         try:
-            message = Message(arbitration_id=(self.CAN_FRAMES[self.COMMAND_SOC][0] & 0xFFFF00FF) | (self.device_address << 8), data=data)
-            self.can_transport_interface.can_bus.send(message, timeout=0.2)
-            message = Message(arbitration_id=(self.CAN_FRAMES[self.COMMAND_MINMAX_CELL_VOLTS][0] & 0xFFFF00FF) | (self.device_address << 8), data=data)
-            self.can_transport_interface.can_bus.send(message, timeout=0.2)
-            message = Message(arbitration_id=(self.CAN_FRAMES[self.COMMAND_MINMAX_TEMP][0] & 0xFFFF00FF) | (self.device_address << 8), data=data)
-            self.can_transport_interface.can_bus.send(message, timeout=0.2)
-            message = Message(arbitration_id=(self.CAN_FRAMES[self.COMMAND_FET][0] & 0xFFFF00FF) | (self.device_address << 8), data=data)
-            self.can_transport_interface.can_bus.send(message, timeout=0.2)
-            message = Message(arbitration_id=(self.CAN_FRAMES[self.COMMAND_STATUS][0] & 0xFFFF00FF) | (self.device_address << 8), data=data)
-            self.can_transport_interface.can_bus.send(message, timeout=0.2)
-            message = Message(arbitration_id=(self.CAN_FRAMES[self.COMMAND_CELL_VOLTS][0] & 0xFFFF00FF) | (self.device_address << 8), data=data)
-            self.can_transport_interface.can_bus.send(message, timeout=0.2)
-            # unused
-            # message = Message(arbitration_id=(self.CAN_FRAMES[self.COMMAND_TEMP][0] & 0xffff00ff) | (self.device_address << 8), data=data)
-            # self.can_transport_interface.can_bus.send(message, timeout=0.2)
-            message = Message(arbitration_id=(self.CAN_FRAMES[self.COMMAND_CELL_BALANCE][0] & 0xFFFF00FF) | (self.device_address << 8), data=data)
-            self.can_transport_interface.can_bus.send(message, timeout=0.2)
-            message = Message(arbitration_id=(self.CAN_FRAMES[self.COMMAND_ALARM][0] & 0xFFFF00FF) | (self.device_address << 8), data=data)
-            self.can_transport_interface.can_bus.send(message, timeout=0.2)
+            for message in self.request_messages:
+                self.can_transport_interface.can_bus.send(message, timeout=0.2)
         except CanOperationError:
             logger.error("CAN Bus Error while sending data. Check cabeling")
 
+        return False
+
+    def can_frame_callback(self, arbitration_id: int, data: bytearray, timestamp: float) -> None:
+        """
+        Called from the CAN receiver thread for each received frame of this battery.
+        Signals that the responses to the requests arrived, the alarm response is the last one.
+
+        :param arbitration_id: arbitration ID of the CAN frame
+        :param data: data of the CAN frame
+        :param timestamp: monotonic receive time of the CAN frame
+        :return: None
+        """
+        if (arbitration_id & 0xFFFFFF00) + 1 in self.CAN_FRAMES[self.RESPONSE_ALARM]:
+            self.response_received.set()
+
+    def stop_requests(self) -> None:
+        """
+        Stop the periodic requests
+
+        :return: None
+        """
+        for task in self.request_tasks:
+            try:
+                task.stop()
+            except CanError as e:
+                logger.debug(f"Error while stopping periodic request: {e}")
+        self.request_tasks = []
+
+    def unsubscribe_can_frames(self) -> None:
+        """
+        Stop the periodic requests and remove the subscription, e.g. if the connection test failed.
+
+        :return: None
+        """
+        self.stop_requests()
+        super().unsubscribe_can_frames()
+
     def read_daly_can(self):
         try:
             # reset errors after timeout
@@ -223,7 +299,9 @@ class Daly_Can(Battery):
             crntMinValid = -(MAX_BATTERY_DISCHARGE_CURRENT * 2.1)
             crntMaxValid = MAX_BATTERY_CHARGE_CURRENT * 1.3
 
-            for frame_id, data in self.can_transport_interface.can_message_cache_callback().items():
+            can_message_cache = self.get_can_message_cache(masks=self.response_masks, callback=self.can_frame_callback)
+
+            for frame_id, data in can_message_cache.items():
                 if frame_id & 0xFF != self.device_address:  # check if id byte is matching
                     continue
                 normalized_arbitration_id = (frame_id & 0xFFFFFF00) + 1
@@ -8,7 +8,7 @@
 
 # avoid importing wildcards, remove unused imports
 from battery import Battery, Cell
-from utils import open_serial_port, logger
+from utils import serial_port, logger
 from time import sleep
 from struct import unpack
 from re import findall
@@ -71,7 +71,7 @@ class Daren485(Battery):
         """
         result = False
         try:
-            with open_serial_port(self.port, self.baud_rate) as ser:
+            with serial_port(self.port, self.baud_rate) as ser:
                 if ser:
                     if ser.is_open:
                         result = self.get_serial(ser)
@@ -111,7 +111,7 @@ class Daren485(Battery):
         """
         result = False
         try:
-            with open_serial_port(self.port, self.baud_rate) as ser:
+            with serial_port(self.port, self.baud_rate) as ser:
                 if ser:
                     if ser.is_open:
                         result = self.get_realtime_data(ser)
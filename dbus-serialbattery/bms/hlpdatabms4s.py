@@ -4,7 +4,7 @@
 # Updated by https://github.com/peterohman
 
 from battery import Battery, Cell
-from utils import logger
+from utils import logger, serial_port
 import serial
 from time import sleep
 import sys
@@ -218,7 +218,8 @@ class HLPdataBMS4S(Battery):
 
 def read_serial_data(command, port, baud, time, min_len):
     try:
-        with serial.Serial(port, baudrate=baud, timeout=2.5) as ser:
+        # the port is kept open in the port pool, it's only closed on a serial exception
+        with serial_port(port, baud, timeout=2.5) as ser:
             ret = read_serialport_data(ser, command, time, min_len)
         return ret
 
@@ -230,27 +231,23 @@ def read_serial_data(command, port, baud, time, min_len):
         return False
 
 
+# a serial exception is passed to the port pool, which closes the port, so it's reopened on the next read
 def read_serialport_data(ser, command, time, min_len):
-    try:
-        if min_len == 12:
-            ser.write(b"\n")
-            sleep(0.2)
-        cnt = 0
-        while cnt < 3:
-            cnt += 1
-            ser.flushOutput()
-            ser.flushInput()
-            ser.write(command)
-            sleep(time)
-            toread = ser.inWaiting()
-            res = ser.read(toread)
-            if len(res) >= min_len:
-                return res
-        return False
-
-    except serial.SerialException as e:
-        logger.error(e)
-        return False
+    if min_len == 12:
+        ser.write(b"\n")
+        sleep(0.2)
+    cnt = 0
+    while cnt < 3:
+        cnt += 1
+        ser.flushOutput()
+        ser.flushInput()
+        ser.write(command)
+        sleep(time)
+        toread = ser.inWaiting()
+        res = ser.read(toread)
+        if len(res) >= min_len:
+            return res
+    return False
 
 
 def get_par(p, s):
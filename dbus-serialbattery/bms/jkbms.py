@@ -5,7 +5,8 @@
 
 from battery import Battery, Cell
 from utils import bytearray_to_string, is_bit_set, read_serial_data, logger, ZERO_CHAR
-from struct import unpack_from
+from operator import itemgetter
+from struct import Struct, unpack_from
 from re import sub
 import sys
 
@@ -16,6 +17,10 @@ class Jkbms(Battery):
         self.type = self.BATTERYTYPE
         self.unique_identifier_tmp = ""
         self.history.exclude_values_to_calculate = ["charge_cycles"]
+        # unknown registers are reported only once
+        self.unknown_registers = set()
+        # register offsets of the last status data, reused as long as the layout does not change
+        self.status_index = None
 
     BATTERYTYPE = "JKBMS"
     LENGTH_CHECK = 1
@@ -28,6 +33,80 @@ class Jkbms(Battery):
     # to test with a RS485 adapter where the address can be set
     command_status = b"\x4e\x57\x00\x13\x00\x00\x00\x00\x06\x03\x00\x00\x00\x00\x00\x00\x68\x00\x00\x01\x29"
 
+    # registers of the status data with the format of their value
+    # 0x79 (cell voltages) has a variable length and is handled separately
+    STATUS_REGISTERS = {
+        0x80: Struct(">H"),  # MOSFET temperature
+        0x81: Struct(">H"),  # temperature sensor 1
+        0x82: Struct(">H"),  # temperature sensor 2
+        0x83: Struct(">H"),  # total voltage
+        0x84: Struct(">H"),  # current
+        0x85: Struct(">B"),  # SoC
+        0x86: Struct(">B"),  # number of temperature sensors
+        0x87: Struct(">H"),  # charge cycles
+        0x89: Struct(">L"),  # total charge cycle capacity
+        0x8A: Struct(">H"),  # cell count
+        0x8B: Struct(">H"),  # warnings
+        0x8C: Struct(">H"),  # status
+        0x8E: Struct(">H"),  # total overvoltage protection
+        0x8F: Struct(">H"),  # total undervoltage protection
+        0x90: Struct(">H"),  # cell overvoltage protection
+        0x91: Struct(">H"),  # cell overvoltage recovery
+        0x92: Struct(">H"),  # cell overvoltage protection delay
+        0x93: Struct(">H"),  # cell undervoltage protection
+        0x94: Struct(">H"),  # cell undervoltage recovery
+        0x95: Struct(">H"),  # cell undervoltage protection delay
+        0x96: Struct(">H"),  # cell voltage difference protection
+        0x97: Struct(">H"),  # continued discharge current
+        0x98: Struct(">H"),  # discharge overcurrent delay
+        0x99: Struct(">H"),  # continued charge current
+        0x9A: Struct(">H"),  # charge overcurrent delay
+        0x9B: Struct(">H"),  # balance start voltage
+        0x9C: Struct(">H"),  # balance trigger voltage difference
+        0x9D: Struct(">B"),  # active balance switch
+        0x9E: Struct(">H"),  # MOSFET temperature protection
+        0x9F: Struct(">H"),  # MOSFET temperature recovery
+        0xA0: Struct(">H"),  # battery temperature protection
+        0xA1: Struct(">H"),  # battery temperature recovery
+        0xA2: Struct(">H"),  # battery temperature difference protection
+        0xA3: Struct(">H"),  # charge high temperature protection
+        0xA4: Struct(">H"),  # discharge high temperature protection
+        0xA5: Struct(">H"),  # charge low temperature protection
+        0xA6: Struct(">H"),  # charge low temperature recovery
+        0xA7: Struct(">H"),  # discharge low temperature protection
+        0xA8: Struct(">H"),  # discharge low temperature recovery
+        0xA9: Struct(">B"),  # cell count setting
+        0xAA: Struct(">L"),  # capacity
+        0xAB: Struct(">B"),  # charge MOSFET switch
+        0xAC: Struct(">B"),  # discharge MOSFET switch
+        0xAD: Struct(">H"),  # current calibration
+        0xAE: Struct(">B"),  # BMS address
+        0xAF: Struct(">B"),  # battery type
+        0xB0: Struct(">H"),  # sleep waiting time
+        0xB1: Struct(">B"),  # low capacity alarm
+        0xB2: Struct(">10s"),  # parameter password
+        0xB3: Struct(">B"),  # dedicated charger switch
+        0xB4: Struct(">8s"),  # "User Private Data" field in APP
+        0xB5: Struct(">4s"),  # production date
+        0xB6: Struct(">L"),  # system working time
+        0xB7: Struct(">15s"),  # software version
+        0xB8: Struct(">B"),  # start current calibration
+        0xB9: Struct(">L"),  # actual battery capacity
+        0xBA: Struct(">24s"),  # manufacturer id
+        0xBB: Struct(">B"),  # restart system
+        0xBC: Struct(">B"),  # factory reset
+        0xBD: Struct(">B"),  # remote upgrade
+        0xBE: Struct(">H"),  # low voltage GPS shutdown
+        0xBF: Struct(">H"),  # low voltage GPS recovery
+        0xC0: Struct(">B"),  # protocol version
+    }
+
+    # registers needed to refresh the data
+    REQUIRED_REGISTERS = [0x79, 0x80, 0x81, 0x82, 0x83, 0x84, 0x85, 0x87, 0x8A, 0x8B, 0x8C, 0x97, 0x99, 0x9D, 0xAA, 0xB4, 0xB5, 0xB7, 0xBA]
+
+    # voltage of one cell, skipping the cell number
+    CELL_VOLTAGE = Struct(">xH")
+
     def test_connection(self):
         """
         call a function that will connect to the battery, send a command and retrieve the result.
@@ -79,13 +158,70 @@ class Jkbms(Battery):
         # Return True if success, False for failure
         return self.read_status_data()
 
-    def get_data(self, bytes, idcode, start, length):
-        # logger.debug("start "+str(start) + " length " + str(length))
-        # logger.debug(binascii.hexlify(bytearray(bytes[start:start + 1 + length])).decode('ascii'))
-        start = bytes.find(idcode, start, start + 1 + length)
-        if start < 0:
-            return False
-        return bytes[start + 1 : start + length + 1]
+    def index_status_data(self, status_data) -> dict:
+        """
+        Walk once over the registers of the status data and get the offsets of their values.
+        Every register is followed by its value, the length of the value depends on the register.
+        Unknown registers, e.g. from a newer firmware, are reported and end the walk, since the
+        length of their value and the offsets of all following registers are unknown.
+
+        :param status_data: the status data without header
+        :return: dict with the register as key and the offset of its value
+        """
+        registers = {}
+        offset = 1
+        while offset < len(status_data):
+            register = status_data[offset]
+            if register == 0x79:
+                # the first byte of the cell voltages is the number of bytes that follow
+                size = 1 + status_data[offset + 1] if offset + 1 < len(status_data) else 1
+            elif register in self.STATUS_REGISTERS:
+                size = self.STATUS_REGISTERS[register].size
+            else:
+                if register not in self.unknown_registers:
+                    self.unknown_registers.add(register)
+                    logger.warning(f"Unknown register 0x{register:02X} at offset {offset} in the status data, the following registers are ignored")
+                break
+
+            if offset + 1 + size > len(status_data):
+                logger.warning(f"Value of register 0x{register:02X} at offset {offset} exceeds the status data")
+                break
+
+            registers[register] = offset + 1
+            offset += 1 + size
+
+        return registers
+
+    def get_status_index(self, status_data) -> dict:
+        """
+        Get the offsets of the register values. The index of the last status data is reused, if the
+        length matches and the needed registers are still at the same positions, else it's rebuilt.
+
+        :param status_data: the status data without header
+        :return: dict with the register as key and the offset of its value
+        """
+        if self.status_index is not None:
+            length, registers, get_registers, required_registers = self.status_index
+            if len(status_data) == length and get_registers(status_data) == required_registers:
+                return registers
+
+        registers = self.index_status_data(status_data)
+        self.status_index = None
+        if all(register in registers for register in self.REQUIRED_REGISTERS):
+            get_registers = itemgetter(*[registers[register] - 1 for register in self.REQUIRED_REGISTERS])
+            self.status_index = (len(status_data), registers, get_registers, tuple(self.REQUIRED_REGISTERS))
+        return registers
+
+    def get_register(self, status_data, registers, register):
+        """
+        Get the value of an indexed register
+
+        :param status_data: the status data without header
+        :param registers: dict from index_status_data()
+        :param register: the register to get
+        :return: value of the register
+        """
+        return self.STATUS_REGISTERS[register].unpack_from(status_data, registers[register])[0]
 
     def read_status_data(self):
         status_data = self.read_serial_data_jkbms(self.command_status)
@@ -93,65 +229,62 @@ class Jkbms(Battery):
         if status_data is False:
             return False
 
+        registers = self.get_status_index(status_data)
+        missing_registers = [register for register in self.REQUIRED_REGISTERS if register not in registers]
+        if len(missing_registers) > 0:
+            logger.error("Registers missing in the status data: " + ", ".join(f"0x{register:02X}" for register in missing_registers))
+            return False
+
         # cell voltages
-        offset = 1
-        cellbyte_count = unpack_from(">B", self.get_data(status_data, b"\x79", offset, 1))[0]
+        cellbyte_count = status_data[registers[0x79]]
 
-        offset = cellbyte_count + 30
-        cell_count = unpack_from(">H", self.get_data(status_data, b"\x8a", offset, 2))[0]
+        cell_count = self.get_register(status_data, registers, 0x8A)
         # check if the cell count is valid
         if cell_count > 0:
             self.cell_count = cell_count
 
         if cellbyte_count == 3 * self.cell_count and self.cell_count == len(self.cells):
-            offset = 1
-            celldata = self.get_data(status_data, b"\x79", offset, 1 + cellbyte_count)
+            # the cells follow the number of bytes
+            offset = registers[0x79] + 1
 
             for c in range(self.cell_count):
-                cell_voltage = unpack_from(">xH", celldata, c * 3 + 1)[0] / 1000
+                cell_voltage = self.CELL_VOLTAGE.unpack_from(status_data, offset + c * 3)[0] / 1000
 
                 # check if the cell voltage is valid
                 if cell_voltage > 0:
                     self.cells[c].voltage = cell_voltage
 
         # MOSFET temperature
-        offset = cellbyte_count + 3
-        temperature_mos = unpack_from(">H", self.get_data(status_data, b"\x80", offset, 2))[0]
+        temperature_mos = self.get_register(status_data, registers, 0x80)
         # check if the mosfet temperature is valid
         if temperature_mos >= 0:
             self.to_temperature(0, temperature_mos if temperature_mos < 99 else (100 - temperature_mos))
 
         # Temperature sensors
-        offset = cellbyte_count + 6
-        temperature_1 = unpack_from(">H", self.get_data(status_data, b"\x81", offset, 2))[0]
+        temperature_1 = self.get_register(status_data, registers, 0x81)
         # check if the temperature is valid
         if temperature_1 >= 0:
             self.to_temperature(1, temperature_1 if temperature_1 < 99 else (100 - temperature_1))
 
-        offset = cellbyte_count + 9
-        temperature_2 = unpack_from(">H", self.get_data(status_data, b"\x82", offset, 2))[0]
+        temperature_2 = self.get_register(status_data, registers, 0x82)
         # check if the temperature is valid
         if temperature_2 >= 0:
             self.to_temperature(2, temperature_2 if temperature_2 < 99 else (100 - temperature_2))
 
-        offset = cellbyte_count + 12
-        voltage = unpack_from(">H", self.get_data(status_data, b"\x83", offset, 2))[0]
+        voltage = self.get_register(status_data, registers, 0x83)
         self.voltage = voltage / 100
 
-        offset = cellbyte_count + 15
-        current = unpack_from(">H", self.get_data(status_data, b"\x84", offset, 2))[0]
+        current = self.get_register(status_data, registers, 0x84)
         self.current = current / -100 if current < self.CURRENT_ZERO_CONSTANT else (current - self.CURRENT_ZERO_CONSTANT) / 100
 
         # Continued discharge current
-        offset = cellbyte_count + 66
-        max_battery_discharge_current = float(unpack_from(">H", self.get_data(status_data, b"\x97", offset, 2))[0])
+        max_battery_discharge_current = float(self.get_register(status_data, registers, 0x97))
         # check if the max discharge current is valid
         if max_battery_discharge_current >= 0:
             self.max_battery_discharge_current = max_battery_discharge_current
 
         # Continued charge current
-        offset = cellbyte_count + 72
-        max_battery_charge_current = float(unpack_from(">H", self.get_data(status_data, b"\x99", offset, 2))[0])
+        max_battery_charge_current = float(self.get_register(status_data, registers, 0x99))
         # check if the max charge current is valid
         if max_battery_charge_current >= 0:
             self.max_battery_charge_current = max_battery_charge_current
@@ -159,66 +292,57 @@ class Jkbms(Battery):
         # the JKBMS resets to
         # 95% SoC, if all cell voltages are above or equal to OVPR (Over Voltage Protection Recovery)
         # 100% Soc, if all cell voltages are above or equal to OVP (Over Voltage Protection)
-        offset = cellbyte_count + 18
-        soc = unpack_from(">B", self.get_data(status_data, b"\x85", offset, 1))[0]
+        soc = self.get_register(status_data, registers, 0x85)
         # check if the soc is valid
         if soc >= 0 and soc <= 100:
             self.soc = soc
 
-        offset = cellbyte_count + 22
-        charge_cycles = unpack_from(">H", self.get_data(status_data, b"\x87", offset, 2))[0]
+        charge_cycles = self.get_register(status_data, registers, 0x87)
         # check if the charge cycles are valid
         if charge_cycles >= 0:
             self.history.charge_cycles = charge_cycles
 
-        # offset = cellbyte_count + 25
-        # self.capacity_remain = unpack_from('>L', self.get_data(status_data, b'\x89', offset, 4))[0]
-        offset = cellbyte_count + 121
-        capacity = unpack_from(">L", self.get_data(status_data, b"\xaa", offset, 4))[0]
+        # self.capacity_remain = self.get_register(status_data, registers, 0x89)
+        capacity = self.get_register(status_data, registers, 0xAA)
         # check if the capacity is valid
         if capacity >= 0:
             self.capacity = capacity
 
-        offset = cellbyte_count + 33
-        self.to_protection_bits(unpack_from(">H", self.get_data(status_data, b"\x8b", offset, 2))[0])
+        self.to_protection_bits(self.get_register(status_data, registers, 0x8B))
 
-        offset = cellbyte_count + 36
-        self.to_fet_bits(unpack_from(">H", self.get_data(status_data, b"\x8c", offset, 2))[0])
+        self.to_fet_bits(self.get_register(status_data, registers, 0x8C))
 
-        offset = cellbyte_count + 84
-        self.to_balance_bits(unpack_from(">B", self.get_data(status_data, b"\x9d", offset, 1))[0])
+        self.to_balance_bits(self.get_register(status_data, registers, 0x9D))
 
         # "User Private Data" field in APP
-        offset = cellbyte_count + 155
         tmp = sub(
             " +",
             " ",
-            (unpack_from(">8s", self.get_data(status_data, b"\xb4", offset, 8))[0].decode().replace("\x00", " ").strip()),
+            (self.get_register(status_data, registers, 0xB4).decode().replace("\x00", " ").strip()),
         )
         self.custom_field = tmp if tmp != "Input Us" else None
 
         # production date
         try:
-            offset = cellbyte_count + 164
-            tmp = unpack_from(">4s", self.get_data(status_data, b"\xb5", offset, 4))[0].decode()
+            tmp = self.get_register(status_data, registers, 0xB5).decode()
             self.production = "20" + tmp + "01" if tmp and tmp != "" else None
         except UnicodeDecodeError:
             self.production = None
 
-        offset = cellbyte_count + 174
-        self.version = unpack_from(">15s", self.get_data(status_data, b"\xb7", offset, 15))[0].decode().replace("_", " ").strip()
+        self.version = self.get_register(status_data, registers, 0xB7).decode().replace("_", " ").strip()
 
-        offset = cellbyte_count + 197
         self.unique_identifier_tmp = sub(
             " +",
             "_",
-            (unpack_from(">24s", self.get_data(status_data, b"\xba", offset, 24))[0].decode().replace("\x00", " ").replace("Input Userda", "").strip()),
+            (self.get_register(status_data, registers, 0xBA).decode().replace("\x00", " ").replace("Input Userda", "").strip()),
         )
 
         # show wich cells are balancing
-        if self.get_min_cell() is not None and self.get_max_cell() is not None:
+        min_cell = self.get_min_cell()
+        max_cell = self.get_max_cell()
+        if min_cell is not None and max_cell is not None:
             for c in range(self.cell_count):
-                if self.balancing and (self.get_min_cell() == c or self.get_max_cell() == c):
+                if self.balancing and (min_cell == c or max_cell == c):
                     self.cells[c].balance = True
                 else:
                     self.cells[c].balance = False
@@ -8,7 +8,7 @@
 from battery import Battery, Cell
 from typing import Callable
 from utils import logger, AUTO_RESET_SOC, BLUETOOTH_FORCE_RESET_BLE_STACK, BLUETOOTH_USE_POLLING
-from utils_ble import restart_ble_hardware_and_bluez_driver
+from utils_ble import Ble_Hub
 from time import sleep, time
 from bms.jkbms_brn import Jkbms_Brn
 import os
@@ -269,7 +269,7 @@ class Jkbms_Ble(Battery):
             return False
 
     def reset_bluetooth(self):
-        restart_ble_hardware_and_bluez_driver()
+        Ble_Hub.reset_bluetooth()
 
     def get_balancing(self):
         return 1 if self.balancing else 0
@@ -277,7 +277,7 @@ class Jkbms_Ble(Battery):
     def trigger_soc_reset(self):
         if AUTO_RESET_SOC:
             self.jk.max_cell_voltage = self.get_max_cell_voltage()
-            self.jk.trigger_soc_reset = True
+            self.jk.trigger_soc_reset()
         return
 
     def disconnect(self):
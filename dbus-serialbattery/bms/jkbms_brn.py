@@ -5,7 +5,7 @@
 # https://github.com/Louisvdw/dbus-serialbattery/pull/372
 # Updated by https://github.com/mr-manuel
 
-from struct import unpack_from, calcsize
+from struct import Struct, calcsize, unpack_from
 from bleak import BleakScanner, BleakClient, exc
 from time import sleep, time
 import asyncio
@@ -25,6 +25,8 @@ if __name__ == "__main__":
 else:
     from utils import bytearray_to_string, logger
 
+from utils_ble import Ble_Hub, Ble_Session_Supervisor
+
 # zero means parse all incoming data (every second)
 CELL_INFO_REFRESH_S = 0
 CHAR_HANDLE = "0000ffe1-0000-1000-8000-00805f9b34fb"
@@ -123,6 +125,150 @@ TRANSLATE_CELL_INFO_32S = [
 ]
 
 
+class TranslationPlan:
+    """
+    Translation table compiled into a few precompiled structs, so that a frame is decoded with one
+    unpack_from() per struct instead of one per value. Values that overlap each other, e.g. the cell
+    arrays with the values behind them, are split into several structs.
+    """
+
+    def __init__(self, translations, f32s=False, cell_count=None):
+        """
+        :param translations: the translation table
+        :param f32s: if the frame is from a BMS with a max of 32 cells
+        :param cell_count: number of cell voltages to decode, defaults to the length in the translation table
+        """
+        # paths and list lengths of the dicts and lists the values are written to
+        self.containers = []
+        # list of (struct, outputs), outputs are (value index, container index, key, scale, is text)
+        self.structs = []
+
+        # values by offset and format, values with the same offset and format are unpacked once
+        values = {}
+        for translation in translations:
+            path = translation[0]
+            offset = translation[1]
+            if f32s:
+                if offset >= 112:
+                    offset += 32
+                elif offset >= 54:
+                    offset += 16
+
+            # keep things universal by using an n=1 list
+            if isinstance(path[-1], int):
+                length = cell_count if cell_count is not None and path[-2] == "voltages" else path[-1]
+                container = (tuple(path[:-1]), length)
+                keys = range(length)
+            else:
+                container = (tuple(path[:-1]), None)
+                keys = [path[-1]]
+
+            if container not in self.containers:
+                self.containers.append(container)
+            container_index = self.containers.index(container)
+
+            # only the first value of formats like "4?" is used, the rest is skipped
+            size = calcsize(translation[2])
+            code = translation[2].lstrip("<>!=@")
+            if not code.endswith("s"):
+                code = code[-1] + ("x" * (size - calcsize("<" + code[-1])))
+            scale = translation[3] if len(translation) == 4 and not code.endswith("s") else None
+
+            for key in keys:
+                values.setdefault((offset, size, code), []).append((container_index, key, scale, code.endswith("s")))
+                offset += size
+
+        # distribute the values to as few structs as possible, without overlapping values in one struct
+        layers = []
+        for offset, size, code in sorted(values):
+            for layer in layers:
+                if layer[-1][0] + layer[-1][1] <= offset:
+                    break
+            else:
+                layer = []
+                layers.append(layer)
+            layer.append((offset, size, code))
+
+        for layer in layers:
+            fmt = "<"
+            position = 0
+            outputs = []
+            for index, (offset, size, code) in enumerate(layer):
+                if offset > position:
+                    fmt += f"{offset - position}x"
+                fmt += code
+                position = offset + size
+                outputs.extend((index,) + output for output in values[(offset, size, code)])
+            self.structs.append((Struct(fmt), outputs))
+
+    def get_containers(self, o):
+        """
+        Get the dicts and lists the values are written to, missing ones are created
+
+        :param o: the dict with the decoded data
+        :return: list of containers
+        """
+        containers = []
+        for path, length in self.containers:
+            c = o
+            for key in path[:-1]:
+                if key not in c:
+                    c[key] = {}
+                c = c[key]
+            if path[-1] not in c:
+                c[path[-1]] = [None] * length if length is not None else {}
+            containers.append(c[path[-1]])
+        return containers
+
+    def translate(self, fb, o):
+        """
+        Decode the frame into the dict
+
+        :param fb: the frame buffer
+        :param o: the dict with the decoded data
+        """
+        containers = self.get_containers(o)
+        for struct, outputs in self.structs:
+            unpacked = struct.unpack_from(fb)
+            for index, container_index, key, scale, is_text in outputs:
+                val = unpacked[index]
+                if is_text:
+                    try:
+                        val = val.decode("utf-8").rstrip(" \t\n\r\0")
+                    except UnicodeDecodeError:
+                        val = ""
+                elif scale is not None:
+                    val = val * scale
+                containers[container_index][key] = val
+
+
+TRANSLATION_PLAN_DEVICE_INFO = TranslationPlan(TRANSLATE_DEVICE_INFO)
+TRANSLATION_PLAN_SETTINGS = TranslationPlan(TRANSLATE_SETTINGS)
+
+# compiled cell info translation plans by max cell count and cell count
+translation_plans_cell_info = {
+    (24, None): TranslationPlan(TRANSLATE_CELL_INFO_24S),
+    (32, None): TranslationPlan(TRANSLATE_CELL_INFO_32S, f32s=True),
+}
+
+
+def get_translation_plan_cell_info(max_cell_count, cell_count=None):
+    """
+    Get the compiled cell info translation plan, it's compiled only once for each combination
+
+    :param max_cell_count: max cell count of the BMS, 24 or 32
+    :param cell_count: number of cell voltages to decode, if known
+    :return: the translation plan
+    """
+    key = (max_cell_count, cell_count)
+    if key not in translation_plans_cell_info:
+        if max_cell_count == 32:
+            translation_plans_cell_info[key] = TranslationPlan(TRANSLATE_CELL_INFO_32S, f32s=True, cell_count=cell_count)
+        else:
+            translation_plans_cell_info[key] = TranslationPlan(TRANSLATE_CELL_INFO_24S, cell_count=cell_count)
+    return translation_plans_cell_info[key]
+
+
 class Jkbms_Brn:
     # entries for translating the bytearray to py-object via unpack
     # [[py dict entry as list, each entry ] ]
@@ -145,8 +291,11 @@ class Jkbms_Brn:
     # will be set by get_bms_max_cell_count()
     bms_max_cell_count = None
 
-    # translate info placeholder, since it depends on the bms_max_cell_count
-    translate_cell_info = []
+    # will be set by decode() after the settings were received
+    cell_count = None
+
+    # translation plan placeholder, since it depends on the bms_max_cell_count
+    translation_plan_cell_info = None
 
     def __init__(self, addr, reset_bt_callback=None):
         self.address = addr
@@ -154,8 +303,12 @@ class Jkbms_Brn:
         self.bt_thread_monitor = threading.Thread(target=self.monitor_scraping, name="Thread-JKBMS-Monitor")
         self.bt_reset = reset_bt_callback
         self.should_be_scraping = False
-        self.trigger_soc_reset = False
         self.bt_client = None
+        # every BMS needs its own buffer and data, if several are connected in one process
+        self.frame_buffer = bytearray()
+        self.bms_status = {}
+        # waits for the disconnect and runs the commands like the SOC reset
+        self.ble_session = Ble_Session_Supervisor(threading.current_thread())
         self.last_status = {"device_info": False, "cell_info": False, "settings": False}
 
     async def scanForDevices(self):
@@ -186,57 +339,16 @@ class Jkbms_Brn:
         # if BMS has a max of 32s the data at fb[287] is not empty
         if fb[287] > 0:
             self.bms_max_cell_count = 32
-            self.translate_cell_info = TRANSLATE_CELL_INFO_32S
         # if BMS has a max of 24s the data ends at fb[219]
         else:
             self.bms_max_cell_count = 24
-            self.translate_cell_info = TRANSLATE_CELL_INFO_24S
 
-        logger.debug(f"bms_max_cell_count recognized: {self.bms_max_cell_count}")
+        self.translation_plan_cell_info = get_translation_plan_cell_info(self.bms_max_cell_count, self.cell_count)
 
-    # iterative implementation maybe later due to referencing
-    def translate(self, fb, translation, o, f32s=False, i=0):
-        if i == len(translation[0]) - 1:
-            # keep things universal by using an n=1 list
-            keys = range(0, translation[0][i]) if isinstance(translation[0][i], int) else [translation[0][i]]
-            offset = 0
-            if f32s:
-                if translation[1] >= 112:
-                    offset = 32
-                elif translation[1] >= 54:
-                    offset = 16
-            i = 0
-            for j in keys:
-                if isinstance(translation[2], int):
-                    # handle raw bytes without unpack_from;
-                    # 3. param gives no format but number of bytes
-                    val = bytearray(fb[translation[1] + i + offset : translation[1] + i + translation[2] + offset])
-                    i += translation[2]
-                else:
-                    val = unpack_from(translation[2], bytearray(fb), translation[1] + i + offset)[0]
-                    # calculate stepping in case of array
-                    i = i + calcsize(translation[2])
-
-                if isinstance(val, bytes):
-                    try:
-                        val = val.decode("utf-8").rstrip(" \t\n\r\0")
-                    except UnicodeDecodeError:
-                        val = ""
-
-                elif isinstance(val, int) and len(translation) == 4:
-                    val = val * translation[3]
-                o[j] = val
-        else:
-            if translation[0][i] not in o:
-                if len(translation[0]) == i + 2 and isinstance(translation[0][i + 1], int):
-                    o[translation[0][i]] = [None] * translation[0][i + 1]
-                else:
-                    o[translation[0][i]] = {}
-
-            self.translate(fb, translation, o[translation[0][i]], f32s=f32s, i=i + 1)
+        logger.debug(f"bms_max_cell_count recognized: {self.bms_max_cell_count}")
 
     def decode_warnings(self, fb):
-        val = unpack_from("<H", bytearray(fb), 136)[0]
+        val = unpack_from("<H", fb, 136)[0]
 
         self.bms_status["cell_info"]["error_bitmask_16"] = hex(val)
         self.bms_status["cell_info"]["error_bitmask_2"] = format(val, "016b")
@@ -256,24 +368,18 @@ class Jkbms_Brn:
         # verified until here, rest is guesswork
 
     def decode_device_info_jk02(self):
-        fb = self.frame_buffer
-        for t in TRANSLATE_DEVICE_INFO:
-            self.translate(fb, t, self.bms_status)
+        TRANSLATION_PLAN_DEVICE_INFO.translate(self.frame_buffer, self.bms_status)
 
     def decode_cellinfo_jk02(self):
         fb = self.frame_buffer
-        has32s = self.bms_max_cell_count == 32
-        for t in self.translate_cell_info:
-            self.translate(fb, t, self.bms_status, f32s=has32s)
+        self.translation_plan_cell_info.translate(fb, self.bms_status)
         self.decode_warnings(fb)
         logger.debug("decode_cellinfo_jk02(): self.frame_buffer")
         logger.debug(self.frame_buffer)
         logger.debug(self.bms_status)
 
     def decode_settings_jk02(self):
-        fb = self.frame_buffer
-        for t in TRANSLATE_SETTINGS:
-            self.translate(fb, t, self.bms_status)
+        TRANSLATION_PLAN_SETTINGS.translate(self.frame_buffer, self.bms_status)
         logger.debug(self.bms_status)
 
     def decode(self):
@@ -284,11 +390,9 @@ class Jkbms_Brn:
             logger.info("Processing frame with settings info")
             if protocol_version == PROTOCOL_VERSION_JK02:
                 self.decode_settings_jk02()
-                # adapt translation table for cell array lengths
-                ccount = self.bms_status["settings"]["cell_count"]
-                for i, t in enumerate(self.translate_cell_info):
-                    if t[0][-2] == "voltages" or t[0][-2] == "voltages":
-                        self.translate_cell_info[i][0][-1] = ccount
+                # adapt translation plan for cell array lengths
+                self.cell_count = self.bms_status["settings"]["cell_count"]
+                self.translation_plan_cell_info = get_translation_plan_cell_info(self.bms_max_cell_count, self.cell_count)
                 self.bms_status["last_update"] = time()
 
         elif info_type == 0x02:
@@ -322,11 +426,11 @@ class Jkbms_Brn:
         logger.debug(self.frame_buffer)
         if len(self.frame_buffer) > MAX_RESPONSE_SIZE:
             logger.debug("data dropped because it alone was longer than max frame length")
-            self.frame_buffer = []
+            self.frame_buffer = bytearray()
 
         if data[0] == 0x55 and data[1] == 0xAA and data[2] == 0xEB and data[3] == 0x90:
             # beginning of new frame, clear buffer
-            self.frame_buffer = []
+            self.frame_buffer = bytearray()
 
         self.frame_buffer.extend(data)
 
@@ -341,7 +445,7 @@ class Jkbms_Brn:
             if ccrc == rcrc:
                 logger.debug("great success! frame complete and sane, lets decode")
                 self.decode()
-                self.frame_buffer = []
+                self.frame_buffer = bytearray()
                 if self._new_data_callback is not None:
                     self._new_data_callback()
 
@@ -442,19 +546,20 @@ class Jkbms_Brn:
             return None
 
     def connect_and_scrape(self):
-        asyncio.run(self.asy_connect_and_scrape())
+        Ble_Hub.run(self.asy_connect_and_scrape())
 
     # self.bt_thread
     async def asy_connect_and_scrape(self):
         logger.debug("--> asy_connect_and_scrape(): connect and scrape on address: " + self.address)
         self.run = True
         while self.run and self.main_thread.is_alive():  # autoreconnect
-            self.bt_client = BleakClient(self.address)
+            self.ble_session.start()
+            self.bt_client = BleakClient(self.address, disconnected_callback=self.ble_session.disconnected_callback)
             logger.debug("--> asy_connect_and_scrape(): btloop")
 
             try:
                 logger.info("|- Try to connect to Jkbms_Ble at " + self.address)
-                await self.bt_client.connect()  # default timeout 10s
+                await Ble_Hub.connect(self.bt_client)  # default timeout 10s
                 logger.info("|- Device connected, check if it's really a JKBMS")
 
                 # TODO: Sometimes settings data are received and sometimes not. Did not found yet found why.
@@ -478,11 +583,7 @@ class Jkbms_Brn:
 
                 await self.request_bt("cell_info", self.bt_client)
 
-                while self.bt_client.is_connected and self.run and self.main_thread.is_alive():
-                    if self.trigger_soc_reset:
-                        self.trigger_soc_reset = False
-                        await self.reset_soc_jk(self.bt_client)
-                    await asyncio.sleep(0.01)
+                await self.ble_session.run(self.bt_client, lambda: self.run)
 
             except exc.BleakDeviceNotFoundError:
                 logger.info(f"BLE client not found: {self.address} - is it turned on and nearby?")
@@ -533,6 +634,7 @@ class Jkbms_Brn:
 
     def start_scraping(self):
         self.main_thread = threading.current_thread()
+        self.ble_session.main_thread = self.main_thread
         if self.is_running():
             logger.debug("scraping thread already running")
             return
@@ -541,6 +643,7 @@ class Jkbms_Brn:
 
     def stop_scraping(self):
         self.run = False
+        self.ble_session.wakeup()
         self.should_be_scraping = False
         stop = time()
         while self.is_running():
@@ -569,6 +672,10 @@ class Jkbms_Brn:
         hexval = f"{intval:0>8X}"
         return bytearray.fromhex(hexval)[::-1]
 
+    def trigger_soc_reset(self):
+        # runs as soon as the BMS is connected
+        self.ble_session.submit(self.reset_soc_jk)
+
     async def reset_soc_jk(self, c):
         # Lowering OVPR / OVP based on the maximum cell voltage at the time
         # That will trigger a High Voltage Alert and resets SOC to 100%
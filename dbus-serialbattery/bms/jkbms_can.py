@@ -11,7 +11,7 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 from battery import Battery, Cell
-from utils import bytearray_to_string, logger
+from utils import bytearray_to_string, logger, CURRENT_INTEGRATION_AT_FRAME_RATE
 from struct import unpack_from
 from time import sleep, time
 import sys
@@ -70,6 +70,15 @@ class Jkbms_Can(Battery):
         BMS_CHG_INFO: [0x1806E5F4],
     }
 
+    # maximum age of the frames in seconds, older frames are ignored
+    # BATT_STAT is sent every 20ms, the others every 100ms. All other frames expire after 5 seconds
+    CAN_FRAME_TIMEOUTS = {
+        BATT_STAT: 0.2,
+        BATT_STAT_EXT: 1,
+        ALM_INFO: 1,
+        CELL_VOLT: 1,
+    }
+
     def connection_name(self) -> str:
         return f"CAN socketcan:{self.port}" + (f"__{self.device_address}" if self.device_address != 0 else "")
 
@@ -184,6 +193,20 @@ class Jkbms_Can(Battery):
                 self.cells[i].voltage = cell_voltage
         self.voltage = self.get_cell_voltage_sum()
 
+    def can_frame_callback(self, arbitration_id: int, data: bytearray, timestamp: float) -> None:
+        """
+        Called from the CAN receiver thread for each received frame of this battery.
+        Integrates the current of each BATT_STAT frame (sent every 20ms) and not only the last one of each poll.
+
+        :param arbitration_id: arbitration ID of the CAN frame
+        :param data: data of the CAN frame
+        :param timestamp: monotonic receive time of the CAN frame
+        :return: None
+        """
+        if arbitration_id + self.device_address in self.CAN_FRAMES[self.BATT_STAT]:
+            current = unpack_from("<H", data, 2)[0]
+            self.add_current_sample((current / 10) - 400, timestamp)
+
     def read_jkbms_can(self):
         # reset errors after timeout
         # timeout is 300 seconds, to prevent notification spam
@@ -194,7 +217,14 @@ class Jkbms_Can(Battery):
         # check if all needed data is available
         data_check = 0
 
-        for frame_id, data in self.can_transport_interface.can_message_cache_callback().items():
+        # subscribe only to the frames sent by this device address
+        can_message_cache = self.get_can_message_cache(
+            arbitration_ids=[frame_id - self.device_address for frame_ids in self.CAN_FRAMES.values() for frame_id in frame_ids],
+            timeouts={frame_id - self.device_address: timeout for frame, timeout in self.CAN_FRAME_TIMEOUTS.items() for frame_id in self.CAN_FRAMES[frame]},
+            callback=self.can_frame_callback if CURRENT_INTEGRATION_AT_FRAME_RATE else None,
+        )
+
+        for frame_id, data in can_message_cache.items():
             normalized_arbitration_id = frame_id + self.device_address
 
             # Frame is send every 20ms
@@ -14,6 +14,7 @@ import asyncio
 from bleak import BleakClient
 from time import time
 from utils import logger
+from utils_ble import Ble_Hub, Ble_Session_Supervisor
 from typing import Optional
 
 
@@ -37,6 +38,8 @@ class Kilovault_Ble(Battery):
         self.bt_thread = threading.Thread(name="Kilovault_Ble_Loop", target=self.background_loop, daemon=True)
         self.client: Optional[BleakClient] = None
         self.run = True
+        # waits for the disconnect or the end of the notifications
+        self.ble_session = Ble_Session_Supervisor(self.main_thread)
 
         # This is the BLE address for the battery
         self.address = address
@@ -74,7 +77,10 @@ class Kilovault_Ble(Battery):
         logger.info(f"Starting connection to {self.address}")
         try:
 
-            async with BleakClient(self.address) as client:
+            self.ble_session.start()
+            client = BleakClient(self.address, disconnected_callback=self.ble_session.disconnected_callback)
+            await Ble_Hub.connect(client)
+            try:
                 self.client = client
                 # register a callback to stop notifications
                 atexit.register(self.stop_notifications_and_disconnect)
@@ -88,8 +94,9 @@ class Kilovault_Ble(Battery):
                 # turn on notifications.  Data is sent to notifyCallback
                 await self.client.start_notify(self.notifyService, self.notifyCallback)
                 logger.info(f"Connected to {self.address}")
-                while self.run and self.main_thread.is_alive() and time() - self.lastUpdateTime < 10:
-                    await asyncio.sleep(0.1)
+                await self.ble_session.run(client, lambda: self.run and time() - self.lastUpdateTime < 10)
+            finally:
+                await client.disconnect()
             logger.info(f"Disconnected from {self.address}")
             logger.info(f"self.run: {self.run}")
             return True
@@ -106,13 +113,19 @@ class Kilovault_Ble(Battery):
 
     def stop_notifications_and_disconnect(self):
         logger.info("Stopping notifications and disconnecting")
+        self.disconnect()
+        if self.bt_thread.is_alive():
+            self.bt_thread.join()
+
+    # stops reconnecting and disconnects from the battery, without waiting for the worker thread
+    def disconnect(self):
         self.run = False
-        self.bt_thread.join()
+        self.ble_session.wakeup()
 
     # this is the body of the worker thread loop.  It just tries to stay connected to the battery
     def background_loop(self):
         while self.run and self.main_thread.is_alive():
-            asyncio.run(self.connection_thread())
+            Ble_Hub.run(self.connection_thread())
 
     # this is called for each frame from the BMS.  We assemble
     # the frames until we get a full status block.  Status
@@ -202,11 +215,13 @@ class Kilovault_Ble(Battery):
     def test_connection(self):
         result = False
         try:
-            loop = asyncio.get_event_loop()
-            loop.run_until_complete(self.async_test_connection())
+            asyncio.run(self.async_test_connection())
             # wait for the first notification to be complete
-            self.valid_data_event.wait()
-            result = True
+            # the connection may have to wait for other batteries in hub mode
+            if self.valid_data_event.wait(timeout=30):
+                result = True
+            else:
+                logger.error(f"No data received from {self.address}")
         except Exception:
             (
                 exception_type,
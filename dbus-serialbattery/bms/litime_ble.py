@@ -43,6 +43,10 @@ class LiTime_Ble(Battery):
     def unique_identifier(self) -> str:
         return self.address
 
+    def disconnect(self):
+        if self.ble_handle is not None:
+            self.ble_handle.stop()
+
     def connection_name(self) -> str:
         return "BLE " + self.address
 
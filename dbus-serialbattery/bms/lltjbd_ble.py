@@ -14,7 +14,7 @@ from asyncio import CancelledError
 from time import sleep
 from typing import Union, Optional
 from utils import logger, BLUETOOTH_FORCE_RESET_BLE_STACK
-from utils_ble import restart_ble_hardware_and_bluez_driver
+from utils_ble import Ble_Hub, Ble_Session_Supervisor
 from bleak import BleakClient, BleakScanner, BLEDevice
 from bleak.exc import BleakDBusError
 from bms.lltjbd import LltJbdProtection, LltJbd
@@ -44,6 +44,8 @@ class LltJbd_Ble(LltJbd):
         self.device: Optional[BLEDevice] = None
         self.response_queue: Optional[asyncio.Queue] = None
         self.ready_event: Optional[asyncio.Event] = None
+        # waits for the disconnect of the BLE client
+        self.ble_session = Ble_Session_Supervisor(self.main_thread)
 
         self.hci_uart_ok = True
         if not os.path.isfile("/tmp/dbus-blebattery-hciattach"):
@@ -69,6 +71,7 @@ class LltJbd_Ble(LltJbd):
 
     def on_disconnect(self, client):
         logger.info("BLE client disconnected")
+        self.ble_session.disconnected_callback(client)
 
     async def bt_main_loop(self):
         logger.info("|- Try to connect to LltJbd_Ble at " + self.address)
@@ -86,22 +89,26 @@ class LltJbd_Ble(LltJbd):
 
             self.device = None
             await asyncio.sleep(0.5)
-            # allow the bluetooth connection to recover
-            sleep(5)
+            # allow the bluetooth connection to recover, without blocking the event loop
+            await asyncio.sleep(5)
 
         if not self.device:
             self.run = False
             return
 
         try:
-            async with BleakClient(self.device, disconnected_callback=self.on_disconnect) as client:
+            self.ble_session.start()
+            client = BleakClient(self.device, disconnected_callback=self.on_disconnect)
+            await Ble_Hub.connect(client)
+            try:
                 self.bt_client = client
                 logger.info("|- Device connected, check if it's really a LLT/JBD BMS")
                 self.bt_loop = asyncio.get_event_loop()
                 self.response_queue = asyncio.Queue()
                 self.ready_event.set()
-                while self.run and client.is_connected and self.main_thread.is_alive():
-                    await asyncio.sleep(0.1)
+                await self.ble_session.run(client, lambda: self.run)
+            finally:
+                await client.disconnect()
             self.bt_loop = None
 
         # Exception occurred: TimeoutError() of type <class 'asyncio.exceptions.TimeoutError'>
@@ -134,7 +141,7 @@ class LltJbd_Ble(LltJbd):
 
     def background_loop(self):
         while self.run and self.main_thread.is_alive():
-            asyncio.run(self.bt_main_loop())
+            Ble_Hub.run(self.bt_main_loop())
 
     async def async_test_connection(self):
         if self.hci_uart_ok:
@@ -144,6 +151,7 @@ class LltJbd_Ble(LltJbd):
 
                 def shutdown_ble_atexit(thread):
                     self.run = False
+                    self.ble_session.wakeup()
                     thread.join()
 
                 atexit.register(shutdown_ble_atexit, self.bt_thread)
@@ -259,13 +267,18 @@ class LltJbd_Ble(LltJbd):
             logger.error(f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
             return False
 
+    # stops reconnecting and disconnects from the battery
+    def disconnect(self):
+        self.run = False
+        self.ble_session.wakeup()
+
     def reset_bluetooth(self):
         if not BLUETOOTH_FORCE_RESET_BLE_STACK:
             return
 
-        self.bt_loop = False
-
-        restart_ble_hardware_and_bluez_driver()
+        # in hub mode the reset is skipped, while other batteries are still connected
+        if Ble_Hub.reset_bluetooth():
+            self.bt_loop = False
 
     def reset_hci_uart(self):
         logger.error("Reset of hci_uart stack... Reconnecting to: " + self.address)
@@ -5,8 +5,7 @@
 # https://github.com/Louisvdw/dbus-serialbattery/pull/530
 
 from battery import Protection, Battery, Cell
-from utils import logger
-import serial
+from utils import logger, serial_port
 import sys
 
 
@@ -275,7 +274,7 @@ class Seplos(Battery):
     def read_serial_data_seplos(self, command):
         logger.debug("read serial data seplos")
 
-        with serial.Serial(self.port, baudrate=self.baud_rate, timeout=1) as ser:
+        with serial_port(self.port, self.baud_rate, timeout=1) as ser:
             ser.flushOutput()
             ser.flushInput()
             written = ser.write(command)
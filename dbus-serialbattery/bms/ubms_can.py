@@ -87,6 +87,9 @@ class Ubms_Can(Battery):
 
     BATTERYTYPE = "UBMS CAN"
 
+    # status, firmware and cell voltage frames of up to 11 modules
+    CAN_FRAMES = [0x180, 0xC0, 0xC1, 0xC2, 0xC4] + list(range(0x350, 0x366))
+
     def connection_name(self) -> str:
         return f"CAN socketcan:{self.port}" + (f"__{self.device_address}" if self.device_address != 0 else "")
 
@@ -133,7 +136,7 @@ class Ubms_Can(Battery):
 
         found = 0
 
-        for frame_id, data in self.can_transport_interface.can_message_cache_callback().items():
+        for frame_id, data in self.get_can_message_cache(arbitration_ids=self.CAN_FRAMES).items():
             msg = can.Message(arbitration_id=frame_id, data=data, is_extended_id=True)
 
             if msg.arbitration_id == 0x180:
@@ -226,7 +229,7 @@ class Ubms_Can(Battery):
 
     def decode_can(self):
 
-        for frame_id, data in self.can_transport_interface.can_message_cache_callback().items():
+        for frame_id, data in self.get_can_message_cache(arbitration_ids=self.CAN_FRAMES).items():
             msg = can.Message(arbitration_id=frame_id, data=data, is_extended_id=True)
 
             if msg.arbitration_id == 0xC0:
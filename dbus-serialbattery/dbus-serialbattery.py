@@ -4,19 +4,22 @@ import math
 import os
 import signal
 import sys
-from datetime import datetime
-from time import sleep
+import threading
+from time import monotonic, sleep
 from typing import Union
 
 from dbus.mainloop.glib import DBusGMainLoop
 from gi.repository import GLib as gobject
 
 from battery import Battery
-from dbushelper import DbusHelper
+from dbushelper import DbusHelper, get_fingerprint, set_fingerprint
 from utils import (
     BATTERY_ADDRESSES,
+    BLUETOOTH_BMS,
     BMS_TYPE,
     bytearray_to_string,
+    close_serial_port,
+    close_serial_ports,
     DRIVER_VERSION,
     EXCLUDED_DEVICES,
     EXTERNAL_SENSOR_DBUS_DEVICE,
@@ -94,6 +97,15 @@ logger.info("Starting dbus-serialbattery")
 count_for_loops = 5
 delayed_loop_count = 0
 
+# bus scheduling, if multiple batteries are connected to the same bus
+# address of the battery to poll first in the next cycle
+poll_start_address = None
+# time (monotonic) before which a not responding battery is not polled again
+poll_next_time = {}
+
+# seconds between the connection attempts to Bluetooth BMS that were not found at startup in hub mode
+BLE_HUB_RETRY_INTERVAL = 60
+
 
 def main():
     global expected_bms_types, supported_bms_types
@@ -113,21 +125,24 @@ def main():
         if "mainloop" in globals() and mainloop is not None:
             mainloop.quit()
 
-        # For BLE connections, disconnect from the BLE device
+        # Save the changed battery state to the dbus settings
+        for key_address in helper:
+            helper[key_address].save_current_battery_state()
+
+        # For BLE connections, disconnect from the BLE devices
         if port.endswith("_Ble"):
-            if battery and len(battery) > 0 and hasattr(battery[0], "disconnect") and callable(battery[0].disconnect):
-                battery[0].disconnect()
+            for key_address in battery:
+                if hasattr(battery[key_address], "disconnect") and callable(battery[key_address].disconnect):
+                    battery[key_address].disconnect()
 
         # Stop the CanReceiverThread
         elif port.startswith(("can", "vecan", "vcan")):
             if "can_thread" in globals() and can_thread is not None:
                 can_thread.stop()
 
-        # Close the serial connection
+        # Close the serial connections of the port pool
         else:
-            # Currently not feasible to close the serial connection
-            # TODO: Is it worth implementing this?
-            pass
+            close_serial_ports()
 
         logger.info(f"Stopped dbus-serialbattery with exit code {code}")
         sys.exit(code)
@@ -142,23 +157,70 @@ def main():
         Calls `publish_battery` from DbusHelper for each battery instance which
         then calls `refresh_data` from the battery instance to update the data.
 
+        If multiple batteries are connected to the same bus, the polls are scheduled:
+        - A battery that does not respond is backed off on its own, so it does not delay the other batteries
+        - Batteries that do not fit in the poll interval anymore are polled first in the next cycle
+
         :param loop: The main event loop
         :return: Always returns True
         """
-        global delayed_loop_count
-
-        # count execution time in milliseconds
-        start = datetime.now()
+        global delayed_loop_count, poll_start_address
+
+        # in hub mode all batteries can still be missing
+        if first_key is None:
+            return True
+
+        poll_interval = battery[first_key].poll_interval / 1000
+        addresses = list(battery.keys())
+
+        # start with the battery that was not polled in the last cycle
+        if poll_start_address in addresses:
+            start_index = addresses.index(poll_start_address)
+            addresses = addresses[start_index:] + addresses[:start_index]
+        poll_start_address = None
+
+        # count execution time in seconds
+        start = monotonic()
+        # execution time of the batteries that responded, used to adjust the poll interval
+        runtime = 0
+
+        for key_address in addresses:
+            # skip batteries that are backed off, since they did not respond
+            if poll_next_time.get(key_address, 0) > start:
+                continue
+
+            # the poll interval is exceeded, poll the remaining batteries first in the next cycle
+            if len(battery) > 1 and monotonic() - start > poll_interval:
+                poll_start_address = key_address
+                logger.debug(f"Poll interval exceeded, continue with address {key_address} in the next cycle")
+                break
 
-        for key_address in battery:
+            battery_start = monotonic()
             helper[key_address].publish_battery(loop)
+            battery_runtime = monotonic() - battery_start
+
+            error_count = helper[key_address].error["count"]
+
+            if error_count == 0:
+                runtime += battery_runtime
+                poll_next_time.pop(key_address, None)
 
-        runtime = (datetime.now() - start).total_seconds()
-        logger.debug(f"Polling data took {runtime:.3f} seconds")
+            # back off a not responding battery, only if there are other batteries to poll
+            elif len(battery) > 1:
+                # double the back off on each failed poll, but check at least every 10 seconds
+                # to not delay the offline detection in publish_battery()
+                back_off = min(poll_interval * 2 ** (error_count - 1), 10)
+                poll_next_time[key_address] = monotonic() + back_off
+                logger.debug(f"Battery at address {key_address} did not respond {error_count} times, next poll in {back_off:.3f} s")
+
+            else:
+                runtime += battery_runtime
+
+        logger.debug(f"Polling data took {monotonic() - start:.3f} seconds")
 
         # check if polling took too long and adjust poll interval, but only after 5 loops
         # since the first polls are always slower
-        if runtime > battery[first_key].poll_interval / 1000:
+        if runtime > poll_interval:
             delayed_loop_count += 1
             if delayed_loop_count > 1:
                 logger.warning(f"Polling data took {runtime:.3f} seconds. Automatically increase interval in {count_for_loops - delayed_loop_count} cycles.")
@@ -188,13 +250,23 @@ def main():
         :param _bus_address: The Modbus/CAN address to connect to (optional).
         :return: The battery object if a connection is established, otherwise None.
         """
+        # Test the battery type that was found last time on this port first
+        bms_types = expected_bms_types
+        fingerprint = get_fingerprint(_port, _bus_address)
+        if fingerprint is not None:
+            bms_types_found = [test for test in expected_bms_types if get_bms_type_fingerprint(test) == fingerprint]
+            if len(bms_types_found) > 0:
+                logger.info(f"-- Testing last found BMS {fingerprint['bms']} first")
+                bms_types = bms_types_found + [test for test in expected_bms_types if test not in bms_types_found]
+
         # Try to establish communications with the battery 3 times, else exit
         retry = 1
         retries = 3
         while retry <= retries:
             logger.info("-- Testing BMS: " + str(retry) + " of " + str(retries) + " rounds")
             # Create a new battery object that can read the battery and run connection test
-            for test in expected_bms_types:
+            for test in bms_types:
+                battery = None
                 # noinspection PyBroadException
                 try:
                     if _bus_address is not None:
@@ -214,7 +286,11 @@ def main():
                     battery.set_can_transport_interface(can_transport_interface)
                     if battery.test_connection() and battery.validate_data():
                         logger.info("-- Connection established to " + battery.__class__.__name__)
+                        set_fingerprint(_port, _bus_address, get_bms_type_fingerprint(test))
                         return battery
+
+                    # remove the CAN subscription of the failed battery type
+                    battery.unsubscribe_can_frames()
                 except KeyboardInterrupt:
                     return None
                 except Exception:
@@ -227,12 +303,30 @@ def main():
                     line = exception_traceback.tb_lineno
                     logger.error("Non blocking exception occurred: " + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}")
                     # Ignore any malfunction test_function()
-                    pass
+                    if battery is not None:
+                        battery.unsubscribe_can_frames()
+                finally:
+                    # the minimalmodbus drivers (e.g. Ecs) change the settings of the serial port with their own handle,
+                    # so reopen the pooled port for the next test, else it keeps the settings of the previous test
+                    close_serial_port(_port)
             retry += 1
             sleep(0.5)
 
         return None
 
+    def get_bms_type_fingerprint(test: dict) -> dict:
+        """
+        Get the fingerprint of a BMS type, which is saved after a successful connection.
+
+        :param test: The BMS type from the `expected_bms_types` list.
+        :return: A dictionary with the BMS class name, the baud rate and the address.
+        """
+        return {
+            "bms": test["bms"].__name__,
+            "baud": test["baud"] if "baud" in test else None,
+            "address": test["address"].hex() if "address" in test else None,
+        }
+
     def get_port() -> str:
         """
         Retrieves the port to connect to from the command line arguments.
@@ -301,8 +395,13 @@ def main():
     # show the version of the driver
     logger.info("dbus-serialbattery v" + str(DRIVER_VERSION))
 
+    helper = {}
     port = get_port()
     battery = {}
+    # classes of the configured Bluetooth BMS types
+    ble_classes = {}
+    # Bluetooth BMS that were not found in hub mode
+    ble_devices_missing = []
 
     # BLUETOOTH
     if port.endswith("_Ble"):
@@ -311,43 +410,103 @@ def main():
         This prevents issues when using the driver exclusively with a serial connection.
         """
 
-        if len(sys.argv) <= 2:
+        def get_ble_battery(class_, _ble_address: str) -> Union[Battery, None]:
+            """
+            Connects to the Bluetooth BMS and returns the battery object if successful.
+
+            :param class_: The BMS class.
+            :param _ble_address: The MAC address of the BMS.
+            :return: The battery object if a connection is established, otherwise None.
+            """
+            # do not remove ble_ prefix, since the dbus service cannot be only numbers
+            testbms = class_("ble_" + _ble_address.replace(":", "").lower(), 9600, _ble_address)
+
+            if testbms.test_connection():
+                logger.info("-- Connection established to " + testbms.__class__.__name__)
+                return testbms
+
+            # stop the connection attempts of the failed BMS, else it keeps reconnecting in the background
+            if hasattr(testbms, "disconnect") and callable(testbms.disconnect):
+                testbms.disconnect()
+            return None
+
+        def retry_ble_devices_missing() -> None:
+            """
+            Retries the Bluetooth BMS that were not found at startup in hub mode.
+            Runs in its own thread, found batteries are published from the main loop.
+
+            :return: None
+            """
+            while len(ble_devices_missing) > 0:
+                sleep(BLE_HUB_RETRY_INTERVAL)
+                for ble_device in list(ble_devices_missing):
+                    _ble_type, _ble_address = ble_device
+                    logger.info(f"Retrying {_ble_type} at {_ble_address}")
+                    found_battery = get_ble_battery(ble_classes[_ble_type], _ble_address)
+                    if found_battery is not None:
+                        ble_devices_missing.remove(ble_device)
+                        gobject.idle_add(add_battery, _ble_address, found_battery)
+
+        # hub mode: all Bluetooth BMS of the config are served by this process on one shared event loop
+        if port == "Hub_Ble":
+            from utils_ble import Ble_Hub
+
+            Ble_Hub.get_instance()
+
+            # each entry consists of the BMS type and the MAC address
+            ble_devices = [entry.split() for entry in BLUETOOTH_BMS]
+            ble_address = ", ".join(ble_device[-1] for ble_device in ble_devices)
+
+        elif len(sys.argv) <= 2:
             logger.error("ERROR >>> Bluetooth address is missing in the command line arguments")
             sleep(60)
             exit_driver(None, None, 1)
         else:
             ble_address = sys.argv[2]
+            ble_devices = [[port, ble_address]]
+
+        # connect to the BMS one after the other
+        for ble_device in ble_devices:
+            if len(ble_device) != 2:
+                logger.error(f'ERROR >>> Invalid Bluetooth BMS "{" ".join(ble_device)}", expected "<BMS type> <MAC address>"')
+                continue
 
-            if port == "Jkbms_Ble":
+            ble_type, ble_mac_address = ble_device
+
+            if ble_type == "Jkbms_Ble":
                 # noqa: F401 --> ignore flake "imported but unused" error
                 from bms.jkbms_ble import Jkbms_Ble  # noqa: F401
 
-            elif port == "Kilovault_Ble":
+            elif ble_type == "Kilovault_Ble":
                 # noqa: F401 --> ignore flake "imported but unused" error
                 from bms.kilovault_ble import Kilovault_Ble  # noqa: F401
 
-            elif port == "LiTime_Ble":
+            elif ble_type == "LiTime_Ble":
                 # noqa: F401 --> ignore flake "imported but unused" error
                 from bms.litime_ble import LiTime_Ble  # noqa: F401
 
-            elif port == "LltJbd_Ble":
+            elif ble_type == "LltJbd_Ble":
                 # noqa: F401 --> ignore flake "imported but unused" error
                 from bms.lltjbd_ble import LltJbd_Ble  # noqa: F401
 
             else:
-                logger.error("ERROR >>> Unknown Bluetooth BMS type: " + port)
+                logger.error("ERROR >>> Unknown Bluetooth BMS type: " + ble_type)
                 logger.error("Supported Bluetooth BMS types (CASE SENSITIVE!): Jkbms_Ble, Kilovault_Ble, LiTime_Ble, LltJbd_Ble")
+                # in hub mode skip only this BMS, the others are still served
+                if port == "Hub_Ble":
+                    continue
                 sleep(60)
                 exit_driver(None, None, 1)
 
-            class_ = eval(port)
+            ble_classes[ble_type] = eval(ble_type)
 
-            # do not remove ble_ prefix, since the dbus service cannot be only numbers
-            testbms = class_("ble_" + ble_address.replace(":", "").lower(), 9600, ble_address)
+            testbms = get_ble_battery(ble_classes[ble_type], ble_mac_address)
 
-            if testbms.test_connection():
-                logger.info("-- Connection established to " + testbms.__class__.__name__)
-                battery[0] = testbms
+            if testbms is not None:
+                battery[ble_mac_address if port == "Hub_Ble" else 0] = testbms
+            elif port == "Hub_Ble":
+                logger.warning(f"No battery connection to {ble_type} at {ble_mac_address}, retrying every {BLE_HUB_RETRY_INTERVAL} s")
+                ble_devices_missing.append((ble_type, ble_mac_address))
 
     # CAN
     elif port.startswith(("can", "vecan", "vcan")):
@@ -398,13 +557,20 @@ def main():
 
         can_transport_interface = CanTransportInterface()
         can_transport_interface.can_message_cache_callback = can_thread.get_message_cache
+        can_transport_interface.can_subscribe_callback = can_thread.subscribe
+        can_transport_interface.can_unsubscribe_callback = can_thread.unsubscribe
         can_transport_interface.can_bus = can_thread.can_bus
         logger.debug("Wait shortly to make sure that all needed data is in the cache")
         # Slowest message cycle transmission is every 1 second, wait a bit more for the first time to fetch all needed data (only jk bms)
         sleep(2)
         addresses = [None] if len(BATTERY_ADDRESSES) == 0 else BATTERY_ADDRESSES  # use default address, if not configured
 
-        for busspeed in [250, 500]:
+        def search_can_batteries() -> None:
+            """
+            Search the batteries on all addresses with the current bitrate of the CAN interface.
+
+            :return: None
+            """
             for address in addresses:
                 bat = get_battery(port, address, can_transport_interface)
                 if bat:
@@ -413,13 +579,29 @@ def main():
                 else:
                     logger.warning(f"No battery connection at {port} and this address {str(address)}")
 
-            # if we've found at least 1 battery, stop the search here. otherwise retry with other bus speeds
-            if len(battery) > 0:
-                break
+        # search with the current bitrate first, since changing the bitrate resets the link of the whole bus
+        search_can_batteries()
 
-            logger.info(f"Found no devices on can bus, retrying with {busspeed} kbps")
-            can_thread.setup_can(channel=port, bitrate=busspeed, force=True)
-            sleep(2)
+        if len(battery) == 0:
+            # detect the bitrate by listening to the bus, instead of trying the bitrates one after another
+            bitrate = can_thread.detect_bitrate([250, 500])
+
+            if bitrate is not None:
+                search_can_batteries()
+            else:
+                for busspeed in [250, 500]:
+                    logger.info(f"Found no devices on can bus, retrying with {busspeed} kbps")
+                    can_thread.setup_can(channel=port, bitrate=busspeed, force=True)
+                    sleep(2)
+                    search_can_batteries()
+
+                    # if we've found at least 1 battery, stop the search here. otherwise retry with other bus speeds
+                    if len(battery) > 0:
+                        break
+
+        # receive only the frames of the found batteries
+        if len(battery) > 0:
+            can_thread.enable_filters()
 
     # SERIAL
     else:
@@ -428,7 +610,11 @@ def main():
 
         # wait some seconds to be sure that the serial connection is ready
         # else the error throw a lot of timeouts
-        sleep(16)
+        # if a battery was already found on this port, the connection was ready before, so wait only shortly
+        if get_fingerprint(port, BATTERY_ADDRESSES[0] if BATTERY_ADDRESSES else None) is not None:
+            sleep(2)
+        else:
+            sleep(16)
 
         # Check if BATTERY_ADDRESSES is not empty
         if BATTERY_ADDRESSES:
@@ -450,7 +636,11 @@ def main():
         if battery[key_address] is not None:
             battery_found = True
 
-    if not battery_found:
+    # in hub mode keep running and retry the missing batteries, since a restart would scan all batteries again
+    if not battery_found and len(ble_devices_missing) > 0:
+        logger.warning(f"No battery connection at {port} yet, retrying every {BLE_HUB_RETRY_INTERVAL} s")
+
+    elif not battery_found:
         logger.error(
             f"ERROR >>> No battery connection at {port}"
             + (" and this bus addresses: " + ", ".join(BATTERY_ADDRESSES) if BATTERY_ADDRESSES else "")
@@ -464,12 +654,61 @@ def main():
         gobject.threads_init()
     mainloop = gobject.MainLoop()
 
-    # Get the initial values for the battery used by setup_vedbus
-    helper = {}
+    def setup_battery(key_address) -> bool:
+        """
+        Sets up the dbus service of the battery and calculates its initial values.
 
-    for key_address in battery:
-        helper[key_address] = DbusHelper(battery[key_address], key_address)
+        :param key_address: The key of the battery in the battery dict.
+        :return: True if the dbus service was set up, otherwise False.
+        """
+        # the port of a BLE battery already contains its MAC address
+        helper[key_address] = DbusHelper(battery[key_address], key_address if not port.endswith("_Ble") else None)
         if not helper[key_address].setup_vedbus():
+            return False
+
+        # Calculate the initial values for the battery
+        battery[key_address].set_calculated_data()
+        return True
+
+    def add_battery(key_address, found_battery: Battery) -> bool:
+        """
+        Publishes a battery that was found after startup, e.g. a Bluetooth BMS in hub mode.
+        Runs in the main loop.
+
+        :param key_address: The key of the battery in the battery dict.
+        :param found_battery: The battery object.
+        :return: Always returns False, so that it's called only once by the main loop
+        """
+        nonlocal first_key
+
+        battery[key_address] = found_battery
+        if not setup_battery(key_address):
+            logger.error(f"ERROR >>> Problem with battery set up at {port} {key_address}")
+            del battery[key_address]
+            if hasattr(found_battery, "disconnect") and callable(found_battery.disconnect):
+                found_battery.disconnect()
+            return False
+
+        # the first battery found in hub mode defines the poll interval
+        if first_key is None:
+            first_key = key_address
+            found_battery.poll_interval = poll_interval_hub
+
+        found_battery.log_settings()
+
+        if not config_values_valid:
+            found_battery.state = 10
+            found_battery.error_code = 119
+
+        if EXTERNAL_SENSOR_DBUS_DEVICE is not None and (EXTERNAL_SENSOR_DBUS_PATH_CURRENT is not None or EXTERNAL_SENSOR_DBUS_PATH_SOC is not None):
+            found_battery.setup_external_sensor()
+
+        logger.info(f"Successful battery connection at {port} {key_address}")
+        return False
+
+    # Get the initial values for the battery used by setup_vedbus
+    for key_address in battery:
+        if not setup_battery(key_address):
             logger.error(
                 f"ERROR >>> Problem with battery set up at {port}"
                 + (" and this bus address: " + ", ".join(BATTERY_ADDRESSES) if BATTERY_ADDRESSES else "")
@@ -477,14 +716,26 @@ def main():
             )
             exit_driver(None, None, 1)
 
-        # Calculate the initial values for the battery
-        battery[key_address].set_calculated_data()
+    # get first key from battery dict, in hub mode there is no battery yet, if all are retried
+    first_key = list(battery.keys())[0] if len(battery) > 0 else None
+
+    # in hub mode the batteries are always polled from the main loop, since an active callback of one battery
+    # would run on the shared bluetooth event loop and poll all other batteries from there
+    if port == "Hub_Ble":
+        # use the slowest poll interval of the batteries, so that all batteries can keep up
+        poll_interval_hub = POLL_INTERVAL if POLL_INTERVAL is not None else max((battery[key].poll_interval for key in battery), default=1000)
+        if first_key is not None:
+            battery[first_key].poll_interval = poll_interval_hub
+
+        logger.info(f"Polling interval: {poll_interval_hub/1000:.3f} s")
 
-    # get first key from battery dict
-    first_key = list(battery.keys())[0]
+        gobject.timeout_add(
+            poll_interval_hub,
+            lambda: poll_battery(mainloop),
+        )
 
     # try using active callback on this battery (normally only used for Bluetooth BMS)
-    if not battery[first_key].use_callback(lambda: poll_battery(mainloop)):
+    elif not battery[first_key].use_callback(lambda: poll_battery(mainloop)):
         # change poll interval if set in config
         if POLL_INTERVAL is not None:
             battery[first_key].poll_interval = POLL_INTERVAL
@@ -505,7 +756,8 @@ def main():
 
     # check config, if there are any invalid values trigger "settings incorrect" error
     # and set the battery in error state to prevent chargin/discharging
-    if not validate_config_values():
+    config_values_valid = validate_config_values()
+    if not config_values_valid:
         for key_address in battery:
             battery[key_address].state = 10
             battery[key_address].error_code = 119
@@ -515,6 +767,10 @@ def main():
         for key_address in battery:
             battery[key_address].setup_external_sensor()
 
+    # retry the Bluetooth BMS that were not found at startup in hub mode
+    if len(ble_devices_missing) > 0:
+        threading.Thread(target=retry_ble_devices_missing, name="BLE_Hub_Retry", daemon=True).start()
+
     # Run the main loop
     try:
         mainloop.run()
@@ -4,7 +4,8 @@ import os
 import platform
 import dbus
 import traceback
-from time import sleep, time
+from time import monotonic, sleep, time
+from typing import Union
 from utils import logger, publish_config_variables
 import utils
 from xml.etree import ElementTree
@@ -14,7 +15,7 @@ import json
 
 # add path to velib_python
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext", "velib_python"))
-from vedbus import VeDbusService  # noqa: E402
+from vedbus import VeDbusService, VeDbusItemImport  # noqa: E402
 from ve_utils import get_vrm_portal_id  # noqa: E402
 from settingsdevice import SettingsDevice  # noqa: E402
 
@@ -29,10 +30,115 @@ class SessionBus(dbus.bus.BusConnection):
         return dbus.bus.BusConnection.__new__(cls, dbus.bus.BusConnection.TYPE_SESSION)
 
 
-def get_bus() -> dbus.bus.BusConnection:
+shared_bus: dbus.bus.BusConnection = None
+"""
+Dbus connection shared by all dbus calls of the driver, see `get_bus()`
+"""
+shared_bus_has_mainloop: bool = False
+"""
+True, if the shared dbus connection was created with a main loop
+"""
+
+
+def get_private_bus() -> dbus.bus.BusConnection:
+    """
+    Create a new private dbus connection.
+    Each VeDbusService needs its own connection, since it registers its object paths on the connection.
+
+    :return: A new dbus connection
+    """
     return SessionBus() if "DBUS_SESSION_BUS_ADDRESS" in os.environ else SystemBus()
 
 
+def get_bus() -> dbus.bus.BusConnection:
+    """
+    Get the dbus connection shared by all dbus calls of the driver.
+    This avoids the connection setup with dbus-daemon on each call.
+
+    A new connection is only created, if there is none yet, if it was disconnected or
+    if it was created before the main loop was set up, since the main loop is needed to receive signals.
+
+    :return: The shared dbus connection
+    """
+    global shared_bus, shared_bus_has_mainloop
+
+    has_mainloop = dbus.get_default_main_loop() is not None
+
+    if shared_bus is not None and shared_bus.get_is_connected() and (shared_bus_has_mainloop or not has_mainloop):
+        return shared_bus
+
+    if shared_bus is not None:
+        logger.debug("Reconnecting shared dbus connection")
+        # the connection was created before the main loop was set up, so nothing can be subscribed to it
+        if shared_bus.get_is_connected():
+            shared_bus.close()
+
+    shared_bus = get_private_bus()
+    shared_bus_has_mainloop = has_mainloop
+
+    return shared_bus
+
+
+def get_fingerprint_path(port: str, bms_address: str = None) -> str:
+    """
+    Get the settings path of the detection fingerprint of a port.
+
+    :param port: The port the battery is connected to.
+    :param bms_address: The bus address of the battery (optional).
+    :return: The settings path.
+    """
+    name = port[port.rfind("/") + 1 :] + ("__" + str(bms_address) if bms_address is not None else "")
+    # remove all non alphanumeric characters except underscore from the name
+    return "/Settings/SerialBattery/Fingerprint/" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def get_fingerprint(port: str, bms_address: str = None) -> Union[dict, None]:
+    """
+    Get the detection fingerprint of the battery that was last found on this port.
+    This is used to test the last found battery type first, when the driver is restarted.
+    It's read before the main loop is set up, therefore no signals are used.
+
+    :param port: The port the battery is connected to.
+    :param bms_address: The bus address of the battery (optional).
+    :return: A dictionary with the keys "bms", "baud" and "address" or None, if there is no fingerprint.
+    """
+    try:
+        obj = get_bus().get_object("com.victronenergy.settings", get_fingerprint_path(port, bms_address))
+        value = str(dbus.Interface(obj, "com.victronenergy.BusItem").GetValue())
+        return json.loads(value) if value != "" else None
+
+    except Exception as e:
+        logger.debug(f"No fingerprint found: {e}")
+        return None
+
+
+def set_fingerprint(port: str, bms_address: str, fingerprint: dict) -> None:
+    """
+    Save the detection fingerprint of the found battery to the dbus settings.
+    The setting is only written, if it changed, to avoid unnecessary writes to the flash.
+
+    :param port: The port the battery is connected to.
+    :param bms_address: The bus address of the battery (optional).
+    :param fingerprint: A dictionary with the keys "bms", "baud" and "address".
+    :return: None
+    """
+    if get_fingerprint(port, bms_address) == fingerprint:
+        return
+
+    path = get_fingerprint_path(port, bms_address)
+    try:
+        bus = get_bus()
+        settings_iface = dbus.Interface(bus.get_object("com.victronenergy.settings", "/Settings"), "com.victronenergy.Settings")
+        settings_iface.AddSetting("", path.replace("/Settings/", "", 1), "", "s", 0, 0)
+
+        obj = bus.get_object("com.victronenergy.settings", path)
+        dbus.Interface(obj, "com.victronenergy.BusItem").SetValue(json.dumps(fingerprint))
+        logger.debug(f"Saved fingerprint {fingerprint} to {path}")
+
+    except Exception as e:
+        logger.error(f"Failed to save fingerprint: {e}")
+
+
 class DbusHelper:
     """
     This class is used to handle all the dbus communication.
@@ -51,7 +157,9 @@ class DbusHelper:
             + self.battery.port[self.battery.port.rfind("/") + 1 :]
             + ("__" + str(bms_address) if bms_address is not None and bms_address != 0 else "")
         )
-        self._dbusservice = VeDbusService(self._dbusname, get_bus(), register=False)
+        self._dbusservice = VeDbusService(self._dbusname, get_private_bus(), register=False)
+        # the items call this for changes of other processes, set before the paths are added
+        self._dbusservice._value_changed = self.external_value_changed
         self.bms_id = "".join(
             # remove all non alphanumeric characters except underscore from the identifier
             c if c.isalnum() else "_"
@@ -69,6 +177,47 @@ class DbusHelper:
         """
         Last time the history values were calculated.
         """
+        self.save_current_battery_state_last_time: int = int(time())
+        """
+        Last time the battery state was saved to the dbus settings.
+        """
+        self.cell_voltage_paths: list = []
+        """
+        Dbus paths of the cell voltages, created once in setup_vedbus()
+        """
+        self.cell_balance_paths: list = []
+        """
+        Dbus paths of the cell balance status, created once in setup_vedbus()
+        """
+        self.cell_voltages_published: list = []
+        """
+        Last published cell voltages, used to only publish changes larger than the deadband
+        """
+        self.cell_balances_published: list = []
+        """
+        Last published cell balance status
+        """
+        self.json_data: dict = {}
+        """
+        Nested battery data published as JSON, only the changed leaves are updated
+        """
+        self.json_data_leaves: dict = {}
+        """
+        Parent dictionary and key in `json_data` for each dbus path, None if the path is not published
+        """
+        self.json_data_changed_paths: set = set()
+        """
+        Dbus paths changed since the JSON data was published the last time
+        """
+        self.json_data_last_time: float = 0
+        """
+        Last time the JSON data was published.
+        """
+        self.settings_ess: dict = {}
+        """
+        ESS settings used for the Time-to-Go calculation.
+        The values are kept up to date by change signals from com.victronenergy.settings.
+        """
         self.telemetry_upload_error_count: int = 0
         self.telemetry_upload_interval: int = 60 * 60 * 3  # 3 hours
         self.telemetry_upload_last: int = 0
@@ -173,11 +322,18 @@ class DbusHelper:
         logger.debug("setup_instance(): SettingsDevice")
 
         # get all the settings from the dbus
-        settings_from_dbus = self.get_settings_with_values(
+        # try to get all settings in one call, fall back to walk the tree if not supported
+        settings_from_dbus = self.get_settings_with_items(
             get_bus(),
             "com.victronenergy.settings",
             "/Settings/Devices",
         )
+        if settings_from_dbus is None:
+            settings_from_dbus = self.get_settings_with_values(
+                get_bus(),
+                "com.victronenergy.settings",
+                "/Settings/Devices",
+            )
         logger.debug("setup_instance(): get_settings_with_values")
         # output:
         # {
@@ -703,8 +859,12 @@ class DbusHelper:
                     writeable=True,
                     gettextcallback=lambda p, v: "{:0.3f}V".format(v),
                 )
+                self.cell_voltage_paths.append(cellpath % (str(i)))
                 if utils.BATTERY_CELL_DATA_FORMAT & 1:
                     self._dbusservice.add_path("/Balances/Cell%s" % (str(i)), None, writeable=True)
+                    self.cell_balance_paths.append("/Balances/Cell%s" % (str(i)))
+            self.cell_voltages_published = [None] * len(self.cell_voltage_paths)
+            self.cell_balances_published = [None] * len(self.cell_balance_paths)
             pathbase = "Cell" if (utils.BATTERY_CELL_DATA_FORMAT & 2) else "Voltages"
             self._dbusservice.add_path(
                 "/%s/Sum" % pathbase,
@@ -727,6 +887,18 @@ class DbusHelper:
             gettextcallback=lambda p, v: "{:0.2f}A".format(v),
         )
 
+        # Subscribe to the ESS settings used for the Time-to-Go calculation
+        # the values are cached and updated by change signals, so they don't have to be read on each calculation
+        if utils.TIME_TO_GO_ENABLE:
+            bus = get_bus()
+            for path in [
+                "/Settings/CGwacs/Hub4Mode",
+                "/Settings/CGwacs/BatteryLife/State",
+                "/Settings/CGwacs/BatteryLife/MinimumSocLimit",
+                "/Settings/CGwacs/BatteryLife/SocLimit",
+            ]:
+                self.settings_ess[path] = VeDbusItemImport(bus, "com.victronenergy.settings", path)
+
         # Create TimeToSoC items only if enabled, battery capacity is set and points are available
         if utils.TIME_TO_GO_ENABLE and self.battery.capacity is not None and len(utils.TIME_TO_SOC_POINTS) > 0:
             for num in utils.TIME_TO_SOC_POINTS:
@@ -767,20 +939,6 @@ class DbusHelper:
             # Call the battery's refresh_data function
             result = self.battery.refresh_data()
 
-            # Check if external sensor is still connected
-            if utils.EXTERNAL_SENSOR_DBUS_DEVICE is not None and (
-                utils.EXTERNAL_SENSOR_DBUS_PATH_CURRENT is not None or utils.EXTERNAL_SENSOR_DBUS_PATH_SOC is not None
-            ):
-                # Check if external sensor was and is still connected
-                if self.battery.dbus_external_objects is not None and utils.EXTERNAL_SENSOR_DBUS_DEVICE not in get_bus().list_names():
-                    logger.error("External current sensor was disconnected, falling back to internal sensor")
-                    self.battery.dbus_external_objects = None
-
-                # Check if external current sensor was not connected and is now connected
-                elif self.battery.dbus_external_objects is None and utils.EXTERNAL_SENSOR_DBUS_DEVICE in get_bus().list_names():
-                    logger.info("External current sensor was connected, switching to external sensor")
-                    self.battery.setup_external_sensor()
-
             # Calculate the values for the battery
             self.battery.set_calculated_data()
 
@@ -893,294 +1051,263 @@ class DbusHelper:
         """
         Publishes the battery data to dbus and refresh it.
         """
-        self._dbusservice["/System/NrOfCellsPerBattery"] = self.battery.cell_count
-        if utils.SOC_CALCULATION or utils.EXTERNAL_SENSOR_DBUS_PATH_SOC is not None:
-            self._dbusservice["/Soc"] = round(self.battery.soc_calc, 2) if self.battery.soc_calc is not None else None
-            # add original SOC for comparing
-            self._dbusservice["/SocBms"] = round(self.battery.soc, 2) if self.battery.soc is not None else None
-        else:
-            self._dbusservice["/Soc"] = round(self.battery.soc_calc, 2) if self.battery.soc is not None else None
-        self._dbusservice["/Soh"] = round(self.battery.soh, 2) if self.battery.soh is not None else None
-        self._dbusservice["/Dc/0/Voltage"] = round(self.battery.voltage, 2) if self.battery.voltage is not None else None
-        self._dbusservice["/Dc/0/Current"] = round(self.battery.current_calc, 2) if self.battery.current_calc is not None else None
-        self._dbusservice["/Dc/0/Power"] = round(self.battery.power_calc, 2) if self.battery.power_calc is not None else None
-        self._dbusservice["/Dc/0/Temperature"] = self.battery.get_temperature()
-        self._dbusservice["/Capacity"] = self.battery.get_capacity_remain()
-        self._dbusservice["/ConsumedAmphours"] = self.battery.get_capacity_consumed()
-
-        midpoint, deviation = self.battery.get_midvoltage()
-        if midpoint is not None:
-            self._dbusservice["/Dc/0/MidVoltage"] = midpoint
-            self._dbusservice["/Dc/0/MidVoltageDeviation"] = deviation
-
-        # Update battery extras
-        self._dbusservice["/State"] = self.battery.state
-        # https://github.com/victronenergy/veutil/blob/master/inc/veutil/ve_regs_payload.h
-        # https://github.com/victronenergy/veutil/blob/master/src/qt/bms_error.cpp
-        self._dbusservice["/ErrorCode"] = self.battery.error_code
-        self._dbusservice["/ConnectionInformation"] = self.battery.connection_info
-
-        self._dbusservice["/History/DeepestDischarge"] = (
-            abs(self.battery.history.deepest_discharge) * -1 if self.battery.history.deepest_discharge is not None else None
-        )
-        self._dbusservice["/History/LastDischarge"] = abs(self.battery.history.last_discharge) * -1 if self.battery.history.last_discharge is not None else None
-        self._dbusservice["/History/AverageDischarge"] = (
-            abs(self.battery.history.average_discharge) * -1 if self.battery.history.average_discharge is not None else None
-        )
-        self._dbusservice["/History/TotalAhDrawn"] = abs(self.battery.history.total_ah_drawn) * -1 if self.battery.history.total_ah_drawn is not None else None
-        self._dbusservice["/History/ChargeCycles"] = self.battery.history.charge_cycles
-        self._dbusservice["/History/FullDischarges"] = self.battery.history.full_discharges
-        self._dbusservice["/History/MinimumVoltage"] = self.battery.history.minimum_voltage
-        self._dbusservice["/History/MaximumVoltage"] = self.battery.history.maximum_voltage
-        self._dbusservice["/History/MinimumCellVoltage"] = self.battery.history.minimum_cell_voltage
-        self._dbusservice["/History/MaximumCellVoltage"] = self.battery.history.maximum_cell_voltage
-        self._dbusservice["/History/TimeSinceLastFullCharge"] = (
-            int(time()) - self.battery.history.timestamp_last_full_charge if self.battery.history.timestamp_last_full_charge is not None else None
-        )
-        self._dbusservice["/History/LowVoltageAlarms"] = self.battery.history.low_voltage_alarms
-        self._dbusservice["/History/HighVoltageAlarms"] = self.battery.history.high_voltage_alarms
-        self._dbusservice["/History/MinimumTemperature"] = self.battery.history.minimum_temperature
-        self._dbusservice["/History/MaximumTemperature"] = self.battery.history.maximum_temperature
-        self._dbusservice["/History/DischargedEnergy"] = self.battery.history.discharged_energy
-        self._dbusservice["/History/ChargedEnergy"] = self.battery.history.charged_energy
-        self._dbusservice["/History/Clear"] = self.battery.history.clear
-
-        self._dbusservice["/Io/AllowToCharge"] = 1 if self.battery.get_allow_to_charge() else 0
-        self._dbusservice["/Io/AllowToDischarge"] = 1 if self.battery.get_allow_to_discharge() else 0
-        self._dbusservice["/Io/AllowToBalance"] = 1 if self.battery.get_allow_to_balance() else 0
-        self._dbusservice["/System/NrOfModulesBlockingCharge"] = 0 if self.battery.get_allow_to_charge() else 1
-        self._dbusservice["/System/NrOfModulesBlockingDischarge"] = 0 if self.battery.get_allow_to_discharge() else 1
-        self._dbusservice["/System/NrOfModulesOnline"] = 1 if self.battery.online else 0
-        self._dbusservice["/System/NrOfModulesOffline"] = 0 if self.battery.online else 1
-        self._dbusservice["/System/MinCellTemperature"] = self.battery.get_min_temperature()
-        self._dbusservice["/System/MinTemperatureCellId"] = self.battery.get_min_temperature_id()
-        self._dbusservice["/System/MaxCellTemperature"] = self.battery.get_max_temperature()
-        self._dbusservice["/System/MaxTemperatureCellId"] = self.battery.get_max_temperature_id()
-        self._dbusservice["/System/MOSTemperature"] = self.battery.temperature_mos
-        self._dbusservice["/System/Temperature1"] = self.battery.temperature_1
-        self._dbusservice["/System/Temperature1Name"] = utils.TEMPERATURE_1_NAME
-        self._dbusservice["/System/Temperature2"] = self.battery.temperature_2
-        self._dbusservice["/System/Temperature2Name"] = utils.TEMPERATURE_2_NAME
-        self._dbusservice["/System/Temperature3"] = self.battery.temperature_3
-        self._dbusservice["/System/Temperature3Name"] = utils.TEMPERATURE_3_NAME
-        self._dbusservice["/System/Temperature4"] = self.battery.temperature_4
-        self._dbusservice["/System/Temperature4Name"] = utils.TEMPERATURE_4_NAME
-
-        # Voltage control
-        self._dbusservice["/Info/BatteryLowVoltage"] = self.battery.min_battery_voltage
-        self._dbusservice["/Info/MaxChargeVoltage"] = (
-            round(self.battery.control_voltage + utils.VOLTAGE_DROP, 2) if self.battery.control_voltage is not None else None
-        )
-
-        # Charge control
-        self._dbusservice["/Info/MaxChargeCurrent"] = self.battery.control_charge_current
-        self._dbusservice["/Info/MaxDischargeCurrent"] = self.battery.control_discharge_current
-
-        # Voltage and charge control info (custom dbus paths)
-        self._dbusservice["/Info/ChargeMode"] = self.battery.charge_mode
-        self._dbusservice["/Info/ChargeModeDebug"] = self.battery.charge_mode_debug
-        self._dbusservice["/Info/ChargeModeDebugFloat"] = self.battery.charge_mode_debug_float
-        self._dbusservice["/Info/ChargeModeDebugBulk"] = self.battery.charge_mode_debug_bulk
-        self._dbusservice["/Info/ChargeLimitation"] = self.battery.charge_limitation
-        self._dbusservice["/Info/DischargeLimitation"] = self.battery.discharge_limitation
-
-        # Updates from cells
-        self._dbusservice["/System/MinVoltageCellId"] = self.battery.get_min_cell_desc()
-        self._dbusservice["/System/MaxVoltageCellId"] = self.battery.get_max_cell_desc()
-        self._dbusservice["/System/MinCellVoltage"] = self.battery.get_min_cell_voltage()
-        self._dbusservice["/System/MaxCellVoltage"] = self.battery.get_max_cell_voltage()
-        self._dbusservice["/Balancing"] = self.battery.get_balancing()
-
-        # Update the alarms
-        self.battery.protection.set_previous()
-        self._dbusservice["/Alarms/LowVoltage"] = self.battery.protection.low_voltage
-        self._dbusservice["/Alarms/LowCellVoltage"] = self.battery.protection.low_cell_voltage
-        # disable high voltage warning temporarly, if loading to bulk voltage and bulk voltage reached is 30 minutes ago
-        self._dbusservice["/Alarms/HighVoltage"] = (
-            self.battery.protection.high_voltage
-            if (self.battery.soc_reset_requested is False and self.battery.soc_reset_last_reached < int(time()) - (60 * 30))
-            else 0
-        )
-        self._dbusservice["/Alarms/HighCellVoltage"] = (
-            self.battery.protection.high_cell_voltage
-            if (self.battery.soc_reset_requested is False and self.battery.soc_reset_last_reached < int(time()) - (60 * 30))
-            else 0
-        )
-        self._dbusservice["/Alarms/LowSoc"] = self.battery.protection.low_soc
-        self._dbusservice["/Alarms/HighChargeCurrent"] = self.battery.protection.high_charge_current
-        self._dbusservice["/Alarms/HighDischargeCurrent"] = self.battery.protection.high_discharge_current
-        self._dbusservice["/Alarms/CellImbalance"] = self.battery.protection.cell_imbalance
-        self._dbusservice["/Alarms/InternalFailure"] = self.battery.protection.internal_failure
-        self._dbusservice["/Alarms/HighChargeTemperature"] = self.battery.protection.high_charge_temperature
-        self._dbusservice["/Alarms/LowChargeTemperature"] = self.battery.protection.low_charge_temperature
-        self._dbusservice["/Alarms/HighTemperature"] = self.battery.protection.high_temperature
-        self._dbusservice["/Alarms/LowTemperature"] = self.battery.protection.low_temperature
-        self._dbusservice["/Alarms/BmsCable"] = 2 if self.battery.block_because_disconnect else 0
-        self._dbusservice["/Alarms/HighInternalTemperature"] = self.battery.protection.high_internal_temperature
-        self._dbusservice["/Alarms/FuseBlown"] = self.battery.protection.fuse_blown
-
-        # cell voltages
-        if utils.BATTERY_CELL_DATA_FORMAT > 0:
-            try:
-                voltage_sum = 0
-                for i in range(self.battery.cell_count):
-                    voltage = self.battery.get_cell_voltage(i)
-                    cellpath = "/Cell/%s/Volts" if (utils.BATTERY_CELL_DATA_FORMAT & 2) else "/Voltages/Cell%s"
-                    self._dbusservice[cellpath % (str(i + 1))] = voltage
-                    if utils.BATTERY_CELL_DATA_FORMAT & 1:
-                        self._dbusservice["/Balances/Cell%s" % (str(i + 1))] = self.battery.get_cell_balancing(i)
-                    if voltage:
-                        voltage_sum += voltage
-                pathbase = "Cell" if (utils.BATTERY_CELL_DATA_FORMAT & 2) else "Voltages"
-                self._dbusservice["/%s/Sum" % pathbase] = round(voltage_sum, 2)
-                self._dbusservice["/%s/Diff" % pathbase] = round(
-                    self.battery.get_max_cell_voltage() - self.battery.get_min_cell_voltage(),
-                    3,
-                )
-            except Exception:
-                # set error code, to show in the GUI that something is wrong
-                self.battery.manage_error_code(8)
-
-                exception_type, exception_object, exception_traceback = sys.exc_info()
-                file = exception_traceback.tb_frame.f_code.co_filename
-                line = exception_traceback.tb_lineno
-                logger.error("Non blocking exception occurred: " + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}")
-
-        # Calculate average current for the last 300 cycles
-        self.battery.previous_current_avg = self.battery.current_avg
-        if self.battery.current_calc is not None:
-            self.battery.current_avg_lst.append(self.battery.current_calc)
-            # delete oldest value
-            if len(self.battery.current_avg_lst) > 300:
-                del self.battery.current_avg_lst[0]
-
-            self.battery.current_avg = round(
-                sum(self.battery.current_avg_lst) / len(self.battery.current_avg_lst),
-                2,
+        # Collect all changes of this cycle in one transaction. Only values that really changed are sent
+        # and they are emitted as a single ItemsChanged signal instead of one PropertiesChanged signal per path
+        with self._dbusservice as dbusservice:
+            dbusservice["/System/NrOfCellsPerBattery"] = self.battery.cell_count
+            if utils.SOC_CALCULATION or utils.EXTERNAL_SENSOR_DBUS_PATH_SOC is not None:
+                dbusservice["/Soc"] = round(self.battery.soc_calc, 2) if self.battery.soc_calc is not None else None
+                # add original SOC for comparing
+                dbusservice["/SocBms"] = round(self.battery.soc, 2) if self.battery.soc is not None else None
+            else:
+                dbusservice["/Soc"] = round(self.battery.soc_calc, 2) if self.battery.soc is not None else None
+            dbusservice["/Soh"] = round(self.battery.soh, 2) if self.battery.soh is not None else None
+            dbusservice["/Dc/0/Voltage"] = round(self.battery.voltage, 2) if self.battery.voltage is not None else None
+            dbusservice["/Dc/0/Current"] = round(self.battery.current_calc, 2) if self.battery.current_calc is not None else None
+            dbusservice["/Dc/0/Power"] = round(self.battery.power_calc, 2) if self.battery.power_calc is not None else None
+            dbusservice["/Dc/0/Temperature"] = self.battery.get_temperature()
+            dbusservice["/Capacity"] = self.battery.get_capacity_remain()
+            dbusservice["/ConsumedAmphours"] = self.battery.get_capacity_consumed()
+
+            midpoint, deviation = self.battery.get_midvoltage()
+            if midpoint is not None:
+                dbusservice["/Dc/0/MidVoltage"] = midpoint
+                dbusservice["/Dc/0/MidVoltageDeviation"] = deviation
+
+            # Update battery extras
+            dbusservice["/State"] = self.battery.state
+            # https://github.com/victronenergy/veutil/blob/master/inc/veutil/ve_regs_payload.h
+            # https://github.com/victronenergy/veutil/blob/master/src/qt/bms_error.cpp
+            dbusservice["/ErrorCode"] = self.battery.error_code
+            dbusservice["/ConnectionInformation"] = self.battery.connection_info
+
+            dbusservice["/History/DeepestDischarge"] = (
+                abs(self.battery.history.deepest_discharge) * -1 if self.battery.history.deepest_discharge is not None else None
+            )
+            dbusservice["/History/LastDischarge"] = abs(self.battery.history.last_discharge) * -1 if self.battery.history.last_discharge is not None else None
+            dbusservice["/History/AverageDischarge"] = (
+                abs(self.battery.history.average_discharge) * -1 if self.battery.history.average_discharge is not None else None
+            )
+            dbusservice["/History/TotalAhDrawn"] = abs(self.battery.history.total_ah_drawn) * -1 if self.battery.history.total_ah_drawn is not None else None
+            dbusservice["/History/ChargeCycles"] = self.battery.history.charge_cycles
+            dbusservice["/History/FullDischarges"] = self.battery.history.full_discharges
+            dbusservice["/History/MinimumVoltage"] = self.battery.history.minimum_voltage
+            dbusservice["/History/MaximumVoltage"] = self.battery.history.maximum_voltage
+            dbusservice["/History/MinimumCellVoltage"] = self.battery.history.minimum_cell_voltage
+            dbusservice["/History/MaximumCellVoltage"] = self.battery.history.maximum_cell_voltage
+            dbusservice["/History/TimeSinceLastFullCharge"] = (
+                int(time()) - self.battery.history.timestamp_last_full_charge if self.battery.history.timestamp_last_full_charge is not None else None
+            )
+            dbusservice["/History/LowVoltageAlarms"] = self.battery.history.low_voltage_alarms
+            dbusservice["/History/HighVoltageAlarms"] = self.battery.history.high_voltage_alarms
+            dbusservice["/History/MinimumTemperature"] = self.battery.history.minimum_temperature
+            dbusservice["/History/MaximumTemperature"] = self.battery.history.maximum_temperature
+            dbusservice["/History/DischargedEnergy"] = self.battery.history.discharged_energy
+            dbusservice["/History/ChargedEnergy"] = self.battery.history.charged_energy
+            dbusservice["/History/Clear"] = self.battery.history.clear
+
+            dbusservice["/Io/AllowToCharge"] = 1 if self.battery.get_allow_to_charge() else 0
+            dbusservice["/Io/AllowToDischarge"] = 1 if self.battery.get_allow_to_discharge() else 0
+            dbusservice["/Io/AllowToBalance"] = 1 if self.battery.get_allow_to_balance() else 0
+            dbusservice["/System/NrOfModulesBlockingCharge"] = 0 if self.battery.get_allow_to_charge() else 1
+            dbusservice["/System/NrOfModulesBlockingDischarge"] = 0 if self.battery.get_allow_to_discharge() else 1
+            dbusservice["/System/NrOfModulesOnline"] = 1 if self.battery.online else 0
+            dbusservice["/System/NrOfModulesOffline"] = 0 if self.battery.online else 1
+            dbusservice["/System/MinCellTemperature"] = self.battery.get_min_temperature()
+            dbusservice["/System/MinTemperatureCellId"] = self.battery.get_min_temperature_id()
+            dbusservice["/System/MaxCellTemperature"] = self.battery.get_max_temperature()
+            dbusservice["/System/MaxTemperatureCellId"] = self.battery.get_max_temperature_id()
+            dbusservice["/System/MOSTemperature"] = self.battery.temperature_mos
+            dbusservice["/System/Temperature1"] = self.battery.temperature_1
+            dbusservice["/System/Temperature1Name"] = utils.TEMPERATURE_1_NAME
+            dbusservice["/System/Temperature2"] = self.battery.temperature_2
+            dbusservice["/System/Temperature2Name"] = utils.TEMPERATURE_2_NAME
+            dbusservice["/System/Temperature3"] = self.battery.temperature_3
+            dbusservice["/System/Temperature3Name"] = utils.TEMPERATURE_3_NAME
+            dbusservice["/System/Temperature4"] = self.battery.temperature_4
+            dbusservice["/System/Temperature4Name"] = utils.TEMPERATURE_4_NAME
+
+            # Voltage control
+            dbusservice["/Info/BatteryLowVoltage"] = self.battery.min_battery_voltage
+            dbusservice["/Info/MaxChargeVoltage"] = (
+                round(self.battery.control_voltage + utils.VOLTAGE_DROP, 2) if self.battery.control_voltage is not None else None
             )
-        else:
-            self.battery.current_avg = None
-
-        self._dbusservice["/CurrentAvg"] = self.battery.current_avg
 
-        # Update TimeToGo and/or TimeToSoC
-        try:
-            # if Time-To-Go or Time-To-SoC is enabled
-
-            if (
-                self.battery.capacity is not None
-                and self.battery.current_avg is not None
-                and (utils.TIME_TO_GO_ENABLE or len(utils.TIME_TO_SOC_POINTS) > 0)
-                and (int(time()) - self.battery.time_to_soc_update >= utils.TIME_TO_SOC_RECALCULATE_EVERY)
-            ):
-                self.battery.time_to_soc_update = int(time())
-
-                percent_per_seconds = abs(self.battery.current_avg / (self.battery.capacity / 100)) / 3600
-
-                # Update TimeToGo item
-                if utils.TIME_TO_GO_ENABLE and percent_per_seconds is not None:
-
-                    # Get settings from dbus
-                    settings_battery_life = self.get_settings_with_values(
-                        get_bus(),
-                        "com.victronenergy.settings",
-                        "/Settings/CGwacs/BatteryLife",
-                    )
-                    settings_hub4mode = self.get_settings_with_values(
-                        get_bus(),
-                        "com.victronenergy.settings",
-                        "/Settings/CGwacs/Hub4Mode",
+            # Charge control
+            dbusservice["/Info/MaxChargeCurrent"] = self.battery.control_charge_current
+            dbusservice["/Info/MaxDischargeCurrent"] = self.battery.control_discharge_current
+
+            # Voltage and charge control info (custom dbus paths)
+            dbusservice["/Info/ChargeMode"] = self.battery.charge_mode
+            dbusservice["/Info/ChargeModeDebug"] = self.battery.charge_mode_debug
+            dbusservice["/Info/ChargeModeDebugFloat"] = self.battery.charge_mode_debug_float
+            dbusservice["/Info/ChargeModeDebugBulk"] = self.battery.charge_mode_debug_bulk
+            dbusservice["/Info/ChargeLimitation"] = self.battery.charge_limitation
+            dbusservice["/Info/DischargeLimitation"] = self.battery.discharge_limitation
+
+            # Updates from cells
+            dbusservice["/System/MinVoltageCellId"] = self.battery.get_min_cell_desc()
+            dbusservice["/System/MaxVoltageCellId"] = self.battery.get_max_cell_desc()
+            dbusservice["/System/MinCellVoltage"] = self.battery.get_min_cell_voltage()
+            dbusservice["/System/MaxCellVoltage"] = self.battery.get_max_cell_voltage()
+            dbusservice["/Balancing"] = self.battery.get_balancing()
+
+            # Update the alarms
+            self.battery.protection.set_previous()
+            dbusservice["/Alarms/LowVoltage"] = self.battery.protection.low_voltage
+            dbusservice["/Alarms/LowCellVoltage"] = self.battery.protection.low_cell_voltage
+            # disable high voltage warning temporarly, if loading to bulk voltage and bulk voltage reached is 30 minutes ago
+            dbusservice["/Alarms/HighVoltage"] = (
+                self.battery.protection.high_voltage
+                if (self.battery.soc_reset_requested is False and self.battery.soc_reset_last_reached < int(time()) - (60 * 30))
+                else 0
+            )
+            dbusservice["/Alarms/HighCellVoltage"] = (
+                self.battery.protection.high_cell_voltage
+                if (self.battery.soc_reset_requested is False and self.battery.soc_reset_last_reached < int(time()) - (60 * 30))
+                else 0
+            )
+            dbusservice["/Alarms/LowSoc"] = self.battery.protection.low_soc
+            dbusservice["/Alarms/HighChargeCurrent"] = self.battery.protection.high_charge_current
+            dbusservice["/Alarms/HighDischargeCurrent"] = self.battery.protection.high_discharge_current
+            dbusservice["/Alarms/CellImbalance"] = self.battery.protection.cell_imbalance
+            dbusservice["/Alarms/InternalFailure"] = self.battery.protection.internal_failure
+            dbusservice["/Alarms/HighChargeTemperature"] = self.battery.protection.high_charge_temperature
+            dbusservice["/Alarms/LowChargeTemperature"] = self.battery.protection.low_charge_temperature
+            dbusservice["/Alarms/HighTemperature"] = self.battery.protection.high_temperature
+            dbusservice["/Alarms/LowTemperature"] = self.battery.protection.low_temperature
+            dbusservice["/Alarms/BmsCable"] = 2 if self.battery.block_because_disconnect else 0
+            dbusservice["/Alarms/HighInternalTemperature"] = self.battery.protection.high_internal_temperature
+            dbusservice["/Alarms/FuseBlown"] = self.battery.protection.fuse_blown
+
+            # cell voltages
+            if utils.BATTERY_CELL_DATA_FORMAT > 0:
+                try:
+                    # use the paths created in setup_vedbus() and only publish cell voltages
+                    # that changed more than the deadband since they were last published
+                    for i, cellpath in enumerate(self.cell_voltage_paths):
+                        voltage = self.battery.get_cell_voltage(i)
+                        published = self.cell_voltages_published[i]
+                        if voltage != published and (
+                            voltage is None or published is None or round(abs(voltage - published), 6) >= utils.BATTERY_CELL_DATA_DEADBAND
+                        ):
+                            dbusservice[cellpath] = voltage
+                            self.cell_voltages_published[i] = voltage
+
+                    for i, balancepath in enumerate(self.cell_balance_paths):
+                        balance = self.battery.get_cell_balancing(i)
+                        if balance != self.cell_balances_published[i]:
+                            dbusservice[balancepath] = balance
+                            self.cell_balances_published[i] = balance
+
+                    pathbase = "Cell" if (utils.BATTERY_CELL_DATA_FORMAT & 2) else "Voltages"
+                    dbusservice["/%s/Sum" % pathbase] = round(self.battery.get_cell_voltage_sum(), 2)
+                    dbusservice["/%s/Diff" % pathbase] = round(
+                        self.battery.get_max_cell_voltage() - self.battery.get_min_cell_voltage(),
+                        3,
                     )
+                except Exception:
+                    # set error code, to show in the GUI that something is wrong
+                    self.battery.manage_error_code(8)
+
+                    exception_type, exception_object, exception_traceback = sys.exc_info()
+                    file = exception_traceback.tb_frame.f_code.co_filename
+                    line = exception_traceback.tb_lineno
+                    logger.error("Non blocking exception occurred: " + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}")
+
+            # Calculate average current for the last 300 cycles, but max. the last 5 minutes
+            self.battery.previous_current_avg = self.battery.current_avg
+            if self.battery.current_calc is not None:
+                self.battery.current_avg_statistics.add(self.battery.current_calc)
+                self.battery.current_avg = round(self.battery.current_avg_statistics.average, 2)
+            else:
+                self.battery.current_avg = None
 
-                    hub4mode = int(settings_hub4mode["Settings"]["CGwacs"]["Hub4Mode"]) if "Settings" in settings_hub4mode else None
-                    state = (
-                        int(settings_battery_life["Settings"]["CGwacs"]["BatteryLife"]["State"])
-                        if "Settings" in settings_battery_life and "State" in settings_battery_life["Settings"]["CGwacs"]["BatteryLife"]
-                        else None
-                    )
+            dbusservice["/CurrentAvg"] = self.battery.current_avg
 
-                    if (
-                        hub4mode == 1
-                        and state != 9
-                        and "Settings" in settings_battery_life
-                        and "MinimumSocLimit" in settings_battery_life["Settings"]["CGwacs"]["BatteryLife"]
-                        and "SocLimit" in settings_battery_life["Settings"]["CGwacs"]["BatteryLife"]
-                    ):
-                        # Optimized without BatteryLife
-                        if state >= 10 and state <= 12:
-                            time_to_go_soc = int(float(settings_battery_life["Settings"]["CGwacs"]["BatteryLife"]["MinimumSocLimit"]))
-                            logger.debug(f"Time-to-Go: Use /Settings/CGwacs/BatteryLife/MinimumSocLimit: {time_to_go_soc}")
-                        # Optimized with BatteryLife
+            # Update TimeToGo and/or TimeToSoC
+            try:
+                # if Time-To-Go or Time-To-SoC is enabled
+
+                if (
+                    self.battery.capacity is not None
+                    and self.battery.current_avg is not None
+                    and (utils.TIME_TO_GO_ENABLE or len(utils.TIME_TO_SOC_POINTS) > 0)
+                    and (int(time()) - self.battery.time_to_soc_update >= utils.TIME_TO_SOC_RECALCULATE_EVERY)
+                ):
+                    self.battery.time_to_soc_update = int(time())
+
+                    percent_per_seconds = abs(self.battery.current_avg / (self.battery.capacity / 100)) / 3600
+
+                    # Update TimeToGo item
+                    if utils.TIME_TO_GO_ENABLE and percent_per_seconds is not None:
+
+                        # Get settings from the subscribed dbus items
+                        hub4mode = self.settings_ess["/Settings/CGwacs/Hub4Mode"].get_value()
+                        state = self.settings_ess["/Settings/CGwacs/BatteryLife/State"].get_value()
+                        minimum_soc_limit = self.settings_ess["/Settings/CGwacs/BatteryLife/MinimumSocLimit"].get_value()
+                        soc_limit = self.settings_ess["/Settings/CGwacs/BatteryLife/SocLimit"].get_value()
+
+                        if hub4mode == 1 and state != 9 and minimum_soc_limit is not None and soc_limit is not None:
+                            # Optimized without BatteryLife
+                            if state is not None and state >= 10 and state <= 12:
+                                time_to_go_soc = int(float(minimum_soc_limit))
+                                logger.debug(f"Time-to-Go: Use /Settings/CGwacs/BatteryLife/MinimumSocLimit: {time_to_go_soc}")
+                            # Optimized with BatteryLife
+                            else:
+                                time_to_go_soc = int(float(soc_limit))
+                                logger.debug(f"Time-to-Go: Use /Settings/CGwacs/BatteryLife/SocLimit: {time_to_go_soc}")
+                        # External control
+                        # Keep batteries charged
+                        # all others fall back to default
                         else:
-                            time_to_go_soc = int(float(settings_battery_life["Settings"]["CGwacs"]["BatteryLife"]["SocLimit"]))
-                            logger.debug(f"Time-to-Go: Use /Settings/CGwacs/BatteryLife/SocLimit: {time_to_go_soc}")
-                    # External control
-                    # Keep batteries charged
-                    # all others fall back to default
-                    else:
-                        time_to_go_soc = utils.SOC_LOW_WARNING
-                        logger.debug(f"Time-to-Go: Use utils.SOC_LOW_WARNING: {time_to_go_soc}")
-
-                    # Update TimeToGo item, has to be a positive int since it's used from dbus-systemcalc-py
-                    time_to_go = self.battery.get_time_to_soc(
-                        # switch value depending on charging/discharging
-                        (time_to_go_soc if self.battery.current_avg < 0 else 100),
-                        percent_per_seconds,
-                        True,
-                    )
-
-                    # Check that time_to_go is not None and current is not near zero
-                    self._dbusservice["/TimeToGo"] = abs(int(time_to_go)) if time_to_go is not None and abs(self.battery.current_avg) > 0.1 else None
-
-                # Update TimeToSoc items
-                if len(utils.TIME_TO_SOC_POINTS) > 0:
-                    for num in utils.TIME_TO_SOC_POINTS:
-                        self._dbusservice["/TimeToSoC/" + str(num)] = (
-                            self.battery.get_time_to_soc(num, percent_per_seconds) if self.battery.current_avg else None
+                            time_to_go_soc = utils.SOC_LOW_WARNING
+                            logger.debug(f"Time-to-Go: Use utils.SOC_LOW_WARNING: {time_to_go_soc}")
+
+                        # Update TimeToGo item, has to be a positive int since it's used from dbus-systemcalc-py
+                        time_to_go = self.battery.get_time_to_soc(
+                            # switch value depending on charging/discharging
+                            (time_to_go_soc if self.battery.current_avg < 0 else 100),
+                            percent_per_seconds,
+                            True,
                         )
 
-        except Exception:
-            # set error code, to show in the GUI that something is wrong
-            self.battery.manage_error_code(8)
+                        # Check that time_to_go is not None and current is not near zero
+                        dbusservice["/TimeToGo"] = abs(int(time_to_go)) if time_to_go is not None and abs(self.battery.current_avg) > 0.1 else None
 
-            exception_type, exception_object, exception_traceback = sys.exc_info()
-            file = exception_traceback.tb_frame.f_code.co_filename
-            line = exception_traceback.tb_lineno
-            logger.error("Non blocking exception occurred: " + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}")
+                    # Update TimeToSoc items
+                    if len(utils.TIME_TO_SOC_POINTS) > 0:
+                        for num in utils.TIME_TO_SOC_POINTS:
+                            dbusservice["/TimeToSoC/" + str(num)] = self.battery.get_time_to_soc(num, percent_per_seconds) if self.battery.current_avg else None
 
-        # calculate history values every 60 seconds
-        if utils.HISTORY_ENABLE and int(time()) - self.history_calculated_last_time > 60:
-            self.battery.history_calculate_values()
-            self.history_calculated_last_time = int(time())
-
-        # save settings every 15 seconds to dbus
-        if int(time()) % 15:
-            self.save_current_battery_state()
-
-        if self.battery.soc is not None:
-            logger.debug("logged to dbus [%s]" % str(round(self.battery.soc, 2)))
-            self.battery.log_cell_data()
-
-        if self.battery.has_settings:
-            self._dbusservice["/Settings/ResetSoc"] = self.battery.reset_soc
+            except Exception:
+                # set error code, to show in the GUI that something is wrong
+                self.battery.manage_error_code(8)
 
-        # get all paths from the dbus service
-        if utils.PUBLISH_BATTERY_DATA_AS_JSON:
-            all_items = self._dbusservice._dbusnodes["/"].GetItems()
+                exception_type, exception_object, exception_traceback = sys.exc_info()
+                file = exception_traceback.tb_frame.f_code.co_filename
+                line = exception_traceback.tb_lineno
+                logger.error("Non blocking exception occurred: " + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}")
 
-            # Convert dbus data types to python native data types
-            all_items = {key: self.dbus_to_python(value["Value"]) for key, value in all_items.items()}
+            # calculate history values every 60 seconds
+            if utils.HISTORY_ENABLE and int(time()) - self.history_calculated_last_time > 60:
+                self.battery.history_calculate_values()
+                self.history_calculated_last_time = int(time())
 
-            # Filter out unwanted keys
-            filtered_data = {key: value for key, value in all_items.items() if key not in ["/JsonData", "/Settings/ResetSoc", "/Settings/HasSettings"]}
+            # save changed settings every 15 seconds to dbus
+            if int(time()) - self.save_current_battery_state_last_time >= 15:
+                self.save_current_battery_state()
+                self.save_current_battery_state_last_time = int(time())
 
-            # Set empty lists to empty string
-            filtered_data = {key: "" if value == [] else value for key, value in filtered_data.items()}
+            if self.battery.soc is not None:
+                logger.debug("logged to dbus [%s]" % str(round(self.battery.soc, 2)))
+                self.battery.log_cell_data()
 
-            cascaded_data_json = json.dumps(self.cascade_data(filtered_data))
+            if self.battery.has_settings:
+                dbusservice["/Settings/ResetSoc"] = self.battery.reset_soc
 
-            # publish the data to the JsonData path
-            self._dbusservice["/JsonData"] = cascaded_data_json
+            if utils.PUBLISH_BATTERY_DATA_AS_JSON:
+                self.publish_json_data(dbusservice)
 
     def dbus_to_python(self, data) -> any:
         """
@@ -1206,23 +1333,102 @@ class DbusHelper:
             data = new_data
         return data
 
-    def cascade_data(self, data) -> dict:
+    def publish_json_data(self, dbusservice) -> None:
+        """
+        Update the changed leaves of the nested JSON data and publish it
+        every `PUBLISH_BATTERY_DATA_AS_JSON_INTERVAL` seconds to `/JsonData`.
+
+        :param dbusservice: The service context of the current publish cycle.
+        """
+        dbusobjects = self._dbusservice._dbusobjects
+
+        # rebuild the structure, if paths were added or removed
+        if dbusobjects.keys() != self.json_data_leaves.keys():
+            self.json_data = {}
+            self.json_data_leaves = {}
+            # create the leaves in the order of the dbus paths to keep the order of the keys
+            for path in dbusobjects:
+                self.get_json_data_leaf(path)
+            self.json_data_changed_paths = set(dbusobjects)
+        else:
+            # only the changes made in this cycle are collected in the service context
+            self.json_data_changed_paths.update(dbusservice.changes)
+
+        if monotonic() - self.json_data_last_time < utils.PUBLISH_BATTERY_DATA_AS_JSON_INTERVAL:
+            return
+
+        self.json_data_last_time = monotonic()
+
+        for path in self.json_data_changed_paths:
+            leaf = self.json_data_leaves.get(path)
+            if leaf is None:
+                continue
+
+            value = self.dbus_to_python(dbusobjects[path].local_get_value()) if path in dbusobjects else None
+
+            # set empty lists, invalid values and missing paths to empty string
+            leaf[0][leaf[1]] = "" if value in ([], None) else value
+
+        self.json_data_changed_paths.clear()
+
+        dbusservice["/JsonData"] = json.dumps(self.json_data)
+
+    def external_value_changed(self, path: str, value) -> bool:
+        """
+        Called by the dbus items, when another process changes a value.
+        Passes the change to the callback of the path and marks the path as changed for the JSON data,
+        since these changes do not show up in the service context of the publish cycle.
+
+        :param path: The dbus path.
+        :param value: The new value.
+        :return: The result of the callback of the path, the change is accepted if it's truthy.
+        """
+        result = VeDbusService._value_changed(self._dbusservice, path, value)
+        if result:
+            self.json_data_changed_paths.add(path)
+        return result
+
+    def get_json_data_leaf(self, path: str) -> Union[tuple, None]:
         """
-        Cascade the data to a nested dictionary structure.
+        Create the nested structure in `json_data` for a dbus path and cache the parent dictionary and key.
 
-        :param data: The data to cascade.
-        :return: The cascaded data.
+        :param path: The dbus path.
+        :return: A tuple with the parent dictionary and the key or None, if the path is not published.
         """
-        cascaded = {}
-        for key, value in data.items():
-            parts = key.strip("/").split("/")
-            d = cascaded
+        if path in ["/JsonData", "/Settings/ResetSoc", "/Settings/HasSettings"]:
+            leaf = None
+        else:
+            parts = path.strip("/").split("/")
+            d = self.json_data
             for part in parts[:-1]:
-                if part not in d:
-                    d[part] = {}
-                d = d[part]
-            d[parts[-1]] = value
-        return cascaded
+                d = d.setdefault(part, {})
+            leaf = (d, parts[-1])
+
+        self.json_data_leaves[path] = leaf
+        return leaf
+
+    def get_settings_with_items(self, bus, service: str, object_path: str) -> Union[dict, None]:
+        """
+        Get all settings with values from dbus with one GetItems call.
+        This is much faster than walking the tree with Introspect, like `get_settings_with_values` does.
+
+        :param bus: The dbus object.
+        :param service: The service name.
+        :param object_path: The object path.
+        :return: A dictionary with all settings and values or None, if the service does not support GetItems.
+        """
+        try:
+            items = bus.call_blocking(service, "/", "com.victronenergy.BusItem", "GetItems", "", [])
+        except dbus.exceptions.DBusException as e:
+            logger.debug(f"get_settings_with_items(): GetItems failed: {e}")
+            return None
+
+        result = {}
+        for path, item in items.items():
+            if path == object_path or path.startswith(object_path.rstrip("/") + "/"):
+                self.merge_dicts(result, self.create_nested_dict(path, str(item["Value"])))
+
+        return result
 
     def get_settings_with_values(self, bus, service: str, object_path: str, recursive: bool = True) -> dict:
         """
@@ -1397,6 +1603,10 @@ class DbusHelper:
 
         :return: True if the values have been saved, otherwise False.
         """
+        # the settings are not set up yet
+        if self.path_battery is None:
+            return False
+
         result = True
 
         if self.battery.allow_max_voltage != self.save_charge_details_last["allow_max_voltage"]:
@@ -1449,10 +1659,14 @@ class DbusHelper:
             )
             self.save_charge_details_last["soc_reset_last_reached"] = self.battery.soc_reset_last_reached
 
+        # save history values only if they changed since the last save
+        if not self.battery.history.changed:
+            return result
+
         # copy history values
         history_values_dict = self.battery.history.__dict__.copy()
         # remove values that should not be saved
-        history_remove_values = self.battery.history.exclude_values_to_calculate + ["exclude_values_to_calculate"]
+        history_remove_values = self.battery.history.exclude_values_to_calculate + ["exclude_values_to_calculate", "changed"]
         # remove keys that should not be saved
         for key in history_remove_values:
             history_values_dict.pop(key, None)
@@ -1475,6 +1689,9 @@ class DbusHelper:
             )
             self.save_charge_details_last["history_values"] = history_values
 
+        if result:
+            self.battery.history.changed = False
+
         return result
 
     def telemetry_upload(self) -> None:
@@ -272,11 +272,18 @@ if [ "$bluetooth_length" -gt 0 ]; then
             echo "trap 'kill -TERM \$PID' TERM INT"
             echo
             # close all open connections, else the driver can't connect
-            echo "bluetoothctl disconnect $3 > /dev/null 2>&1"
+            for mac_address in $3; do
+                echo "bluetoothctl disconnect $mac_address > /dev/null 2>&1"
+            done
             echo
             echo "# Start the main process"
             echo "exec 2>&1"
-            echo "python /data/apps/dbus-serialbattery/dbus-serialbattery.py $2 $3 &"
+            # in hub mode the driver reads the BMS list from the config file
+            if [ "$2" == "Hub_Ble" ]; then
+                echo "python /data/apps/dbus-serialbattery/dbus-serialbattery.py $2 &"
+            else
+                echo "python /data/apps/dbus-serialbattery/dbus-serialbattery.py $2 $3 &"
+            fi
             echo
             echo "# Capture the PID of the child process"
             echo "PID=\$!"
@@ -296,13 +303,29 @@ if [ "$bluetooth_length" -gt 0 ]; then
     # Example
     # install_blebattery_service 0 Jkbms_Ble C8:47:8C:00:00:00
     # install_blebattery_service 1 Jkbms_Ble C8:47:8C:00:00:11
-
-    for (( i=0; i<bluetooth_length; i++ ));
-    do
-        # split BMS type and MAC address
-        IFS=' ' read -r -a bms <<< "${bms_array[$i]}"
-        install_blebattery_service $i "${bms[0]}" "${bms[1]}"
-    done
+    # install_blebattery_service hub Hub_Ble "C8:47:8C:00:00:00 C8:47:8C:00:00:11"
+
+    # get bluetooth hub mode
+    bluetooth_hub=$(awk -F "=" '/^BLUETOOTH_HUB/ {print $2}' /data/apps/dbus-serialbattery/config.ini)
+
+    if [[ $bluetooth_hub == *"True"* ]]; then
+        # one service for all BMS, which share the Bluetooth adapter
+        mac_addresses=""
+        for (( i=0; i<bluetooth_length; i++ ));
+        do
+            # split BMS type and MAC address
+            IFS=' ' read -r -a bms <<< "${bms_array[$i]}"
+            mac_addresses="$mac_addresses ${bms[1]}"
+        done
+        install_blebattery_service hub Hub_Ble "${mac_addresses# }"
+    else
+        for (( i=0; i<bluetooth_length; i++ ));
+        do
+            # split BMS type and MAC address
+            IFS=' ' read -r -a bms <<< "${bms_array[$i]}"
+            install_blebattery_service $i "${bms[0]}" "${bms[1]}"
+        done
+    fi
 
     echo
 
@@ -85,6 +85,7 @@ from utils import (
     BATTERY_ADDRESSES,
     BMS_TYPE,
     bytearray_to_string,
+    close_serial_port,
     logger,
 )
 
@@ -219,6 +220,10 @@ class standalone_serialbattery:
                     logging.error("Non blocking exception occurred: " + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}")
                     # Ignore any malfunction test_function()
                     pass
+                finally:
+                    # the minimalmodbus drivers (e.g. Ecs) change the settings of the serial port with their own handle,
+                    # so reopen the pooled port for the next test, else it keeps the settings of the previous test
+                    close_serial_port(_port)
             retry += 1
             sleep(0.5)
 
@@ -349,13 +354,15 @@ class standalone_serialbattery:
 
                 can_transport_interface = CanTransportInterface()
                 can_transport_interface.can_message_cache_callback = can_thread.get_message_cache
+                can_transport_interface.can_subscribe_callback = can_thread.subscribe
+                can_transport_interface.can_unsubscribe_callback = can_thread.unsubscribe
                 can_transport_interface.can_bus = can_thread.can_bus
                 logging.debug("Wait shortly to make sure that all needed data is in the cache")
                 # Slowest message cycle transmission is every 1 second, wait a bit more for the first time to fetch all needed data (only jk bms)
                 sleep(2)
                 addresses = [None] if len(BATTERY_ADDRESSES) == 0 else BATTERY_ADDRESSES  # use default address, if not configured
 
-                for busspeed in [250, 500]:
+                def search_can_batteries() -> None:
                     for address in addresses:
                         bat = self.get_battery(self.devpath, address, can_transport_interface)
                         if bat:
@@ -364,13 +371,29 @@ class standalone_serialbattery:
                         else:
                             logging.warning(f"No battery connection at {self.devpath} and this address {str(address)}")
 
-                    # if we've found at least 1 battery, stop the search here. otherwise retry with other bus speeds
-                    if len(self.battery) > 0:
-                        break
+                # search with the current bitrate first, since changing the bitrate resets the link of the whole bus
+                search_can_batteries()
 
-                    logger.info(f"Found no devices on can bus, retrying with {busspeed} kbps")
-                    can_thread.setup_can(channel=self.devpath, bitrate=busspeed, force=True)
-                    sleep(2)
+                if len(self.battery) == 0:
+                    # detect the bitrate by listening to the bus, instead of trying the bitrates one after another
+                    bitrate = can_thread.detect_bitrate([250, 500])
+
+                    if bitrate is not None:
+                        search_can_batteries()
+                    else:
+                        for busspeed in [250, 500]:
+                            logger.info(f"Found no devices on can bus, retrying with {busspeed} kbps")
+                            can_thread.setup_can(channel=self.devpath, bitrate=busspeed, force=True)
+                            sleep(2)
+                            search_can_batteries()
+
+                            # if we've found at least 1 battery, stop the search here. otherwise retry with other bus speeds
+                            if len(self.battery) > 0:
+                                break
+
+                # receive only the frames of the found batteries
+                if len(self.battery) > 0:
+                    can_thread.enable_filters()
 
         # SERIAL
         else:  # Serial, modbus, ...
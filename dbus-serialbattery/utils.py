@@ -3,11 +3,15 @@
 import bisect
 import configparser
 import logging
+import select
 import sys
+import threading
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
 from struct import unpack_from
-from time import sleep
-from typing import List, Any, Callable, Union
+from time import monotonic
+from typing import Deque, Dict, Iterator, List, Any, Callable, Tuple, Union
 
 # Third-party imports
 import serial
@@ -203,6 +207,7 @@ if SOC_RESET_AFTER_DAYS and SOC_RESET_VOLTAGE < MAX_CELL_VOLTAGE:
 
 # --------- SoC Calculation ---------
 SOC_CALCULATION: bool = get_bool_from_config("DEFAULT", "SOC_CALCULATION")
+CURRENT_INTEGRATION_AT_FRAME_RATE: bool = get_bool_from_config("DEFAULT", "CURRENT_INTEGRATION_AT_FRAME_RATE")
 
 # --------- Current correction --------
 CURRENT_REPORTED_BY_BMS: list = get_list_from_config("DEFAULT", "CURRENT_REPORTED_BY_BMS", float)
@@ -216,6 +221,8 @@ CURRENT_CORRECTION: bool = CURRENT_REPORTED_BY_BMS != CURRENT_MEASURED_BY_USER
 # --------- Bluetooth BMS ---------
 BLUETOOTH_USE_POLLING = get_bool_from_config("DEFAULT", "BLUETOOTH_USE_POLLING")
 BLUETOOTH_FORCE_RESET_BLE_STACK = get_bool_from_config("DEFAULT", "BLUETOOTH_FORCE_RESET_BLE_STACK")
+# list of "<BMS type> <MAC address>" entries, used in hub mode
+BLUETOOTH_BMS: list = get_list_from_config("DEFAULT", "BLUETOOTH_BMS", str)
 
 # --------- Daisy Chain Configuration (Multiple BMS on one cable) ---------
 BATTERY_ADDRESSES: list = get_list_from_config("DEFAULT", "BATTERY_ADDRESSES", str)
@@ -470,7 +477,12 @@ Poll interval in milliseconds
 """
 PUBLISH_CONFIG_VALUES: bool = get_bool_from_config("DEFAULT", "PUBLISH_CONFIG_VALUES")
 PUBLISH_BATTERY_DATA_AS_JSON: bool = get_bool_from_config("DEFAULT", "PUBLISH_BATTERY_DATA_AS_JSON")
+PUBLISH_BATTERY_DATA_AS_JSON_INTERVAL: float = get_float_from_config("DEFAULT", "PUBLISH_BATTERY_DATA_AS_JSON_INTERVAL")
+"""
+Interval in seconds in which the JSON data is serialized and published
+"""
 BATTERY_CELL_DATA_FORMAT: int = get_int_from_config("DEFAULT", "BATTERY_CELL_DATA_FORMAT")
+BATTERY_CELL_DATA_DEADBAND: float = get_float_from_config("DEFAULT", "BATTERY_CELL_DATA_DEADBAND")
 MIDPOINT_ENABLE: bool = get_bool_from_config("DEFAULT", "MIDPOINT_ENABLE")
 TEMPERATURE_SOURCE_BATTERY: List[int] = get_list_from_config("DEFAULT", "TEMPERATURE_SOURCE_BATTERY", int)
 TEMPERATURE_1_NAME: str = config["DEFAULT"]["TEMPERATURE_1_NAME"]
@@ -640,24 +652,359 @@ def bytearray_to_string(data: bytearray) -> str:
     return "".join(f"\\x{byte:02x}" for byte in data)
 
 
-def open_serial_port(port: str, baud: int) -> Union[serial.Serial, None]:
+class RollingStatistics:
+    """
+    Rolling statistics over the last added values.
+    The window can be limited by the number of values, by the age of the values or both.
+    Sum, average, minimum and maximum are updated with each added value, without iterating over the window.
+
+    :param size: Maximum number of values in the window, None for no limit
+    :param time_window: Maximum age of the values in seconds, None for no limit
+    :param ewma_alpha: Smoothing factor between 0 and 1 for the exponentially weighted moving average, None to disable it
+    """
+
+    def __init__(self, size: int = None, time_window: float = None, ewma_alpha: float = None):
+        self.size: int = size
+        self.time_window: float = time_window
+        self.ewma_alpha: float = ewma_alpha
+
+        self.sum: float = 0
+        """
+        Sum of all values in the window.
+        """
+
+        self.ewma: float = None
+        """
+        Exponentially weighted moving average of all added values, if `ewma_alpha` is set.
+        """
+
+        # values in the window as (index, timestamp, value)
+        self._values: Deque[Tuple[int, float, float]] = deque()
+        # candidates for the minimum and maximum as (index, value), the first entry is the current minimum/maximum
+        self._minimum: Deque[Tuple[int, float]] = deque()
+        self._maximum: Deque[Tuple[int, float]] = deque()
+        self._index: int = 0
+        # recalculate the sum from time to time to avoid accumulating floating point errors
+        self._added_since_sum: int = 0
+
+    def add(self, value: float, timestamp: float = None) -> None:
+        """
+        Add a value to the window and remove the values that are outside of the window.
+
+        :param value: Value to add
+        :param timestamp: Timestamp of the value in seconds, defaults to `time.monotonic()`
+        :return: None
+        """
+        timestamp = monotonic() if timestamp is None else timestamp
+
+        self._values.append((self._index, timestamp, value))
+        self.sum += value
+
+        while self._minimum and self._minimum[-1][1] >= value:
+            self._minimum.pop()
+        self._minimum.append((self._index, value))
+
+        while self._maximum and self._maximum[-1][1] <= value:
+            self._maximum.pop()
+        self._maximum.append((self._index, value))
+
+        self._index += 1
+
+        self.ewma = value if self.ewma is None or self.ewma_alpha is None else self.ewma + self.ewma_alpha * (value - self.ewma)
+
+        # remove the oldest values, if the window is full
+        while self.size is not None and len(self._values) > self.size:
+            self._remove_oldest()
+
+        # remove values that are too old
+        while self.time_window is not None and self._values and self._values[0][1] < timestamp - self.time_window:
+            self._remove_oldest()
+
+        self._added_since_sum += 1
+        if self._added_since_sum > len(self._values):
+            self.sum = sum(value for _, _, value in self._values)
+            self._added_since_sum = 0
+
+    def _remove_oldest(self) -> None:
+        """
+        Remove the oldest value from the window.
+
+        :return: None
+        """
+        index, _, value = self._values.popleft()
+        self.sum -= value
+
+        if self._minimum[0][0] == index:
+            self._minimum.popleft()
+        if self._maximum[0][0] == index:
+            self._maximum.popleft()
+
+    def clear(self) -> None:
+        """
+        Remove all values from the window and reset the EWMA.
+
+        :return: None
+        """
+        self._values.clear()
+        self._minimum.clear()
+        self._maximum.clear()
+        self.sum = 0
+        self.ewma = None
+        self._added_since_sum = 0
+
+    @property
+    def count(self) -> int:
+        """
+        Number of values in the window.
+        """
+        return len(self._values)
+
+    @property
+    def average(self) -> Union[float, None]:
+        """
+        Average of the values in the window or None, if the window is empty.
+        """
+        return self.sum / len(self._values) if self._values else None
+
+    @property
+    def minimum(self) -> Union[float, None]:
+        """
+        Minimum of the values in the window or None, if the window is empty.
+        """
+        return self._minimum[0][1] if self._minimum else None
+
+    @property
+    def maximum(self) -> Union[float, None]:
+        """
+        Maximum of the values in the window or None, if the window is empty.
+        """
+        return self._maximum[0][1] if self._maximum else None
+
+    @property
+    def last(self) -> Union[float, None]:
+        """
+        Last added value or None, if the window is empty.
+        """
+        return self._values[-1][2] if self._values else None
+
+    @property
+    def time_span(self) -> float:
+        """
+        Time in seconds between the oldest and the newest value in the window.
+        """
+        return self._values[-1][1] - self._values[0][1] if self._values else 0
+
+
+class ChargeIntegrator:
+    """
+    Integrates current and power of each sample as it arrives, e.g. from a receiver thread.
+    The totals only increase, so multiple consumers can read their own increments with `get_delta()`.
+
+    :param max_gap: Maximum time in seconds between two samples, longer gaps are not integrated
     """
-    Open a serial port.
+
+    def __init__(self, max_gap: float = 5):
+        self.max_gap: float = max_gap
+        self.lock: threading.Lock = threading.Lock()
+
+        self.charge_charged: float = 0
+        """
+        Charged charge in Ah since the start.
+        """
+        self.charge_discharged: float = 0
+        """
+        Discharged charge in Ah since the start, positive value.
+        """
+        self.energy_charged: float = 0
+        """
+        Charged energy in Wh since the start.
+        """
+        self.energy_discharged: float = 0
+        """
+        Discharged energy in Wh since the start, positive value.
+        """
+
+        self._last_current: float = None
+        self._last_voltage: float = None
+        self._last_timestamp: float = None
+        self._consumers: Dict[str, Tuple[float, float, float, float]] = {}
+
+    def add(self, current: float, voltage: float = None, timestamp: float = None) -> None:
+        """
+        Add a sample. The previous sample is integrated until the timestamp of this sample.
+
+        :param current: Current in A
+        :param voltage: Voltage in V, None if unknown
+        :param timestamp: Monotonic timestamp in seconds, defaults to now
+        :return: None
+        """
+        if timestamp is None:
+            timestamp = monotonic()
+
+        with self.lock:
+            if self._last_current is not None:
+                time_delta = timestamp - self._last_timestamp
+                if 0 < time_delta <= self.max_gap:
+                    charge = self._last_current * time_delta / 3600
+                    energy = charge * self._last_voltage if self._last_voltage is not None else 0
+                    if charge > 0:
+                        self.charge_charged += charge
+                        self.energy_charged += energy
+                    else:
+                        self.charge_discharged -= charge
+                        self.energy_discharged -= energy
+
+            self._last_current = current
+            self._last_voltage = voltage
+            self._last_timestamp = timestamp
+
+    def get_delta(self, consumer: str) -> Tuple[float, float, float, float]:
+        """
+        Get the integrated values since the last call of the same consumer.
+
+        :param consumer: Name of the consumer
+        :return: Tuple of charged and discharged charge in Ah and charged and discharged energy in Wh
+        """
+        with self.lock:
+            totals = (self.charge_charged, self.charge_discharged, self.energy_charged, self.energy_discharged)
+
+        last = self._consumers.get(consumer, totals)
+        self._consumers[consumer] = totals
+        return tuple(total - last_total for total, last_total in zip(totals, last))
+
+
+# Serial ports opened by the driver, keyed by the port name
+# They stay open for the lifetime of the driver and are shared by all batteries on the same port
+serial_ports: Dict[str, serial.Serial] = {}
+
+
+def get_serial_port(port: str, baud: int, timeout: float = 0.1, parity: str = serial.PARITY_NONE) -> Union[serial.Serial, None]:
+    """
+    Get an open serial port from the port pool.
+    The port is opened only once and reused for all following calls.
+    Baud rate, timeout and parity are only reconfigured, if they differ from the current settings.
+    Settings changed with another handle of the same device, e.g. by minimalmodbus, are not noticed,
+    so the port has to be closed with `close_serial_port` after such a use.
+    A port that was closed, e.g. after a `SerialException`, is reopened transparently.
 
     :param port: Serial port
     :param baud: Baud rate
+    :param timeout: Read timeout in seconds
+    :param parity: Parity, one of the `serial.PARITY_*` constants
     :return: Opened serial port or None if failed
     """
+    ser = serial_ports.get(port)
+
+    if ser is not None and ser.is_open:
+        # changing a setting reconfigures the port, so only do it when needed
+        if ser.baudrate != baud:
+            ser.baudrate = baud
+        if ser.timeout != timeout:
+            ser.timeout = timeout
+        if ser.parity != parity:
+            ser.parity = parity
+        return ser
+
     tries = 3
     while tries > 0:
         try:
-            return serial.Serial(port, baudrate=baud, timeout=0.1)
+            ser = serial.Serial(port, baudrate=baud, timeout=timeout, parity=parity)
+            serial_ports[port] = ser
+            return ser
         except serial.SerialException as e:
             logger.error(e)
             tries -= 1
+
+    serial_ports.pop(port, None)
     return None
 
 
+def close_serial_port(port: str) -> None:
+    """
+    Close a serial port and remove it from the port pool.
+    The next call of `get_serial_port` opens it again.
+
+    :param port: Serial port
+    :return: None
+    """
+    ser = serial_ports.pop(port, None)
+    if ser is not None:
+        try:
+            ser.close()
+        except serial.SerialException as e:
+            logger.error(e)
+
+
+def close_serial_ports() -> None:
+    """
+    Close all serial ports of the port pool.
+    Should be called when the driver exits.
+
+    :return: None
+    """
+    for port in list(serial_ports):
+        close_serial_port(port)
+
+
+@contextmanager
+def serial_port(port: str, baud: int, timeout: float = 0.1, parity: str = serial.PARITY_NONE) -> Iterator[serial.Serial]:
+    """
+    Context manager to use a serial port from the port pool.
+    Unlike `serial.Serial` the port is not closed when leaving the context, it is only closed
+    when a `SerialException` occurs, so that it is reopened on the next use.
+
+    :param port: Serial port
+    :param baud: Baud rate
+    :param timeout: Read timeout in seconds
+    :param parity: Parity, one of the `serial.PARITY_*` constants
+    :return: Opened serial port
+    """
+    ser = get_serial_port(port, baud, timeout, parity)
+    if ser is None:
+        raise serial.SerialException(f"Could not open serial port {port}")
+
+    try:
+        yield ser
+    except serial.SerialException:
+        close_serial_port(port)
+        raise
+
+
+def wait_for_serialport_data(ser: serial.Serial, timeout: float) -> bool:
+    """
+    Wait until data is available on a serial port.
+    Waits on the file descriptor of the port, so the driver does not wake up until data arrives.
+
+    :param ser: Serial port
+    :param timeout: Timeout in seconds
+    :return: True if data is available, False if the timeout was reached
+    """
+    if timeout <= 0:
+        return False
+    readable, _, _ = select.select([ser.fileno()], [], [], timeout)
+    return len(readable) > 0
+
+
+def read_serialport_bytes(ser: serial.Serial, data: bytearray, size: int, deadline: float) -> bool:
+    """
+    Read from a serial port until `data` contains `size` bytes.
+    Only the missing bytes are read, so nothing that belongs to the next frame is consumed.
+
+    :param ser: Serial port
+    :param data: Buffer to append the received bytes to
+    :param size: Number of bytes `data` should contain
+    :param deadline: Deadline as `time.monotonic()` value
+    :return: True if `data` contains `size` bytes, False if the deadline was reached
+    """
+    while len(data) < size:
+        if not wait_for_serialport_data(ser, deadline - monotonic()):
+            return False
+        # read at least one byte, this raises a SerialException, if the port reports data, but returns none
+        data += ser.read(max(1, min(ser.in_waiting, size - len(data))))
+
+    return True
+
+
 def read_serialport_data(
     ser: serial.Serial,
     command: bytearray,
@@ -689,45 +1036,35 @@ def read_serialport_data(
         elif length_size.upper() == "I" or length_size.upper() == "L":
             length_byte_size = 4
 
-        count = 0
-        toread = ser.inWaiting()
+        data = bytearray()
 
-        while toread < (length_pos + length_byte_size):
-            sleep(0.005)
-            toread = ser.inWaiting()
-            count += 1
-            if count > 50:
-                logger.error(">>> ERROR: No reply - returning")
-                return False
+        # wait for the start of the reply up to the length byte
+        if not read_serialport_bytes(ser, data, length_pos + length_byte_size, monotonic() + 0.3):
+            logger.error(">>> ERROR: No reply - returning [len:" + str(len(data)) + "]")
+            return False
 
-        # logger.info('serial data toread ' + str(toread))
-        res = ser.read(toread)
         if length_fixed is not None:
             length = length_fixed
         else:
-            if len(res) < (length_pos + length_byte_size):
-                logger.error(">>> ERROR: No reply - returning [len:" + str(len(res)) + "]")
-                return False
-            length = unpack_from(">" + length_size, res, length_pos)[0]
-
-        # logger.info('serial data length ' + str(length))
-
-        count = 0
-        data = bytearray(res)
-        while len(data) <= length + length_check:
-            res = ser.read(length + length_check)
-            data.extend(res)
-            # logger.info('serial data length ' + str(len(data)))
-            sleep(0.005)
-            count += 1
-            if count > 150:
-                logger.error(">>> ERROR: No reply - returning [len:" + str(len(data)) + "/" + str(length + length_check) + "]")
-                return False
+            length = unpack_from(">" + length_size, data, length_pos)[0]
+
+        # wait for the rest of the frame
+        deadline = monotonic() + 1.5
+        if not read_serialport_bytes(ser, data, length + length_check + 1, deadline):
+            logger.error(">>> ERROR: No reply - returning [len:" + str(len(data)) + "/" + str(length + length_check) + "]")
+            return False
+
+        # some BMS send more bytes than the length indicates, collect them until the line is idle.
+        # The idle time covers the latency timer of USB to serial adapters
+        while monotonic() < deadline and wait_for_serialport_data(ser, 0.02):
+            data += ser.read(max(1, ser.in_waiting))
 
         return data
 
     except serial.SerialException as e:
         logger.error(e)
+        # close the port, it is reopened on the next read
+        ser.close()
         return False
 
     except Exception:
@@ -763,19 +1100,21 @@ def read_serial_data(
     :param length_size: Size of the length byte, can be "B", "H", "I" or "L"
     :return: Data read from the serial port
     """
-    ser = None  # Initialize ser to None
     try:
-        with serial.Serial(port, baudrate=baud, timeout=0.1) as ser:
-            return read_serialport_data(ser, command, length_pos, length_check, length_fixed, length_size)
+        with serial_port(port, baud) as ser:
+            data = read_serialport_data(ser, command, length_pos, length_check, length_fixed, length_size)
+
+        # read_serialport_data() closes the port on a SerialException, reopen it and try once more
+        if data is False and not ser.is_open:
+            logger.error("Serial port closed, reopening it")
+            with serial_port(port, baud) as ser:
+                data = read_serialport_data(ser, command, length_pos, length_check, length_fixed, length_size)
+
+        return data
 
     except serial.SerialException as e:
         logger.error(e)
-        if ser is not None:
-            # close the serial port if it was opened
-            ser.close()
-            logger.error("Serial port closed")
-        else:
-            logger.error("Serial port could not be opened")
+        logger.error("Serial port could not be opened")
 
         return False
 
@@ -1,42 +1,251 @@
 import threading
 import asyncio
+import concurrent.futures
 import subprocess
 import sys
 from bleak import BleakClient
-from time import sleep
+from collections import deque
+from time import monotonic, sleep
 from utils import logger, BLUETOOTH_FORCE_RESET_BLE_STACK
 
 
+# Runs the bluetooth LE connections of several batteries in one process on a single event loop, so that they
+# share the adapter and the bleak connection to BlueZ. Connection attempts are serialized to prevent connection
+# storms, e.g. after a reboot. Without an instance every battery runs its own event loop like before
+class Ble_Hub:
+
+    _instance = None
+
+    # seconds to wait after a connection attempt, before the next connection attempt is started
+    CONNECT_DELAY = 1
+
+    # minimum seconds between two resets of the bluetooth stack, since a reset disconnects all batteries
+    RESET_INTERVAL = 600
+
+    def __init__(self):
+        self.loop = None
+        self.loop_ready = threading.Event()
+        # only one connection attempt at a time, created in the event loop
+        self.connect_lock = None
+        # clients that were connected, to check if a reset would disconnect other batteries
+        self.clients = set()
+        self.clients_lock = threading.Lock()
+        # only one reset at a time, several batteries can lose the connection at the same time
+        self.reset_lock = threading.Lock()
+        self.last_reset = None
+        self.thread = threading.Thread(name="BLE_Hub_Loop", target=self.run_loop, daemon=True)
+
+    @classmethod
+    def get_instance(cls) -> "Ble_Hub":
+        """
+        Get the instance of the BLE hub and start its event loop
+
+        :return: instance of the BLE hub
+        """
+        if cls._instance is None:
+            instance = cls()
+            instance.thread.start()
+            instance.loop_ready.wait()
+            cls._instance = instance
+        return cls._instance
+
+    def run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.connect_lock = asyncio.Lock()
+        self.loop_ready.set()
+        self.loop.run_forever()
+
+    @classmethod
+    def run(cls, coroutine):
+        """
+        Run the coroutine until it's finished, blocks the calling thread.
+        In hub mode the coroutine runs on the shared event loop, else on a new event loop like asyncio.run()
+
+        :param coroutine: the coroutine to run
+        :return: result of the coroutine
+        """
+        if cls._instance is None:
+            return asyncio.run(coroutine)
+        return asyncio.run_coroutine_threadsafe(coroutine, cls._instance.loop).result()
+
+    @classmethod
+    async def connect(cls, client):
+        """
+        Connect the BleakClient, in hub mode one connection attempt after the other
+
+        :param client: the BleakClient to connect
+        :return: result of BleakClient.connect()
+        """
+        if cls._instance is None:
+            return await client.connect()
+        async with cls._instance.connect_lock:
+            try:
+                result = await client.connect()
+                with cls._instance.clients_lock:
+                    cls._instance.clients.add(client)
+                return result
+            finally:
+                await asyncio.sleep(cls.CONNECT_DELAY)
+
+    @classmethod
+    def reset_bluetooth(cls) -> bool:
+        """
+        Restart the bluetooth hardware and the BlueZ driver, if enabled in the config.
+        In hub mode the reset disconnects all batteries, so it's only done if no battery is connected
+        anymore and at most once every `RESET_INTERVAL` seconds. Don't call it from the shared event loop.
+
+        :return: True if the reset was done
+        """
+        if not BLUETOOTH_FORCE_RESET_BLE_STACK:
+            return False
+
+        if cls._instance is None:
+            restart_ble_hardware_and_bluez_driver()
+            return True
+
+        hub = cls._instance
+
+        # another battery is already resetting the bluetooth stack
+        if not hub.reset_lock.acquire(blocking=False):
+            return False
+
+        try:
+            if hub.last_reset is not None and monotonic() - hub.last_reset < cls.RESET_INTERVAL:
+                logger.info(f"Bluetooth reset skipped, the last reset was {monotonic() - hub.last_reset:.0f} s ago")
+                return False
+
+            with hub.clients_lock:
+                # forget the clients that are disconnected
+                hub.clients = {client for client in hub.clients if client.is_connected}
+                connected_count = len(hub.clients)
+
+            if connected_count > 0:
+                logger.info(f"Bluetooth reset skipped, {connected_count} batteries are still connected")
+                return False
+
+            hub.last_reset = monotonic()
+            restart_ble_hardware_and_bluez_driver()
+            return True
+        finally:
+            hub.reset_lock.release()
+
+
+# Supervises a connected bluetooth LE session without polling. The session ends when bleak reports the
+# disconnect, the keep alive check fails or the main thread ended. Commands submitted from other threads
+# are run one after the other on the bluetooth event loop
+class Ble_Session_Supervisor:
+
+    # seconds between the checks, that can't be signalled with an event (main thread alive, keep alive)
+    CHECK_INTERVAL = 1
+
+    def __init__(self, main_thread):
+        self.main_thread = main_thread
+        # commands are kept across sessions, if submitted while disconnected
+        self.commands = deque()
+        self.loop = None
+        self.wakeup_event = None
+        self.disconnected = False
+
+    # has to be called from the bluetooth event loop before connecting
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup_event = asyncio.Event()
+        self.disconnected = False
+
+    # can be passed as disconnected_callback to the BleakClient
+    def disconnected_callback(self, client):
+        self.disconnected = True
+        self.wakeup()
+
+    # wakes up the supervisor to recheck the session, can be called from any thread
+    def wakeup(self):
+        loop = self.loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self.wakeup_event.set)
+        except RuntimeError:
+            # the event loop was already closed
+            pass
+
+    # queue a coroutine function that is called with the client as first argument, can be called from any thread
+    def submit(self, command, *args):
+        self.commands.append((command, args))
+        self.wakeup()
+
+    async def run(self, client, keep_alive=None):
+        """
+        Waits until the session ended and runs the submitted commands meanwhile
+
+        :param client: the connected BleakClient
+        :param keep_alive: optional function, the session ends when it returns False
+        """
+        try:
+            while True:
+                self.wakeup_event.clear()
+                if self.disconnected or not client.is_connected or not self.main_thread.is_alive():
+                    break
+                if keep_alive is not None and not keep_alive():
+                    break
+
+                if self.commands:
+                    command, args = self.commands.popleft()
+                    await command(client, *args)
+                    continue
+
+                try:
+                    await asyncio.wait_for(self.wakeup_event.wait(), timeout=self.CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.loop = None
+
+
 # Class that enables synchronous writing and reading to a bluetooh device
 class Syncron_Ble:
 
-    ble_async_thread_ready = threading.Event()
-    ble_connection_ready = threading.Event()
+    ble_async_thread_ready = None
+    ble_connection_ready = None
     ble_async_thread_event_loop = False
     client = False
+    session = None
     address = None
-    response_event = False
-    response_data = False
+    pending_responses = None
+    request_locks = None
+    response_key_callback = None
     main_thread = False
     connected = False
+    run = True
 
     write_characteristic = None
     read_characteristic = None
 
-    def __init__(self, address, read_characteristic, write_characteristic):
+    def __init__(self, address, read_characteristic, write_characteristic, response_key_callback=None):
         """
         address: the address of the bluetooth device to read and write to
         read_characteristic: the id of bluetooth LE characteristic that will send a
         notification when there is new data to read.
         write_characteristic: the id of the bluetooth LE characteristic that the class writes messages to
+        response_key_callback: optional function that returns the key (e.g. the frame type) of a received
+        notification, used to match responses to requests, if several requests are in flight
         """
 
         self.write_characteristic = write_characteristic
         self.read_characteristic = read_characteristic
         self.address = address
+        self.response_key_callback = response_key_callback
+        self.ble_async_thread_ready = threading.Event()
+        self.ble_connection_ready = threading.Event()
+        # futures of the requests waiting for a response, keyed by the response key
+        self.pending_responses = {}
+        # only one request per response key can be in flight
+        self.request_locks = {}
 
         # Start a new thread that will run bleak the async bluetooth LE library
         self.main_thread = threading.current_thread()
+        # supervises the connection and waits for the disconnect of the bluetooth device
+        self.session = Ble_Session_Supervisor(self.main_thread)
         ble_async_thread = threading.Thread(name="BMS_bluetooth_async_thread", target=self.initiate_ble_thread_main, daemon=True)
         ble_async_thread.start()
 
@@ -50,25 +259,27 @@ class Syncron_Ble:
             self.connected = True
 
     def initiate_ble_thread_main(self):
-        asyncio.run(self.async_main(self.address))
+        Ble_Hub.run(self.async_main(self.address))
 
     async def async_main(self, address):
         self.ble_async_thread_event_loop = asyncio.get_event_loop()
         self.ble_async_thread_ready.set()
 
         # try to connect over and over if the connection fails
-        while self.main_thread.is_alive():
+        while self.run and self.main_thread.is_alive():
             await self.connect_to_bms(self.address)
             await asyncio.sleep(1)  # sleep one second before trying to reconnecting
 
     def client_disconnected(self, client):
         logger.error(f"bluetooh device with address: {self.address} disconnected")
+        self.session.disconnected_callback(client)
 
     async def connect_to_bms(self, address):
+        self.session.start()
         self.client = BleakClient(address, disconnected_callback=self.client_disconnected)
         try:
             logger.info("initiating BLE connection to: " + address)
-            await self.client.connect()
+            await Ble_Hub.connect(self.client)
             logger.info("connected to bluetooh device" + address)
             await self.client.start_notify(self.read_characteristic, self.notify_read_callback)
 
@@ -77,31 +288,47 @@ class Syncron_Ble:
             return False
         finally:
             self.ble_connection_ready.set()
-            while self.client.is_connected and self.main_thread.is_alive():
-                await asyncio.sleep(0.1)
+            await self.session.run(self.client, lambda: self.run)
             await self.client.disconnect()
 
-    # saves response and tells the command sender that the response has arived
+    # stops reconnecting and disconnects from the bluetooth device
+    def stop(self):
+        self.run = False
+        self.session.wakeup()
+
+    # passes the response to the request waiting for it, runs in the bluetooth thread
     def notify_read_callback(self, sender, data: bytearray):
-        self.response_data = data
-        self.response_event.set()
-
-    async def ble_thread_send_com(self, command):
-        self.response_event = asyncio.Event()
-        self.response_data = False
-        await self.client.write_gatt_char(self.write_characteristic, command, True)
-        await asyncio.wait_for(self.response_event.wait(), timeout=1)  # Wait for the response notification
-        self.response_event = False
-        return self.response_data
-
-    async def send_coroutine_to_ble_thread_and_wait_for_result(self, coroutine):
-        bt_task = asyncio.run_coroutine_threadsafe(coroutine, self.ble_async_thread_event_loop)
-        result = await asyncio.wait_for(asyncio.wrap_future(bt_task), timeout=1.5)
-        return result
-
-    def send_data(self, data):
-        data = asyncio.run(self.send_coroutine_to_ble_thread_and_wait_for_result(self.ble_thread_send_com(data)))
-        return data
+        key = self.response_key_callback(data) if self.response_key_callback is not None else None
+
+        # requests without key accept any response
+        if key not in self.pending_responses:
+            key = None
+
+        future = self.pending_responses.get(key)
+        if future is not None and not future.done():
+            future.set_result(data)
+        else:
+            logger.debug(f"bluetooh device with address: {self.address} sent unexpected data: {data}")
+
+    async def ble_thread_send_com(self, command, response_key=None):
+        # wait until the previous request with the same key is finished
+        async with self.request_locks.setdefault(response_key, asyncio.Lock()):
+            future = self.ble_async_thread_event_loop.create_future()
+            self.pending_responses[response_key] = future
+            try:
+                await self.client.write_gatt_char(self.write_characteristic, command, True)
+                return await asyncio.wait_for(future, timeout=1)  # Wait for the response notification
+            finally:
+                del self.pending_responses[response_key]
+
+    # submits the command to the long-lived event loop of the bluetooth thread and blocks until the response arrived
+    def send_data(self, data, response_key=None):
+        bt_task = asyncio.run_coroutine_threadsafe(self.ble_thread_send_com(data, response_key), self.ble_async_thread_event_loop)
+        try:
+            return bt_task.result(timeout=1.5)
+        except concurrent.futures.TimeoutError:
+            bt_task.cancel()
+            raise
 
 
 def restart_ble_hardware_and_bluez_driver():
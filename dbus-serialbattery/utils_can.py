@@ -2,8 +2,11 @@
 import threading
 import can
 import subprocess
+import socket
+import struct
 from utils import logger
-from time import sleep, time
+from time import monotonic, sleep, time
+from typing import Tuple, Union
 
 
 class CanTransportInterface:
@@ -12,9 +15,89 @@ class CanTransportInterface:
     """
 
     can_message_cache_callback: callable = None
+    can_subscribe_callback: callable = None
+    can_unsubscribe_callback: callable = None
     can_bus = None
 
 
+class CanSubscription:
+    """
+    Class to hold the CAN frames of the arbitration IDs a driver subscribed to
+    """
+
+    def __init__(self, arbitration_ids: list, masks: list, callback: callable, timeouts: dict, receiver: "CanReceiverThread"):
+        """
+        :param arbitration_ids: list of arbitration IDs
+        :param masks: list of tuples (can_id, can_mask), a frame matches if `arbitration_id & can_mask == can_id & can_mask`
+        :param callback: function called with (arbitration_id, data, timestamp) from the receiver thread for each matching frame
+        :param timeouts: dict with the arbitration ID as key and the maximum frame age in seconds as value
+        :param receiver: the CAN receiver thread
+        """
+        self.arbitration_ids: set = set(arbitration_ids or [])
+        self.masks: list = list(masks or [])
+        self.callback: callable = callback
+        self.timeouts: dict = dict(timeouts or {})
+        """
+        Maximum age in seconds of the frames per arbitration ID, older frames are not returned by `get_message_cache()`
+        """
+        self.message_cache: dict = {}
+        """
+        Last received data of each matching arbitration ID
+        """
+        self.receiver: "CanReceiverThread" = receiver
+        self.cache_lock: threading.Lock = receiver.cache_lock
+
+    def matches(self, arbitration_id: int) -> bool:
+        """
+        Check if the arbitration ID belongs to this subscription
+
+        :param arbitration_id: arbitration ID of the CAN frame
+        :return: True if the frame matches, False otherwise
+        """
+        if arbitration_id in self.arbitration_ids:
+            return True
+        for can_id, can_mask in self.masks:
+            if arbitration_id & can_mask == can_id & can_mask:
+                return True
+        return False
+
+    def get_message_cache(self) -> dict:
+        """
+        Get the current cache of the subscribed CAN messages
+
+        :return: dict of received CAN messages
+        """
+        with self.cache_lock:
+            if not self.timeouts:
+                return dict(self.message_cache)
+
+            # skip stale frames
+            now = monotonic()
+            return {
+                arb_id: data
+                for arb_id, data in self.message_cache.items()
+                if arb_id not in self.timeouts or now - self.receiver.get_frame_time(arb_id, now) <= self.timeouts[arb_id]
+            }
+
+    def get_frame_age(self, arbitration_id: int) -> Union[float, None]:
+        """
+        Get the age of the last received frame of an arbitration ID
+
+        :param arbitration_id: arbitration ID of the CAN frame
+        :return: age in seconds or None, if no frame is cached
+        """
+        return self.receiver.get_frame_age(arbitration_id)
+
+    def get_frame_rate(self, arbitration_id: int) -> Union[float, None]:
+        """
+        Get the receive rate of an arbitration ID
+
+        :param arbitration_id: arbitration ID of the CAN frame
+        :return: frames per second or None, if not enough frames were received
+        """
+        return self.receiver.get_frame_rate(arbitration_id)
+
+
 class CanReceiverThread(threading.Thread):
     """
     Class to receive CAN messages on a separate thread
@@ -31,18 +114,24 @@ class CanReceiverThread(threading.Thread):
         super().__init__(name=f"CanReceiverThread-{channel}")
         self.channel = channel
         self.bustype = bustype
-        self._current_time = int(time())
+        self._current_time = monotonic()
         self.message_cache = {}  # cache can frames here
         self.cache_lock = threading.Lock()  # lock for thread safety
-        self._last_received_time = {}  # track last received time for each arbitration ID
+        self._last_received_time = {}  # track last received time (monotonic) for each arbitration ID
+        self._receive_interval = {}  # smoothed receive interval in seconds for each arbitration ID
         self._last_cache_clean_time = 0  # last time the cached was cleaned (deleted too old values)
+        self._subscriptions = []  # subscriptions of the drivers
+        self._subscribers = {}  # matching subscriptions for each received arbitration ID
+        self._filters_enabled = False  # set kernel filters from the subscriptions, enabled after the battery detection
+        self.frames_received = 0  # number of received frames, used for the bitrate detection
+        self.receive_cycles = 0  # number of receive calls without error, used to detect when the receiving resumed
         CanReceiverThread._instances[(channel, bustype)] = self
         self.daemon = True
         self._running = True  # flag to control the running state
         self.can_bus = None
         self.can_initialised = threading.Event()
         self._link_status_cache = {"timestamp": 0, "result": None}
-        self.initial_interface_state = self.get_link_status()
+        self.initial_interface_state = self.get_interface_up(channel)
 
     @classmethod
     def get_instance(cls, channel, bustype) -> "CanReceiverThread":
@@ -76,20 +165,38 @@ class CanReceiverThread(threading.Thread):
 
         # timestamp of last received message
         last_message_time_stamp = 0
+        last_link_status = None
         self.can_initialised.set()
 
         while self._running:
-            self._current_time = int(time())
+            self._current_time = monotonic()
 
             link_status = self.get_link_status()
             self.clear_old_cache_entries()
 
+            # clear the cache once the link goes down, so the drivers notice the bus loss immediately
+            if link_status != last_link_status:
+                if link_status:
+                    logger.info(f"CAN Bus {self.channel} link is up")
+                elif last_link_status is not None:
+                    logger.error(f">>> ERROR: CAN Bus {self.channel} link went down")
+                    self.clear_cache()
+                last_link_status = link_status
+
             if link_status:
                 try:
                     message = self.can_bus.recv(timeout=1.0)  # wait for max 1 second to receive message
+                    self.receive_cycles += 1
 
                     if message is not None:
-                        last_message_time_stamp = self._current_time
+                        self.frames_received += 1
+
+                        # use the socket timestamp of the frame, converted to monotonic time, so that the time waiting in the
+                        # socket buffer is not lost
+                        last_message_time_stamp = monotonic()
+                        if message.timestamp:
+                            last_message_time_stamp -= min(max(time() - message.timestamp, 0), 1)
+
                         with self.cache_lock:
 
                             # daly hack: cell voltage messages are sent with same id, so use frame id additionally as offset for cmd byte
@@ -100,25 +207,41 @@ class CanReceiverThread(threading.Thread):
 
                             # cache data with arbitration id as key
                             self.message_cache[message.arbitration_id] = message.data
-                            self._last_received_time[message.arbitration_id] = last_message_time_stamp  # update last received time
+
+                            # update the receive interval and the last received time
+                            if message.arbitration_id in self._last_received_time:
+                                interval = last_message_time_stamp - self._last_received_time[message.arbitration_id]
+                                if message.arbitration_id in self._receive_interval:
+                                    self._receive_interval[message.arbitration_id] += 0.1 * (interval - self._receive_interval[message.arbitration_id])
+                                else:
+                                    self._receive_interval[message.arbitration_id] = interval
+                            self._last_received_time[message.arbitration_id] = last_message_time_stamp
+
+                            # dispatch the frame to the subscriptions of this arbitration id
+                            subscribers = self.get_subscribers(message.arbitration_id)
+                            for subscription in subscribers:
+                                subscription.message_cache[message.arbitration_id] = message.data
+
+                        for subscription in subscribers:
+                            if subscription.callback is not None:
+                                try:
+                                    subscription.callback(message.arbitration_id, message.data, last_message_time_stamp)
+                                except Exception as e:
+                                    logger.error(f"[{self.channel}] Error in callback for arbitration ID {hex(message.arbitration_id)}: {e}")
 
                         logger.debug(f"[{self.channel}] Received: ID={hex(message.arbitration_id)}, Daten={message.data}")
 
                 except can.exceptions.CanOperationError as e:
                     logger.debug(f"CAN Bus {self.channel}: {e}")
-                    self.message_cache = {}
-                    self._last_received_time = {}
+                    self.clear_cache()
                     sleep(1)
             else:
-                logger.error(">>> ERROR: CAN Bus interface is down")
-                self.message_cache = {}
-                self._last_received_time = {}
+                logger.debug(f"CAN Bus {self.channel} interface is down")
                 sleep(1)
 
             if self._current_time - last_message_time_stamp > 2 and self.message_cache:
                 logger.debug(f"CAN Bus {self.channel} has not received any messages in the last 2 seconds")
-                self.message_cache = {}
-                self._last_received_time = {}
+                self.clear_cache()
                 sleep(2)
 
         self.stop()
@@ -142,6 +265,9 @@ class CanReceiverThread(threading.Thread):
                 if self._current_time - self._last_received_time[arb_id] > 5:
                     del self.message_cache[arb_id]
                     del self._last_received_time[arb_id]
+                    self._receive_interval.pop(arb_id, None)
+                    for subscription in self._subscribers.get(arb_id, []):
+                        subscription.message_cache.pop(arb_id, None)
                     logger.debug(f"[{self.channel}] Cleared cache for arbitration ID {hex(arb_id)} due to timeout")
 
     def stop(self) -> None:
@@ -173,11 +299,158 @@ class CanReceiverThread(threading.Thread):
             # return a copy of the current cache
             return dict(self.message_cache)
 
+    def clear_cache(self) -> None:
+        """
+        Clear the cache of all received CAN messages, including the caches of the subscriptions
+
+        :return: None
+        """
+        with self.cache_lock:
+            self.message_cache = {}
+            self._last_received_time = {}
+            self._receive_interval = {}
+            for subscription in self._subscriptions:
+                subscription.message_cache = {}
+
+    def subscribe(self, arbitration_ids: list = None, masks: list = None, callback: callable = None, timeouts: dict = None) -> CanSubscription:
+        """
+        Subscribe to the CAN frames of the given arbitration IDs and masks. Only matching frames are stored in the
+        cache of the subscription, so a driver does not have to go through the frames of all other devices on the bus.
+
+        :param arbitration_ids: list of arbitration IDs
+        :param masks: list of tuples (can_id, can_mask), a frame matches if `arbitration_id & can_mask == can_id & can_mask`
+        :param callback: optional function called with (arbitration_id, data, timestamp) from the receiver thread for each matching frame,
+            the timestamp is the monotonic receive time
+        :param timeouts: optional dict with the arbitration ID as key and the maximum frame age in seconds as value
+        :return: the subscription
+        """
+        subscription = CanSubscription(arbitration_ids, masks, callback, timeouts, self)
+
+        with self.cache_lock:
+            self._subscriptions.append(subscription)
+            # add the subscription to the already known arbitration IDs
+            # the lists are replaced and not changed, since the receiver thread iterates over them without lock
+            for arb_id in list(self._subscribers.keys()):
+                if subscription.matches(arb_id):
+                    self._subscribers[arb_id] = self._subscribers[arb_id] + [subscription]
+
+            # fill the cache with the frames received before the subscription
+            for arb_id, data in self.message_cache.items():
+                if subscription.matches(arb_id):
+                    subscription.message_cache[arb_id] = data
+
+        self.update_filters()
+
+        return subscription
+
+    def unsubscribe(self, subscription: CanSubscription) -> None:
+        """
+        Remove a subscription
+
+        :param subscription: the subscription to remove
+        :return: None
+        """
+        with self.cache_lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+            for arb_id in list(self._subscribers.keys()):
+                if subscription in self._subscribers[arb_id]:
+                    self._subscribers[arb_id] = [subscriber for subscriber in self._subscribers[arb_id] if subscriber is not subscription]
+
+        self.update_filters()
+
+    def get_frame_time(self, arbitration_id: int, default: float = None) -> Union[float, None]:
+        """
+        Get the monotonic receive time of the last frame of an arbitration ID
+
+        :param arbitration_id: arbitration ID of the CAN frame
+        :param default: value returned, if no frame is cached
+        :return: receive time in seconds
+        """
+        return self._last_received_time.get(arbitration_id, default)
+
+    def get_frame_age(self, arbitration_id: int) -> Union[float, None]:
+        """
+        Get the age of the last received frame of an arbitration ID
+
+        :param arbitration_id: arbitration ID of the CAN frame
+        :return: age in seconds or None, if no frame is cached
+        """
+        frame_time = self.get_frame_time(arbitration_id)
+        return monotonic() - frame_time if frame_time is not None else None
+
+    def get_frame_rate(self, arbitration_id: int) -> Union[float, None]:
+        """
+        Get the smoothed receive rate of an arbitration ID
+
+        :param arbitration_id: arbitration ID of the CAN frame
+        :return: frames per second or None, if not enough frames were received
+        """
+        interval = self._receive_interval.get(arbitration_id)
+        return 1 / interval if interval else None
+
+    def enable_filters(self) -> None:
+        """
+        Let the kernel filter the received CAN frames by the arbitration IDs and masks of the subscriptions.
+        Call this after the battery detection, else the frames of the not yet subscribed battery types are dropped.
+
+        :return: None
+        """
+        self._filters_enabled = True
+        self.update_filters()
+
+    def get_filters(self) -> Union[list, None]:
+        """
+        Get the SocketCAN filters for all subscriptions
+
+        :return: list of filters or None to receive all frames
+        """
+        filters = []
+        with self.cache_lock:
+            for subscription in self._subscriptions:
+                # a subscription without arbitration IDs and masks would get no frames, so do not filter at all
+                if not subscription.arbitration_ids and not subscription.masks:
+                    return None
+                filters += [{"can_id": arb_id, "can_mask": 0x1FFFFFFF} for arb_id in sorted(subscription.arbitration_ids)]
+                filters += [{"can_id": can_id & can_mask, "can_mask": can_mask} for can_id, can_mask in subscription.masks]
+
+        return filters if len(filters) > 0 else None
+
+    def update_filters(self) -> None:
+        """
+        Update the SocketCAN filters of the CAN bus, if the filters are enabled
+
+        :return: None
+        """
+        if not self._filters_enabled or self.can_bus is None:
+            return
+
+        filters = self.get_filters()
+        try:
+            self.can_bus.set_filters(filters)
+            logger.debug(f"[{self.channel}] Set CAN filters: {filters}")
+        except Exception as e:
+            logger.error(f"[{self.channel}] Error setting CAN filters: {e}")
+
+    def get_subscribers(self, arbitration_id: int) -> list:
+        """
+        Get the subscriptions matching the arbitration ID. The result is cached for each arbitration ID,
+        so the masks are only checked once. Must be called with `cache_lock` held.
+
+        :param arbitration_id: arbitration ID of the CAN frame
+        :return: list of matching subscriptions
+        """
+        subscribers = self._subscribers.get(arbitration_id)
+        if subscribers is None:
+            subscribers = [subscription for subscription in self._subscriptions if subscription.matches(arbitration_id)]
+            self._subscribers[arbitration_id] = subscribers
+        return subscribers
+
     def get_link_status(self) -> bool:
         """
-        Check if the CAN interface is up. Cache the result for 1 second.
+        Check if the CAN interface is up and has a carrier. Cache the result for 1 second.
+        The state is read from sysfs, which is much cheaper than running `ip link show`.
 
-        :param channel: CAN interface name
         :return: True if interface is up, False otherwise
         """
 
@@ -185,8 +458,13 @@ class CanReceiverThread(threading.Thread):
         if self._link_status_cache["timestamp"] + 1 > self._current_time:
             return self._link_status_cache["result"]
 
-        result = subprocess.run(["ip", "link", "show", self.channel], capture_output=True, text=True, check=True)
-        status = "UP" in result.stdout
+        try:
+            # operstate is "down", if the CAN controller lost the carrier, e.g. on bus-off
+            with open(f"/sys/class/net/{self.channel}/operstate") as file:
+                status = self.get_interface_up(self.channel) and file.read().strip() != "down"
+        except OSError as e:
+            logger.debug(f"CAN Bus {self.channel}: {e}")
+            status = False
 
         # Update the cache
         self._link_status_cache["timestamp"] = self._current_time
@@ -194,6 +472,19 @@ class CanReceiverThread(threading.Thread):
 
         return status
 
+    @staticmethod
+    def get_interface_up(channel: str) -> bool:
+        """
+        Check if the CAN interface was brought up, like the "UP" flag of `ip link show`
+
+        :param channel: CAN interface name
+        :return: True if interface is up, False otherwise
+        :raises OSError: if the interface does not exist
+        """
+        with open(f"/sys/class/net/{channel}/flags") as file:
+            # IFF_UP
+            return int(file.read().strip(), 16) & 0x1 != 0
+
     @staticmethod
     def get_bitrate(channel: str) -> int:
         """
@@ -205,41 +496,205 @@ class CanReceiverThread(threading.Thread):
         if channel.startswith("vcan"):
             return 250000
         try:
-            result = subprocess.run(["ip", "-details", "link", "show", channel], capture_output=True, text=True, check=True)
-            for line in result.stdout.split("\n"):
-                if "bitrate" in line:
-                    return int(line.split("bitrate")[1].split()[0])
+            # request the link info of the interface with rtnetlink instead of parsing `ip -details link show`
+            with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE) as sock:
+                sock.settimeout(1)
+                # nlmsghdr (RTM_GETLINK, NLM_F_REQUEST) + ifinfomsg with the interface index
+                sock.send(struct.pack("=IHHII", 32, 18, 1, 1, 0) + struct.pack("=BxHiII", socket.AF_UNSPEC, 0, socket.if_nametoindex(channel), 0, 0))
+                data = sock.recv(65536)
+
+            length, message_type = struct.unpack_from("=IH", data)
+            if message_type != 16:  # RTM_NEWLINK
+                raise Exception(f"Unexpected netlink message type {message_type}")
+
+            # IFLA_LINKINFO -> IFLA_INFO_DATA -> IFLA_CAN_BITTIMING, the bitrate is the first value of struct can_bittiming
+            link_info = CanReceiverThread.get_netlink_attribute(data[32:length], 18)
+            info_data = CanReceiverThread.get_netlink_attribute(link_info, 2) if link_info is not None else None
+            bittiming = CanReceiverThread.get_netlink_attribute(info_data, 1) if info_data is not None else None
+            if bittiming is not None:
+                return struct.unpack_from("=I", bittiming)[0]
         except Exception as e:
             logger.error(f"Error fetching bitrate: {e}")
             raise
 
+    def detect_bitrate(self, bitrates: tuple = (250, 500), listen_time: float = 1) -> Union[int, None]:
+        """
+        Detect the bitrate of the CAN bus passively, if no battery answered with the current bitrate.
+        First the bus is observed with the current configuration. If it receives bus errors instead of valid frames,
+        the interface is switched to listen-only mode for each bitrate, so that it does not send
+        acknowledges or error frames, which would disturb the other devices on the bus.
+        A quiet bus has nothing to detect, so the interface is not reset then.
+
+        :param bitrates: bitrates in kbps to try
+        :param listen_time: time in seconds to listen for each bitrate
+        :return: detected bitrate in kbps or None, if no bitrate received valid frames
+        """
+        # vcan doesn't support bitrate
+        if self.channel.startswith("vcan"):
+            return None
+
+        try:
+            current_bitrate = self.get_bitrate(self.channel) // 1000
+        except Exception:
+            current_bitrate = None
+
+        if current_bitrate is not None:
+            frames_received, rx_errors = self.listen_for_frames(listen_time)
+
+            if self.frames_valid(frames_received, rx_errors):
+                logger.info(f"CAN Bus {self.channel} receives valid frames with {current_bitrate} kbps")
+                return current_bitrate
+
+            # e.g. request/response BMS are quiet until polled
+            if frames_received == 0 and rx_errors == 0:
+                logger.info(f"CAN Bus {self.channel} is quiet with {current_bitrate} kbps, bitrate detection skipped")
+                return None
+
+        # the interface configuration was changed and has to be restored, if no bitrate is detected
+        interface_changed = False
+
+        for bitrate in bitrates:
+            if bitrate == current_bitrate:
+                continue
+
+            try:
+                interface_changed = True
+                self.setup_can(channel=self.channel, bitrate=bitrate, force=True, listen_only=True)
+            except Exception:
+                # listen-only mode is not supported, do not disturb the bus with the normal mode
+                logger.info(f"CAN Bus {self.channel} does not support listen-only mode, bitrate detection skipped")
+                break
+
+            # the receiver pauses after the interface was reset, so start listening after it resumed
+            if not self.wait_for_receiver():
+                logger.warning(f"CAN Bus {self.channel} receiver did not resume with {bitrate} kbps")
+                continue
+
+            if self.frames_valid(*self.listen_for_frames(listen_time)):
+                logger.info(f"CAN Bus {self.channel} receives valid frames with {bitrate} kbps")
+                try:
+                    self.setup_can(channel=self.channel, bitrate=bitrate, force=True, listen_only=False)
+                    return bitrate
+                except Exception:
+                    logger.error(f"CAN Bus {self.channel} could not be set up with the detected bitrate {bitrate} kbps")
+                    break
+
+        # restore a working configuration, the previous bitrate or the first bitrate to try
+        if interface_changed:
+            restore_bitrate = current_bitrate if current_bitrate is not None else bitrates[0]
+            try:
+                self.setup_can(channel=self.channel, bitrate=restore_bitrate, force=True, listen_only=False)
+            except Exception:
+                logger.error(f"CAN Bus {self.channel} could not be restored with {restore_bitrate} kbps")
+
+        logger.info(f"CAN Bus {self.channel} received no valid frames, bitrate detection failed")
+        return None
+
+    def wait_for_receiver(self, timeout: float = 5) -> bool:
+        """
+        Wait until the receiver thread is receiving again after the interface was reset.
+        The receive call that was running during the reset is not counted, since it may have been started before.
+
+        :param timeout: maximum time in seconds to wait
+        :return: True if the receiver resumed within the timeout
+        """
+        receive_cycles = self.receive_cycles
+        end_time = monotonic() + timeout
+
+        while monotonic() < end_time:
+            if self.receive_cycles >= receive_cycles + 2:
+                return True
+            sleep(0.1)
+
+        return False
+
+    def listen_for_frames(self, listen_time: float) -> Tuple[int, int]:
+        """
+        Listen to the CAN bus and count the valid frames and the bus errors.
+
+        :param listen_time: time in seconds to listen
+        :return: number of received frames and number of receive errors
+        """
+        frames_received = self.frames_received
+        rx_errors = self.get_rx_errors(self.channel)
+
+        sleep(listen_time)
+
+        frames_received = self.frames_received - frames_received
+        rx_errors = self.get_rx_errors(self.channel) - rx_errors
+        logger.debug(f"CAN Bus {self.channel}: {frames_received} frames and {rx_errors} errors received in {listen_time} s")
+
+        return frames_received, rx_errors
+
+    @staticmethod
+    def frames_valid(frames_received: int, rx_errors: int) -> bool:
+        """
+        Check if the bitrate is correct, based on the received frames and errors.
+
+        :param frames_received: number of received frames
+        :param rx_errors: number of receive errors
+        :return: True if more valid frames than errors are received
+        """
+        return frames_received > 0 and frames_received > rx_errors
+
     @staticmethod
-    def setup_can(channel: str, bitrate: int = 250, force: bool = False) -> None:
+    def get_rx_errors(channel: str) -> int:
+        """
+        Get the receive error counter of the CAN interface
+
+        :param channel: CAN interface name
+        :return: number of receive errors
+        """
+        try:
+            with open(f"/sys/class/net/{channel}/statistics/rx_errors") as file:
+                return int(file.read().strip())
+        except (OSError, ValueError):
+            return 0
+
+    @staticmethod
+    def get_netlink_attribute(data: bytes, attribute_type: int) -> Union[bytes, None]:
+        """
+        Get the payload of a netlink attribute
+
+        :param data: netlink attributes
+        :param attribute_type: type of the attribute to find
+        :return: payload of the attribute or None, if not found
+        """
+        offset = 0
+        while offset + 4 <= len(data):
+            length, rta_type = struct.unpack_from("=HH", data, offset)
+            if length < 4:
+                break
+            # mask out NLA_F_NESTED and NLA_F_NET_BYTEORDER
+            if rta_type & 0x3FFF == attribute_type:
+                return data[offset + 4 : offset + length]
+            # attributes are aligned to 4 bytes
+            offset += (length + 3) & ~3
+        return None
+
+    @staticmethod
+    def setup_can(channel: str, bitrate: int = 250, force: bool = False, listen_only: bool = None) -> None:
         """
         Bring up the CAN interface
 
         :param channel: CAN interface name
         :param bitrate: bitrate in kbps, default is 250 kbps
         :param force: force to bring up/reset the interface, default is False
+        :param listen_only: enable or disable the listen-only mode, None to leave it unchanged
         """
         try:
             # check if CAN interface exists and is down
-            result = subprocess.run(["ip", "link", "show", f"{channel}"], capture_output=True, text=True, check=True)
-
-            if not force and "DOWN" not in result.stdout:
+            if not force and CanReceiverThread.get_interface_up(channel):
                 logger.debug(f"Interface {channel} is already up")
                 return True
 
-            if result.returncode != 0:
-                logger.error(result.stderr)
-                return False
-
             # bring down the interface
             subprocess.run(["ip", "link", "set", f"{channel}", "down"], capture_output=True, text=True, check=True)
 
             # bring up the interface with the given bitrate
             result = subprocess.run(
-                ["ip", "link", "set", f"{channel}", "type", "can", "bitrate", f"{bitrate * 1000}"],
+                ["ip", "link", "set", f"{channel}", "type", "can", "bitrate", f"{bitrate * 1000}"]
+                + (["listen-only", "on" if listen_only else "off"] if listen_only is not None else []),
                 capture_output=True,
                 text=True,
                 check=True,
@@ -249,7 +704,7 @@ class CanReceiverThread(threading.Thread):
             result = subprocess.run(["ip", "link", "set", f"{channel}", "up"], capture_output=True, text=True, check=True)
             result.check_returncode()
 
-            logger.info(f"CAN Bus {channel} is up with bitrate {bitrate} kbps")
+            logger.info(f"CAN Bus {channel} is up with bitrate {bitrate} kbps" + (" in listen-only mode" if listen_only else ""))
 
         except Exception as e:
             logger.error(f"Error bringing up {channel}: {e}")